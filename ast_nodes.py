@@ -1,51 +1,90 @@
+# Nodes have fixed attributes, to keep large programs small. Besides those
+# set by their constructors, the parser gives statements the `line` and
+# `column` they start at, and passes over the tree add `type` (inference),
+# and `scope`, `slot` and a function's `slots` (the resolver) to the nodes
+# that need them.
 class ASTNode:
-    pass
+    __slots__ = ("type", "line", "column")
 
 
 class Number(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = float(value)
 
 
+# A value computed ahead of time by the optimizer
+class Constant(ASTNode):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
 class String(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
 
 class BinOp(ASTNode):
+    __slots__ = ("left", "op", "right")
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
 
 
 class UnaryOp(ASTNode):
+    __slots__ = ("op", "expr")
+
     def __init__(self, op, expr):
-        self.token = self.op = op
+        self.op = op
         self.expr = expr
 
 
 class Variable(ASTNode):
+    __slots__ = ("name", "scope", "slot")
+
     def __init__(self, name):
         self.name = name
 
 
 class Assign(ASTNode):
+    __slots__ = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
 
+# `x op= value`, or `x[i] op= value` when left is a Subscript
+class AugAssign(ASTNode):
+    __slots__ = ("left", "op", "right")
+
+    def __init__(self, left, op, right):
+        self.left = left
+        self.op = op
+        self.right = right
+
+
 class Compound(ASTNode):
+    __slots__ = ("children",)
+
     def __init__(self):
         self.children = []
 
 
 class NoOp(ASTNode):
-    pass
+    __slots__ = ()
 
 
 class If(ASTNode):
+    __slots__ = ("condition", "true_block", "false_block")
+
     def __init__(self, condition, true_block, false_block=None):
         self.condition = condition
         self.true_block = true_block
@@ -53,53 +92,91 @@ class If(ASTNode):
 
 
 class While(ASTNode):
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
 
 
 class For(ASTNode):
+    __slots__ = ("var", "iterable", "body", "scope", "slot")
+
     def __init__(self, var, iterable, body):
         self.var = var
         self.iterable = iterable
         self.body = body
 
 
+# `memo def` sets memo: calls then reuse the results of earlier calls
 class FunctionDef(ASTNode):
-    def __init__(self, name, params, body):
+    __slots__ = ("name", "params", "body", "memo", "slots", "scope", "slot")
+
+    def __init__(self, name, params, body, memo=False):
         self.name = name
         self.params = params
         self.body = body
+        self.memo = memo
 
 
 class FunctionCall(ASTNode):
+    __slots__ = ("name", "args", "scope", "slot")
+
     def __init__(self, name, args):
         self.name = name
         self.args = args
 
 
 class ListLiteral(ASTNode):
+    __slots__ = ("elements",)
+
     def __init__(self, elements):
         self.elements = elements
 
 
 class SetLiteral(ASTNode):
+    __slots__ = ("elements",)
+
     def __init__(self, elements):
         self.elements = elements
 
 
 class Subscript(ASTNode):
+    __slots__ = ("var", "index")
+
     def __init__(self, var, index):
         self.var = var
         self.index = index
 
 
 class Slice(ASTNode):
+    __slots__ = ("start", "end")
+
     def __init__(self, start, end):
         self.start = start
         self.end = end
 
 
+# A pure expression whose value is cached in a hidden variable; the
+# optimizer resets the variable to None wherever the cache must be dropped
+class Hoisted(ASTNode):
+    __slots__ = ("name", "expr", "scope", "slot")
+
+    def __init__(self, name, expr):
+        self.name = name
+        self.expr = expr
+
+
 class Return(ASTNode):
+    __slots__ = ("expr",)
+
     def __init__(self, expr):
         self.expr = expr
+
+
+def copy_position(node, source):
+    """Gives `node` the source position of `source`, if it has one."""
+    if hasattr(source, "line"):
+        node.line = source.line
+        node.column = source.column
+    return node
@@ -0,0 +1,114 @@
+"""
+An on-disk cache of parsed programs, so that running an unchanged script
+skips tokenizing and parsing. Like codegen's compiled programs, the syntax
+tree of `dir/name.mpy` is kept in `dir/__mpycache__/name.ast`, marked with
+a hash of the source it came from.
+"""
+from ast_nodes import *
+from lexer import Token, tokenize
+from parser import Parser
+import hashlib
+import marshal
+import os
+
+# Bump whenever the parser output or the node classes change shape
+AST_VERSION = 2
+CACHE_MAGIC = b"MPYA" + bytes([AST_VERSION])
+# Shared with codegen, which is not imported here because it loads matplotlib
+CACHE_DIR = "__mpycache__"
+
+# The constructor arguments of every node the parser creates, in order. A
+# node is stored as a tuple of its class index, its line and column (None
+# unless it is a statement) and these fields.
+NODE_FIELDS = [
+    (Number, ("value",)),
+    (String, ("value",)),
+    (BinOp, ("left", "op", "right")),
+    (UnaryOp, ("op", "expr")),
+    (Variable, ("name",)),
+    (Assign, ("left", "right")),
+    (AugAssign, ("left", "op", "right")),
+    (If, ("condition", "true_block", "false_block")),
+    (While, ("condition", "body")),
+    (For, ("var", "iterable", "body")),
+    (FunctionDef, ("name", "params", "body", "memo")),
+    (FunctionCall, ("name", "args")),
+    (ListLiteral, ("elements",)),
+    (SetLiteral, ("elements",)),
+    (Subscript, ("var", "index")),
+    (Slice, ("start", "end")),
+    (Return, ("expr",)),
+    (NoOp, ()),
+]
+NODE_INDEX = {cls: index for index, (cls, _) in enumerate(NODE_FIELDS)}
+TOKEN_INDEX = len(NODE_FIELDS)
+
+
+def encode(value):
+    """`value` as nested tuples, lists and constants that marshal can store."""
+    if isinstance(value, ASTNode):
+        cls = type(value)
+        index = NODE_INDEX.get(cls)
+        if index is None:
+            raise TypeError(f"Cannot cache a {cls.__name__} node")
+        fields = NODE_FIELDS[index][1]
+        position = (getattr(value, "line", None), getattr(value, "column", None))
+        return (index,) + position + tuple(
+            encode(getattr(value, field)) for field in fields
+        )
+    if isinstance(value, Token):
+        return (TOKEN_INDEX, value.type, value.value, value.line, value.column)
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    """The nodes and tokens that `encode` turned into `value`."""
+    if type(value) is tuple:
+        index = value[0]
+        if index == TOKEN_INDEX:
+            return Token(*value[1:])
+        node = NODE_FIELDS[index][0](*[decode(field) for field in value[3:]])
+        if value[1] is not None:
+            node.line = value[1]
+            node.column = value[2]
+        return node
+    if type(value) is list:
+        return [decode(item) for item in value]
+    return value
+
+
+def cache_path(filename):
+    directory, base = os.path.split(os.path.abspath(filename))
+    stem = os.path.splitext(base)[0]
+    return os.path.join(directory, CACHE_DIR, f"{stem}.ast")
+
+
+def load_cached(filename, source):
+    """
+    Returns the parsed program for `source`, reusing the on-disk cache next
+    to `filename` when its source hash matches and writing it otherwise.
+    """
+    header = CACHE_MAGIC + hashlib.sha256(source.encode()).digest()
+    path = cache_path(filename)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[: len(header)] == header:
+            return decode(marshal.loads(data[len(header) :]))
+    except (OSError, ValueError, EOFError, TypeError, IndexError):
+        pass
+
+    nodes = Parser(tokenize(source)).parse()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Each writer renames its own file into place, so a reader sees
+        # either the old cache or a complete new one
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header + marshal.dumps(encode(nodes)))
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError):
+        pass
+    return nodes
@@ -0,0 +1,121 @@
+"""
+Runs many scripts in one invocation of main.py, on a pool of worker
+processes. Each worker imports the interpreter once and keeps one warm
+Interpreter, which it resets between scripts. The output of every script
+is captured, and main.py writes it in the order the scripts were given.
+"""
+import glob
+import io
+import os
+import time
+
+from interpreter import Interpreter, ReturnException
+from lexer import tokenize
+from parser import Parser
+from inference import infer
+import astcache
+import optimizer
+
+# The interpreter of this worker process, made by start_worker
+worker_interpreter = None
+
+
+class Result:
+    """How one script of a batch went."""
+
+    def __init__(self, filename, output, seconds, error=None):
+        self.filename = filename
+        self.output = output
+        self.seconds = seconds
+        self.error = error  # None if the script ran to the end
+
+    def __str__(self):
+        status = f"failed: {self.error}" if self.error else "ok"
+        return f"{self.seconds:8.3f} s  {self.filename}  {status}"
+
+
+def expand(patterns):
+    """
+    The scripts named by `patterns`: files, directories, searched for .mpy
+    files recursively, and glob patterns, in order and without duplicates.
+    """
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = glob.glob(os.path.join(pattern, "**", "*.mpy"), recursive=True)
+        elif glob.has_magic(pattern):
+            found = glob.glob(pattern, recursive=True)
+        else:
+            found = [pattern]
+        filenames.extend(sorted(found))
+    return list(dict.fromkeys(filenames))
+
+
+def start_worker(args):
+    global worker_interpreter
+    worker_interpreter = Interpreter(
+        engine=args.engine, memo_capacity=args.memo_capacity
+    )
+
+
+def run_script(filename, args, interpreter=None):
+    """
+    Runs one script with main.py's options `args`, on `interpreter` or the
+    worker's interpreter, and returns its Result.
+    """
+    interpreter = interpreter or worker_interpreter
+    interpreter.reset()
+    output = io.StringIO()
+    interpreter.output_stream = output
+    start = time.perf_counter()
+    error = None
+    try:
+        if not filename.endswith(".mpy"):
+            raise Exception("File must have a .mpy extension")
+        with open(filename, "r") as f:
+            code = f.read()
+        if args.cache:
+            ast = astcache.load_cached(filename, code)
+        else:
+            ast = Parser(tokenize(code)).parse()
+        if args.optimize:
+            ast = optimizer.optimize(ast)
+        errors = infer(ast) if args.check else []
+        for shape_error in errors:
+            print(f"Shape error: {shape_error}", file=output)
+        if errors:
+            error = f"{len(errors)} shape errors"
+        else:
+            interpreter.interpret(ast)
+    except ReturnException:
+        pass
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        interpreter.output_stream = None
+    return Result(filename, output.getvalue(), time.perf_counter() - start, error)
+
+
+def run_task(task):
+    filename, args = task
+    return run_script(filename, args)
+
+
+def run_scripts(filenames, args, jobs=None):
+    """
+    Runs `filenames` on `jobs` worker processes (one per CPU by default),
+    yielding their Results in the order of `filenames`. One job runs the
+    scripts in this process.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        interpreter = Interpreter(engine=args.engine, memo_capacity=args.memo_capacity)
+        for filename in filenames:
+            yield run_script(filename, args, interpreter)
+        return
+    # Imported here, so that running a single script does not pay for it
+    import multiprocessing
+
+    with multiprocessing.Pool(min(jobs, len(filenames)), start_worker, (args,)) as pool:
+        tasks = [(filename, args) for filename in filenames]
+        yield from pool.imap(run_task, tasks)
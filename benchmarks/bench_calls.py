@@ -0,0 +1,57 @@
+"""
+Measures call throughput for small numeric helper functions, the pattern
+that stresses the user-function call path (argument binding, frame setup and
+returning a value).
+
+Usage: python3 benchmarks/bench_calls.py [calls]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import tokenize
+from parser import Parser
+from interpreter import Interpreter
+
+PROGRAM = """
+def square(x):
+    return x * x
+end
+
+def hypot2(a, b):
+    return square(a) + square(b)
+end
+
+total = 0
+i = 0
+while i < {iterations}:
+    total = total + hypot2(i, 2)
+    i = i + 1
+end
+"""
+
+# Each loop iteration makes three user-function calls
+CALLS_PER_ITERATION = 3
+
+
+def run(engine, ast):
+    interpreter = Interpreter(engine=engine)
+    start = time.perf_counter()
+    interpreter.interpret(ast)
+    return time.perf_counter() - start
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    iterations = calls // CALLS_PER_ITERATION
+    ast = Parser(tokenize(PROGRAM.format(iterations=iterations))).parse()
+    for engine in Interpreter.ENGINES:
+        elapsed = run(engine, ast)
+        rate = iterations * CALLS_PER_ITERATION / elapsed
+        print(f"{engine:>8}: {elapsed:8.3f}s  {rate:12,.0f} calls/s")
+
+
+if __name__ == "__main__":
+    main()
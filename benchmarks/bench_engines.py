@@ -0,0 +1,60 @@
+"""
+Times the scaled-up factorial loop from examples/factorial.mpy under each
+execution engine, relative to the tree engine without tiering.
+
+Usage: python3 benchmarks/bench_engines.py [iterations]
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import tokenize
+from parser import Parser
+from interpreter import Interpreter
+
+PROGRAM = """
+def factorial(n):
+    result = 1
+    while n > 1:
+        result = result * n
+        n = n - 1
+    end
+    return result
+end
+
+total = 0
+i = 0
+while i < {iterations}:
+    total = total + factorial(20) / factorial(19)
+    i = i + 1
+end
+"""
+
+
+def run(engine, ast, tiering=True):
+    interpreter = Interpreter(engine=engine)
+    if not tiering:
+        interpreter.tier_threshold = math.inf
+    start = time.perf_counter()
+    interpreter.interpret(ast)
+    return time.perf_counter() - start
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ast = Parser(tokenize(PROGRAM.format(iterations=iterations))).parse()
+    # The plain tree walker is the baseline; tiering is reported on its own
+    timings = {"tree": run("tree", ast, tiering=False)}
+    timings["tree+tiering"] = run("tree", ast)
+    for engine in Interpreter.ENGINES[1:]:
+        timings[engine] = run(engine, ast)
+    baseline = timings["tree"]
+    for engine, elapsed in timings.items():
+        print(f"{engine:>12}: {elapsed:8.3f}s  ({baseline / elapsed:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
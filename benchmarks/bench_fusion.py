@@ -0,0 +1,56 @@
+"""
+Compares peak memory and time of an elementwise array expression evaluated
+one operation at a time with the same expression fused into chunked
+evaluation by the optimizer.
+
+Usage: python3 benchmarks/bench_fusion.py [elements]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import tokenize
+from parser import Parser
+from interpreter import Interpreter
+from optimizer import optimize
+
+PROGRAM = """
+x = linspace(0, 10, {n})
+y = sin(x) .* exp(-0.1 * x) + x .^ 2 ./ 3
+"""
+
+
+def run(engine, source, optimized):
+    ast = Parser(tokenize(source)).parse()
+    if optimized:
+        ast = optimize(ast)
+    interpreter = Interpreter(engine=engine)
+    tracemalloc.start()
+    start = time.perf_counter()
+    interpreter.interpret(ast)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, interpreter.global_env.vars["y"]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    source = PROGRAM.format(n=n)
+    for engine in Interpreter.ENGINES:
+        plain, plain_peak, expected = run(engine, source, False)
+        fused, fused_peak, y = run(engine, source, True)
+        assert np.array_equal(y, expected)
+        print(
+            f"{engine:>8}: unfused {plain:7.4f}s {plain_peak / 2**20:7.1f} MiB"
+            f"  fused {fused:7.4f}s {fused_peak / 2**20:7.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Reports the memory taken per token and per syntax tree node for a large
+generated script, with slotted classes and the TokenArray arena, and with
+classes that keep their attributes in a per-instance __dict__ as they used
+to.
+
+Usage: python3 benchmarks/bench_memory.py [functions]
+"""
+import gc
+import io
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ast_nodes
+import lexer
+import memo
+import parser
+from bench_startup import program
+from lexer import TokenArray, generate_tokens, tokenize
+from parser import Parser
+
+
+def allocated(build):
+    """The value `build` returns, and the bytes it still holds."""
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def unslotted(cls):
+    """A copy of `cls` whose instances keep their attributes in a __dict__."""
+    return type(cls.__name__, (), {"__init__": cls.__init__})
+
+
+class Unslotted:
+    """Makes the lexer and parser create unslotted tokens and nodes."""
+
+    def __enter__(self):
+        self.saved = [(lexer, "Token", lexer.Token)]
+        for name, value in vars(ast_nodes).items():
+            if isinstance(value, type) and issubclass(value, ast_nodes.ASTNode):
+                self.saved.append((parser, name, getattr(parser, name)))
+        for module, name, cls in self.saved:
+            setattr(module, name, unslotted(cls))
+
+    def __exit__(self, *exc_info):
+        for module, name, cls in self.saved:
+            setattr(module, name, cls)
+
+
+def measure(source):
+    tokens, token_bytes = allocated(lambda: tokenize(source))
+    nodes, node_bytes = allocated(lambda: Parser(tokens).parse())
+    return len(tokens), token_bytes, nodes, node_bytes
+
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    source = program(functions)
+    print(f"{len(source):,} bytes of source")
+    tokens, token_bytes, nodes, node_bytes = measure(source)
+    # Counted on the slotted tree, which memo.walk recognizes
+    count = sum(1 for _ in memo.walk(nodes))
+    with Unslotted():
+        _, dict_token_bytes, _, dict_node_bytes = measure(source)
+    for name, per_token, per_node in [
+        ("__dict__", dict_token_bytes / tokens, dict_node_bytes / count),
+        ("slotted", token_bytes / tokens, node_bytes / count),
+    ]:
+        print(f"{name:>11}: {per_token:6.1f} bytes/token  {per_node:6.1f} bytes/node")
+    arena, arena_bytes = allocated(
+        lambda: TokenArray(generate_tokens(io.StringIO(source)))
+    )
+    print(f" TokenArray: {arena_bytes / len(arena):6.1f} bytes/token")
+
+
+if __name__ == "__main__":
+    main()
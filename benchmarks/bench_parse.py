@@ -0,0 +1,72 @@
+"""
+Measures parser throughput on large synthetic programs: one made of long
+arithmetic and logical expressions, and one of many short statements and
+function definitions.
+
+Usage: python3 benchmarks/bench_parse.py [statements]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import tokenize
+from parser import Parser
+
+OPERATORS = ["+", "-", "*", "/", "^", ".+", ".*", "==", "<", "and", "or"]
+OPERANDS = ["x", "1", "2.5", "v[i]", "f(x, y)", "(a - b)", "-y", "[1, 2, 3]"]
+
+STATEMENTS = """
+def g{index}(a, b):
+    c = a + b * {index}
+    if c > 1:
+        c -= 1
+    end
+    return c
+end
+x = g{index}(1, 2)
+"""
+
+REPEATS = 5
+
+
+def expression(rng, operators):
+    parts = [rng.choice(OPERANDS)]
+    for _ in range(operators):
+        parts.append(rng.choice(OPERATORS))
+        parts.append(rng.choice(OPERANDS))
+    return " ".join(parts)
+
+
+def expression_program(statements):
+    rng = random.Random(0)
+    lines = [f"y = {expression(rng, 12)}\n" for _ in range(statements)]
+    return "".join(lines)
+
+
+def statement_program(statements):
+    # Each copy of STATEMENTS holds eight statements
+    return "".join(STATEMENTS.format(index=i) for i in range(statements // 8))
+
+
+def measure(name, source):
+    tokens = tokenize(source)
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        Parser(tokens).parse()
+        best = min(best, time.perf_counter() - start)
+    rate = len(tokens) / best
+    print(f"{name:>12}: {best:8.3f}s  {rate:12,.0f} tokens/s  ({len(tokens):,} tokens)")
+
+
+def main():
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    measure("expressions", expression_program(statements))
+    measure("statements", statement_program(statements))
+
+
+if __name__ == "__main__":
+    main()
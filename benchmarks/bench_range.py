@@ -0,0 +1,62 @@
+"""
+Compares peak memory and time of a scalar for-loop over a lazy `range`
+with the same loop over the materialized array.
+
+Usage: python3 benchmarks/bench_range.py [iterations]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import tokenize
+from parser import Parser
+from interpreter import Interpreter
+
+# `.+ 0` turns the range into an ordinary array of the same values
+PROGRAMS = {
+    "lazy": "items = range(0, {n})\n",
+    "array": "items = range(0, {n}) .+ 0\n",
+}
+LOOP = """
+s = 0
+for i in items:
+    s = s + i * i - 3 * i
+end
+"""
+
+
+def run(engine, source):
+    # Unoptimized, so the loop is not vectorized away
+    ast = Parser(tokenize(source)).parse()
+    interpreter = Interpreter(engine=engine)
+    tracemalloc.start()
+    start = time.perf_counter()
+    interpreter.interpret(ast)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, interpreter.global_env.vars["s"]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    for engine in Interpreter.ENGINES:
+        results = {
+            name: run(engine, program.format(n=n) + LOOP)
+            for name, program in PROGRAMS.items()
+        }
+        assert results["lazy"][2] == results["array"][2]
+        print(
+            f"{engine:>8}: "
+            + "  ".join(
+                f"{name} {elapsed:7.4f}s {peak / 2**20:7.1f} MiB"
+                for name, (elapsed, peak, _) in results.items()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares cold and warm startup of a large generated script: parsing it from
+source against loading its syntax tree from the __mpycache__ cache, both in
+process and for a whole `main.py` run.
+
+Usage: python3 benchmarks/bench_startup.py [functions]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import astcache
+from lexer import tokenize
+from parser import Parser
+
+FUNCTION = """
+def f{index}(x, y):
+    v = [x, y, {index}]
+    a = x * {index} + y ^ 2 - (x - y) / 3
+    if a > {index}:
+        a = a - sqrt(abs(y)) * v[0]
+    end
+    return a
+end
+"""
+
+# Runs each generated function once, so the script itself finishes quickly
+CALL = "t = t + f{index}(1, 2)\n"
+
+REPEATS = 5
+
+
+def program(functions):
+    parts = [FUNCTION.format(index=i) for i in range(functions)]
+    parts.append("t = 0\n")
+    parts.extend(CALL.format(index=i) for i in range(functions))
+    parts.append("print(t)\n")
+    return "".join(parts)
+
+
+def best(action):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        action()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    source = program(functions)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "generated.mpy")
+        with open(filename, "w") as f:
+            f.write(source)
+        print(f"{functions} functions, {len(source):,} bytes of source")
+
+        parse = best(lambda: Parser(tokenize(source)).parse())
+        astcache.load_cached(filename, source)
+        load = best(lambda: astcache.load_cached(filename, source))
+        print(f"   parse: {parse:8.3f}s")
+        print(f"  cached: {load:8.3f}s  ({parse / load:.1f}x)")
+
+        command = [sys.executable, os.path.join(ROOT, "main.py"), filename]
+        run = lambda *flags: subprocess.run(
+            command + list(flags), check=True, stdout=subprocess.DEVNULL
+        )
+        cold = best(lambda: run("--no-cache"))
+        warm = best(run)
+        print(f"    cold: {cold:8.3f}s  main.py --no-cache")
+        print(f"    warm: {warm:8.3f}s  main.py  ({cold / warm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares elementwise for-loops run one element at a time with the same loops
+rewritten into whole-array operations by the vectorizer.
+
+Usage: python3 benchmarks/bench_vectorize.py [elements]
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import tokenize
+from parser import Parser
+from interpreter import Interpreter
+from optimizer import optimize
+
+PROGRAM = """
+x = linspace(0, 10, {n})
+w = ones({n})
+energy = 0
+weighted = 0
+for i in range(0, {n}):
+    y = sin(x[i]) .* exp(-0.1 * x[i])
+    energy = energy + y ^ 2
+    weighted = weighted + w[i] * x[i]
+end
+"""
+
+
+def run(engine, source, optimized):
+    ast = Parser(tokenize(source)).parse()
+    report = []
+    if optimized:
+        ast = optimize(ast, report=report)
+    interpreter = Interpreter(engine=engine)
+    start = time.perf_counter()
+    interpreter.interpret(ast)
+    elapsed = time.perf_counter() - start
+    return elapsed, interpreter.global_env.vars["energy"], report
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    source = PROGRAM.format(n=n)
+    for engine in Interpreter.ENGINES:
+        loop, expected, _ = run(engine, source, False)
+        vector, energy, report = run(engine, source, True)
+        assert math.isclose(energy, expected, rel_tol=1e-12), (energy, expected)
+        print(
+            f"{engine:>8}: loop {loop:8.3f}s  vectorized {vector:8.4f}s"
+            f"  speedup {loop / vector:8.1f}x"
+        )
+    for line in report:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
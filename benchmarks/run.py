@@ -0,0 +1,209 @@
+"""
+Runs the synthetic workloads of benchmarks/workloads.py through the lexer,
+the parser and an interpreter engine, and reports the throughput of each
+stage: tokens, syntax tree nodes and executed statements per second.
+
+Results can be written to a JSON file, and compared against an earlier
+results file, in which case the run fails (exit status 1) when any
+throughput dropped by more than the threshold:
+
+    python3 benchmarks/run.py --output baseline.json
+    python3 benchmarks/run.py --baseline baseline.json --threshold 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from interpreter import Interpreter
+from lexer import tokenize
+from memo import walk
+from optimizer import optimize
+from parser import Parser
+from workloads import WORKLOADS
+
+# Throughputs compared against a baseline, with their column titles
+METRICS = [
+    ("tokens_per_s", "tokens/s"),
+    ("nodes_per_s", "nodes/s"),
+    ("statements_per_s", "statements/s"),
+]
+
+
+def best(action, repeat):
+    """The shortest of `repeat` timings of `action()`, after a warm-up call."""
+    action()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def executed_statements(tokens):
+    """How many statements the optimized program runs, counted on the tree engine."""
+    interpreter = Interpreter()
+    # Compiled functions would run their statements without visiting them
+    interpreter.tier_threshold = math.inf
+    visit = interpreter.visit
+    count = 0
+
+    def counting_visit(node, env):
+        nonlocal count
+        if getattr(node, "line", None) is not None:
+            count += 1
+        return visit(node, env)
+
+    interpreter.visit = counting_visit
+    with contextlib.redirect_stdout(io.StringIO()):
+        interpreter.interpret(optimize(Parser(tokens).parse()))
+    return count
+
+
+def run_program(tokens, engine):
+    # Passes annotate the tree, so every run gets a freshly parsed copy
+    ast = optimize(Parser(tokens).parse())
+    interpreter = Interpreter(engine=engine)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        interpreter.interpret(ast)
+        return time.perf_counter() - start
+
+
+def measure(name, scale, engine, repeat):
+    generate, size = WORKLOADS[name]
+    source = generate(max(1, int(size * scale)))
+    tokens = tokenize(source)
+    nodes = sum(1 for _ in walk(Parser(tokens).parse()))
+    statements = executed_statements(tokens)
+    lex = best(lambda: tokenize(source), repeat)
+    parse = best(lambda: Parser(tokens).parse(), repeat)
+    run_program(tokens, engine)
+    execute = min(run_program(tokens, engine) for _ in range(repeat))
+    return {
+        "tokens": len(tokens),
+        "nodes": nodes,
+        "statements": statements,
+        "lex_s": lex,
+        "parse_s": parse,
+        "run_s": execute,
+        "tokens_per_s": len(tokens) / lex,
+        "nodes_per_s": nodes / parse,
+        "statements_per_s": statements / execute,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Report lines for every throughput, and whether any of them regressed."""
+    lines = []
+    regressed = False
+    for name, result in results["workloads"].items():
+        old = baseline["workloads"].get(name)
+        if old is None:
+            lines.append(f"{name:<16} not in the baseline")
+            continue
+        for key, title in METRICS:
+            change = (result[key] - old[key]) / old[key] * 100
+            status = ""
+            if change < -threshold:
+                status = "  REGRESSION"
+                regressed = True
+            lines.append(
+                f"{name:<16} {title:<14} {old[key]:>14,.0f} -> {result[key]:>14,.0f}"
+                f"  {change:+6.1f}%{status}"
+            )
+    return lines, regressed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        usage="python3 benchmarks/run.py [options]",
+        description="Measure lexer, parser and interpreter throughput.",
+    )
+    arg_parser.add_argument(
+        "--workloads",
+        nargs="+",
+        choices=list(WORKLOADS),
+        default=list(WORKLOADS),
+        metavar="NAME",
+        help=f"workloads to run (default: all of {', '.join(WORKLOADS)})",
+    )
+    arg_parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply the size of every workload (default: 1)",
+    )
+    arg_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        metavar="N",
+        help="timed runs per stage, of which the fastest counts (default: 3)",
+    )
+    arg_parser.add_argument(
+        "--engine",
+        choices=Interpreter.ENGINES,
+        default="tree",
+        help="execution engine (default: tree)",
+    )
+    arg_parser.add_argument(
+        "--output", metavar="FILE", help="write the results to FILE as JSON"
+    )
+    arg_parser.add_argument(
+        "--baseline", metavar="FILE", help="compare against the results in FILE"
+    )
+    arg_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        metavar="PERCENT",
+        help="slowdown against the baseline that fails the run (default: 10)",
+    )
+    args = arg_parser.parse_args()
+    if args.repeat < 1:
+        arg_parser.error("--repeat must be at least 1")
+    if args.scale <= 0:
+        arg_parser.error("--scale must be positive")
+
+    results = {
+        "engine": args.engine,
+        "scale": args.scale,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "workloads": {},
+    }
+    print(f"{'workload':<16}" + "".join(f"{title:>16}" for _, title in METRICS))
+    for name in args.workloads:
+        result = measure(name, args.scale, args.engine, args.repeat)
+        results["workloads"][name] = result
+        rates = "".join(f"{result[key]:>16,.0f}" for key, _ in METRICS)
+        print(f"{name:<16}{rates}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("engine", "scale"):
+            if baseline.get(key) != results[key]:
+                print(f"Note: the baseline ran with {key} {baseline.get(key)}")
+        lines, regressed = compare(results, baseline, args.threshold)
+        print()
+        print("\n".join(lines))
+        if regressed:
+            print(f"Throughput dropped by more than {args.threshold:g}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Synthetic MathPy programs for benchmarks/run.py. Every workload turns a size
+into the source of a program whose work grows linearly with it; each prints
+one result, which run.py discards.
+"""
+
+SCALAR_LOOPS = """
+total = 0
+i = 0
+while i < {size}:
+    x = i * 2.5 - 1
+    if x > 100 and x < 40000:
+        total = total + x / 3
+    else:
+        total = total - 1
+    end
+    i = i + 1
+end
+print(total)
+"""
+
+RECURSION = """
+def fib(n):
+    if n < 2:
+        return n
+    end
+    return fib(n - 1) + fib(n - 2)
+end
+
+total = 0
+for i in range({calls}):
+    total = total + fib(10)
+end
+print(total)
+"""
+
+MATRIX_OPS = """
+A = [[4, 1, 2], [1, 5, 3], [2, 3, 6]]
+b = [1, 2, 3]
+M = zeros(3, 3)
+for i in range({size}):
+    M = M + inv(A) * A .* 0.5
+    x = inv(A) * b
+    d = det(A) + i
+end
+print(M)
+"""
+
+SET_OPS = """
+seen = {{0}}
+evens = {{0}}
+for i in range({size}):
+    seen = seen | {{i, i + 1}}
+    evens = evens | {{2 * i}}
+    common = seen & evens
+    odd = seen - evens
+end
+print(common)
+"""
+
+LONG_SCRIPT_STATEMENT = """
+a{index} = {index} * 2 + 1
+b{index} = (a{index} - 3) / 4 ^ 2
+if b{index} > a{index}:
+    c{index} = a{index}
+else:
+    c{index} = b{index} - a{index}
+end
+"""
+
+
+def scalar_loops(size):
+    return SCALAR_LOOPS.format(size=size)
+
+
+def recursion(size):
+    # fib(10) makes 177 calls
+    return RECURSION.format(calls=max(1, size // 177))
+
+
+def large_literals(size):
+    elements = ", ".join(f"{i % 97}.5" for i in range(size))
+    members = ", ".join(str(i) for i in range(size))
+    return f"v = [{elements}]\ns = {{{members}}}\nprint(v[0])\n"
+
+
+def matrix_ops(size):
+    return MATRIX_OPS.format(size=size)
+
+
+def set_ops(size):
+    return SET_OPS.format(size=size)
+
+
+def long_script(size):
+    # Each copy holds four statements
+    parts = [LONG_SCRIPT_STATEMENT.format(index=i) for i in range(size // 4)]
+    parts.append("print(a0)\n")
+    return "".join(parts)
+
+
+# Workload generators by name, with the size run.py uses at scale 1
+WORKLOADS = {
+    "scalar_loops": (scalar_loops, 20000),
+    "recursion": (recursion, 20000),
+    "large_literals": (large_literals, 20000),
+    "matrix_ops": (matrix_ops, 2000),
+    "set_ops": (set_ops, 2000),
+    "long_script": (long_script, 8000),
+}
@@ -0,0 +1,533 @@
+from ast_nodes import *
+from interpreter import (
+    KIND_TYPES,
+    ReturnException,
+    binary_operator,
+    check_arity,
+    specialization,
+    specialized_operator,
+    store_item,
+    update_in_place,
+)
+from inference import infer, inferred_kind
+from resolver import (
+    DYNAMIC,
+    LOCAL,
+    PARAM,
+    UNBOUND,
+    assigned_names,
+    binding_counts,
+    function_defs,
+    resolve,
+)
+from memo import MISSING
+import builtin_modules
+import functools
+import memo
+import vectorizer
+import hashlib
+import marshal
+import os
+import sys
+import numpy as np
+
+# Bump whenever the generated code or the runtime namespace changes shape
+CODEGEN_VERSION = 7
+CACHE_MAGIC = b"MPYC" + bytes([CODEGEN_VERSION])
+CACHE_DIR = "__mpycache__"
+CODE_FILENAME = "<mathpy>"
+
+# Prefix applied to every MathPy identifier so that user names can never
+# collide with Python keywords, builtins or the runtime helpers below.
+NAME_PREFIX = "_m_"
+
+
+# Prefix for the optimizer's hidden variables, which start with "$"
+TEMP_PREFIX = "_t_"
+
+
+def mangle(name):
+    if name.startswith("$"):
+        return TEMP_PREFIX + name[1:]
+    return NAME_PREFIX + name
+
+
+class PythonGenerator:
+    """
+    Translates a MathPy AST into the source of an equivalent Python module.
+
+    User functions become plain Python functions whose locals are Python
+    locals. MathPy's scoping is dynamic (a function sees its caller's
+    variables), so a name that is local to some function is looked up
+    through the active MathPy frames when it is not bound locally; names that
+    are never local anywhere are read straight from the module globals.
+    """
+
+    ARITHMETIC = {
+        "+": "add",
+        "-": "sub",
+        "*": "mul",
+        "/": "div",
+        "^": "pow",
+        ".+": "eadd",
+        ".-": "esub",
+        ".*": "emul",
+        "./": "ediv",
+        ".^": "epow",
+        "|": "or_",
+        "&": "and_",
+    }
+    COMPARE = {
+        "==": "eq",
+        "!=": "ne",
+        "<": "lt",
+        ">": "gt",
+        "<=": "le",
+        ">=": "ge",
+    }
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.lines = []
+        self.indent = 0
+        self.function = None
+
+    def generate(self, nodes):
+        resolve(nodes)
+        infer(nodes)
+        memo.check(nodes)
+        self.top_level = set(assigned_names(nodes))
+        all_assigned = set(self.top_level)
+        for func in function_defs(nodes):
+            all_assigned.update(func.slots)
+        # Names that always refer to the same function and can be called
+        # directly, with the parameter list of user functions
+        self.direct_calls = {}
+        builtins = self.interpreter.global_env.vars
+        for name, value in builtins.items():
+            if callable(value) and name not in all_assigned:
+                self.direct_calls[name] = None
+        counts = binding_counts(nodes)
+        for func in function_defs(nodes):
+            if counts[func.name] == 1:
+                self.direct_calls[func.name] = func.params
+
+        self.emit("def _rt_main():")
+        self.indent += 1
+        if self.top_level:
+            self.emit(
+                "global " + ", ".join(sorted(mangle(n) for n in self.top_level))
+            )
+        self.block(nodes)
+        self.indent -= 1
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def block(self, nodes):
+        start = len(self.lines)
+        for node in nodes:
+            self.statement(node)
+        if len(self.lines) == start:
+            self.emit("pass")
+
+    # Statements
+    def statement(self, node):
+        method = getattr(self, "gen_" + type(node).__name__, None)
+        if method is None:
+            self.emit(self.expression(node))
+        else:
+            method(node)
+
+    def gen_Assign(self, node):
+        if isinstance(node.left, Subscript):
+            self.assign_item(node.left, self.expression(node.right))
+            return
+        self.emit(f"{mangle(node.left.name)} = {self.expression(node.right)}")
+
+    def gen_AugAssign(self, node):
+        helper = "_rt_" + self.ARITHMETIC[node.op.value]
+        value = self.expression(node.right)
+        if isinstance(node.left, Subscript):
+            self.assign_item(node.left, value, helper)
+            return
+        var = node.left
+        self.emit(f"_rt_value = {value}")
+        self.take(var)
+        self.emit(
+            f"{mangle(var.name)} = _rt_update_in_place("
+            f"_rt_target, _rt_value, {node.op.value!r}, {helper})"
+        )
+
+    def assign_item(self, target, value, helper=None):
+        self.emit(f"_rt_value = {value}")
+        self.emit(f"_rt_key = {self.subscript_index(target)}")
+        self.take(target.var)
+        apply = f", {helper}" if helper else ""
+        self.emit(
+            f"{mangle(target.var.name)} = _rt_store_item("
+            f"_rt_target, _rt_key, _rt_value{apply})"
+        )
+
+    def take(self, var):
+        """
+        Moves a variable about to be reassigned into `_rt_target`, so that
+        the variable itself no longer references its value.
+        """
+        target = mangle(var.name)
+        self.emit(
+            f"_rt_target, {target} = {self.load(var.name, var.scope)}, _rt_unset"
+        )
+
+    def gen_Compound(self, node):
+        self.block(node.children)
+
+    def gen_NoOp(self, node):
+        self.emit("pass")
+
+    def gen_If(self, node):
+        self.emit(f"if {self.expression(node.condition)}:")
+        self.indent += 1
+        self.block(node.true_block)
+        self.indent -= 1
+        if node.false_block:
+            self.emit("else:")
+            self.indent += 1
+            self.block(node.false_block)
+            self.indent -= 1
+
+    def gen_While(self, node):
+        self.emit(f"while {self.expression(node.condition)}:")
+        self.indent += 1
+        self.block(node.body)
+        self.indent -= 1
+
+    def gen_For(self, node):
+        self.emit(f"for {mangle(node.var)} in {self.expression(node.iterable)}:")
+        self.indent += 1
+        self.block(node.body)
+        self.indent -= 1
+
+    def gen_FunctionDef(self, node):
+        outer = self.function
+        self.function = node
+        params = ", ".join(mangle(param) for param in node.params)
+        self.emit(f"def {mangle(node.name)}({params}):")
+        self.indent += 1
+        for name in list(node.slots)[len(set(node.params)) :]:
+            self.emit(f"{mangle(name)} = _rt_unset")
+        self.block(node.body)
+        self.indent -= 1
+        self.function = outer
+        plan = vectorizer.lift(node)
+        if plan is not None:
+            self.emit(f"{mangle(node.name)}._rt_lift = {plan!r}")
+        if node.memo:
+            self.emit(f"{mangle(node.name)} = _rt_memo({mangle(node.name)})")
+
+    def gen_Return(self, node):
+        value = self.expression(node.expr) if node.expr else "None"
+        if self.function is None:
+            self.emit(f"raise _rt_return({value})")
+        else:
+            self.emit(f"return {value}")
+
+    # Expressions
+    def expression(self, node):
+        method = getattr(self, "expr_" + type(node).__name__, None)
+        if method is None:
+            raise Exception(f"No code generator for {type(node).__name__}")
+        return method(node)
+
+    def expr_Number(self, node):
+        return repr(self.interpreter.visit_Number(node, None))
+
+    def expr_String(self, node):
+        return repr(node.value)
+
+    def expr_Constant(self, node):
+        return repr(node.value)
+
+    def expr_Variable(self, node):
+        return self.load(node.name, node.scope)
+
+    def load(self, name, scope):
+        target = mangle(name)
+        if scope == PARAM:
+            return target
+        if scope == LOCAL:
+            return f"({target} if {target} is not _rt_unset else _rt_lookup({name!r}))"
+        if scope == DYNAMIC:
+            return f"_rt_lookup({name!r})"
+        return target
+
+    def expr_Hoisted(self, node):
+        target = mangle(node.name)
+        value = self.expression(node.expr)
+        return f"({target} if {target} is not None else ({target} := {value}))"
+
+    def expr_BinOp(self, node):
+        left = self.expression(node.left)
+        right = self.expression(node.right)
+        op_value = node.op.value
+        if op_value in ("and", "or"):
+            helper = op_value + "_"
+            return f"_rt_logical_{helper}({left}, {right})"
+        if node.op.type == "COMPARE":
+            return f"_rt_{self.COMPARE[op_value]}({left}, {right})"
+        helper = self.ARITHMETIC.get(op_value)
+        if helper is None:
+            raise Exception(f"Unsupported operator {op_value}")
+        kinds = inferred_kind(node.left), inferred_kind(node.right)
+        if specialization(op_value, *kinds) is not None:
+            # A helper that skips the generic dispatch for these kinds
+            helper += "_{}_{}".format(*kinds)
+        return f"_rt_{helper}({left}, {right})"
+
+    def expr_UnaryOp(self, node):
+        expr = self.expression(node.expr)
+        op_value = node.op.value if hasattr(node.op, "value") else node.op.type
+        if op_value in ("+", "-"):
+            return f"({op_value}{expr})"
+        elif op_value == "not":
+            return f"(not {expr})"
+        else:
+            raise Exception(f"Unsupported unary operator {op_value}")
+
+    def expr_FunctionCall(self, node):
+        args = ", ".join(self.expression(arg) for arg in node.args)
+        if node.name == "plot":
+            return f"_rt_plot({args})"
+        if node.name == "vmap":
+            return f"_rt_vmap({args})"
+        func = self.load(node.name, node.scope)
+        if node.name in self.direct_calls:
+            params = self.direct_calls[node.name]
+            if params is not None and len(params) != len(node.args):
+                return f"_rt_arity_error({node.name!r}, {params!r}, [{args}])"
+            return f"{func}({args})"
+        return f"_rt_call({node.name!r}, {func}, [{args}])"
+
+    def expr_ListLiteral(self, node):
+        elements = ", ".join(self.expression(e) for e in node.elements)
+        return f"_rt_array([{elements}])"
+
+    def expr_SetLiteral(self, node):
+        elements = ", ".join(self.expression(e) for e in node.elements)
+        return f"set([{elements}])"
+
+    def expr_Subscript(self, node):
+        var = self.expression(node.var)
+        return f"_rt_subscript({var}, {self.subscript_index(node)})"
+
+    def subscript_index(self, node):
+        indices = node.index if isinstance(node.index, list) else [node.index]
+        parts = [self.index(idx_node) for idx_node in indices]
+        if len(parts) == 1:
+            return parts[0]
+        return "(" + ", ".join(parts) + ",)"
+
+    def index(self, idx_node):
+        if isinstance(idx_node, Slice):
+            start = self.index(idx_node.start) if idx_node.start else "None"
+            end = self.index(idx_node.end) if idx_node.end else "None"
+            return f"slice({start}, {end})"
+        return f"_rt_index({self.expression(idx_node)})"
+
+
+def generate(interpreter, nodes):
+    return PythonGenerator(interpreter).generate(nodes)
+
+
+def compile_program(interpreter, nodes):
+    return compile(generate(interpreter, nodes), CODE_FILENAME, "exec")
+
+
+def is_generated(func):
+    """Whether `func` is a user function of a generated program."""
+    code = getattr(func, "__code__", None)
+    return code is not None and code.co_filename == CODE_FILENAME
+
+
+def function_name(func):
+    return func.__code__.co_name[len(NAME_PREFIX) :]
+
+
+def memoized(func, table):
+    """A generated function that caches its results in `table`."""
+    name = function_name(func)
+    params = func.__code__.co_varnames[: func.__code__.co_argcount]
+
+    @functools.wraps(func)
+    def call(*args):
+        check_arity(name, params, args)
+        key, result = table.lookup(args)
+        if result is MISSING:
+            result = func(*args)
+            table.store(key, result)
+        return result
+
+    return call
+
+
+def runtime_namespace(interpreter):
+    """Builds the helper functions that generated code calls into."""
+
+    def lookup(name):
+        target = mangle(name)
+        frame = sys._getframe(1)
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == CODE_FILENAME and code.co_name != "_rt_main":
+                value = frame.f_locals.get(target, UNBOUND)
+                if value is not UNBOUND:
+                    return value
+            frame = frame.f_back
+        try:
+            return namespace[target]
+        except KeyError:
+            raise NameError(f"Name {name} is not defined")
+
+    def call(func_name, func, args):
+        if is_generated(func):
+            code = func.__code__
+            check_arity(func_name, code.co_varnames[: code.co_argcount], args)
+        if callable(func):
+            return func(*args)
+        raise Exception(f"{func_name} is not a function")
+
+    def plot(*args):
+        builtin_modules.plot(args)
+
+    def vmap(*args):
+        def call_one(func, item):
+            if is_generated(func):
+                return call(function_name(func), func, [item])
+            return call("vmap() argument", func, [item])
+
+        plan_of = lambda func: getattr(func, "_rt_lift", None)
+        return vectorizer.vmap(args, plan_of, lookup, call_one)
+
+    def memo_def(func):
+        table = interpreter.memo_table(func.__code__, function_name(func))
+        return memoized(func, table)
+
+    def subscript(var, index):
+        try:
+            return var[index]
+        except (IndexError, TypeError) as e:
+            raise Exception(f"Subscript error: {e}")
+
+    def index(value):
+        if isinstance(value, float):
+            return int(value)
+        return value
+
+    def raise_return(value):
+        return ReturnException(value)
+
+    namespace = {
+        "_rt_unset": UNBOUND,
+        "_rt_lookup": lookup,
+        "_rt_call": call,
+        "_rt_arity_error": check_arity,
+        "_rt_plot": plot,
+        "_rt_vmap": vmap,
+        "_rt_memo": memo_def,
+        "_rt_array": np.array,
+        "_rt_subscript": subscript,
+        "_rt_index": index,
+        "_rt_store_item": store_item,
+        "_rt_update_in_place": update_in_place,
+        "_rt_return": raise_return,
+        "_rt_logical_and_": binary_operator(interpreter, "and", "and"),
+        "_rt_logical_or_": binary_operator(interpreter, "or", "or"),
+    }
+    for op_value, helper in PythonGenerator.ARITHMETIC.items():
+        namespace["_rt_" + helper] = binary_operator(interpreter, "OP", op_value)
+        for left_kind in KIND_TYPES:
+            for right_kind in KIND_TYPES:
+                handler = specialized_operator(
+                    interpreter, "OP", op_value, left_kind, right_kind
+                )
+                if handler is not None:
+                    name = f"_rt_{helper}_{left_kind}_{right_kind}"
+                    namespace[name] = handler
+    for op_value, helper in PythonGenerator.COMPARE.items():
+        namespace["_rt_" + helper] = binary_operator(interpreter, "COMPARE", op_value)
+    return namespace
+
+
+def code_names(code):
+    """The MathPy names used by compiled code and the functions it defines."""
+    prefix = len(NAME_PREFIX)
+    names = {name[prefix:] for name in code.co_names if name.startswith(NAME_PREFIX)}
+    for const in code.co_consts:
+        if isinstance(const, type(code)):
+            names |= code_names(const)
+    return names
+
+
+def execute(interpreter, code):
+    """Runs a compiled program against the interpreter's global environment."""
+    interpreter.load_builtins(code_names(code))
+    env_vars = interpreter.global_env.vars
+    namespace = runtime_namespace(interpreter)
+    namespace.update((mangle(name), value) for name, value in env_vars.items())
+    try:
+        exec(code, namespace)
+        namespace["_rt_main"]()
+    except NameError as e:
+        name = getattr(e, "name", None)
+        if name and name.startswith(NAME_PREFIX):
+            raise NameError(f"Name {name[len(NAME_PREFIX):]} is not defined")
+        raise
+    finally:
+        for name, value in namespace.items():
+            if name.startswith(NAME_PREFIX):
+                env_vars[name[len(NAME_PREFIX) :]] = value
+
+
+def cache_path(filename):
+    directory, base = os.path.split(os.path.abspath(filename))
+    stem = os.path.splitext(base)[0]
+    name = f"{stem}.{sys.implementation.cache_tag}.pyc"
+    return os.path.join(directory, CACHE_DIR, name)
+
+
+def load_cached(filename, source, optimize=True):
+    """
+    Returns the compiled program for `source`, reusing the on-disk cache next
+    to `filename` when its source hash matches and writing it otherwise.
+    """
+    digest = hashlib.sha256(source.encode() + bytes([optimize])).digest()
+    header = CACHE_MAGIC + digest
+    path = cache_path(filename)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[: len(header)] == header:
+            return marshal.loads(data[len(header) :])
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+
+    from lexer import tokenize
+    from parser import Parser
+    from interpreter import Interpreter
+
+    nodes = Parser(tokenize(source)).parse()
+    if optimize:
+        import optimizer
+
+        nodes = optimizer.optimize(nodes)
+    code = compile_program(Interpreter(), nodes)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header + marshal.dumps(code))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return code
@@ -0,0 +1,570 @@
+from ast_nodes import *
+from interpreter import (
+    COMPARE_OPS,
+    RETURN,
+    SET_OPS,
+    ReturnException,
+    binary_operator,
+    check_arity,
+    specialization,
+    store_item,
+    update_in_place,
+)
+from inference import infer, inferred_kind
+from resolver import DYNAMIC, GLOBAL, LOCAL, PARAM, UNBOUND, resolve
+from functools import partial
+from memo import MISSING
+import builtin_modules
+import memo
+import vectorizer
+import numpy as np
+
+
+class Frame(list):
+    """
+    The local variables of one function call, indexed by the slots assigned
+    by the resolver. `parent` is the caller's frame, since MathPy resolves
+    unbound names dynamically; the top-level frame has no slots.
+    """
+
+    __slots__ = ("parent", "names")
+
+    @classmethod
+    def top_level(cls):
+        frame = cls()
+        frame.parent = None
+        frame.names = {}
+        return frame
+
+
+class Compiler:
+    """
+    Compiles a parsed MathPy program into nested Python closures.
+
+    Every node is translated once into a function taking the current Frame.
+    Operators, literal values, subscript shapes and variable locations (see
+    resolver.py) are resolved at compile time, so running the program does
+    no per-node dispatch and no dictionary lookups for function locals.
+    Globals and builtins are read directly from the global environment.
+    Arithmetic on operands inferred to be numbers or arrays (see
+    inference.py) checks their types and skips the generic dispatch.
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.global_env.vars
+        self.functions = {}
+        self.return_value = None
+        self.arithmetic_ops = interpreter.arithmetic_ops()
+
+    def compile(self, node):
+        method_name = "compile_" + type(node).__name__
+        method = getattr(self, method_name, self.generic_compile)
+        return method(node)
+
+    def generic_compile(self, node):
+        raise Exception(f"No compile_{type(node).__name__} method")
+
+    def compile_program(self, nodes):
+        resolve(nodes)
+        infer(nodes)
+        memo.check(nodes)
+        program = self.compile_block(nodes)
+
+        def run():
+            if program(Frame.top_level()) is RETURN:
+                raise ReturnException(self.return_value)
+
+        return run
+
+    def compile_block(self, nodes):
+        stmts = tuple(self.compile(node) for node in nodes)
+        if len(stmts) == 1:
+            return stmts[0]
+
+        def block(frame):
+            for stmt in stmts:
+                if stmt(frame) is RETURN:
+                    return RETURN
+
+        return block
+
+    # Expressions
+    def compile_Number(self, node):
+        value = self.interpreter.visit_Number(node, None)
+        return lambda frame: value
+
+    def compile_String(self, node):
+        value = node.value
+        return lambda frame: value
+
+    compile_Constant = compile_String
+
+    def compile_Variable(self, node):
+        return self.compile_load(node.name, node.scope, node.slot)
+
+    def compile_load(self, name, scope, slot):
+        lookup = self.lookup
+        if scope == PARAM:
+            return lambda frame: frame[slot]
+        elif scope == LOCAL:
+
+            def local(frame):
+                value = frame[slot]
+                if value is UNBOUND:
+                    return lookup(frame.parent, name)
+                return value
+
+            return local
+        elif scope == DYNAMIC:
+            return lambda frame: lookup(frame.parent, name)
+
+        global_vars = self.globals
+
+        def global_(frame):
+            try:
+                return global_vars[name]
+            except KeyError:
+                raise NameError(f"Name {name} is not defined")
+
+        return global_
+
+    def lookup(self, frame, name):
+        """Resolves a name through the active frames, then the globals."""
+        while frame is not None:
+            if not isinstance(frame, Frame):
+                # The Environment of a tree engine caller, which hands hot
+                # functions to compiled code (see Interpreter.call_function)
+                return frame.get(name)
+            slot = frame.names.get(name)
+            if slot is not None and frame[slot] is not UNBOUND:
+                return frame[slot]
+            frame = frame.parent
+        try:
+            return self.globals[name]
+        except KeyError:
+            raise NameError(f"Name {name} is not defined")
+
+    def compile_take(self, name, scope, slot):
+        """
+        Like compile_load, for a variable about to be reassigned: the value
+        is also cleared from the current frame or the globals, so that it is
+        no longer referenced there.
+        """
+        if scope in (LOCAL, PARAM):
+            lookup = self.lookup
+
+            def local(frame):
+                value = frame[slot]
+                if value is UNBOUND:
+                    return lookup(frame.parent, name)
+                frame[slot] = UNBOUND
+                return value
+
+            return local
+        global_vars = self.globals
+
+        def global_(frame):
+            try:
+                return global_vars.pop(name)
+            except KeyError:
+                raise NameError(f"Name {name} is not defined")
+
+        return global_
+
+    def compile_store(self, name, scope, slot):
+        if scope in (LOCAL, PARAM):
+
+            def local(frame, value):
+                frame[slot] = value
+
+            return local
+        global_vars = self.globals
+
+        def global_(frame, value):
+            global_vars[name] = value
+
+        return global_
+
+    def compile_Hoisted(self, node):
+        expr = self.compile(node.expr)
+        if node.scope == GLOBAL:
+            global_vars = self.globals
+            name = node.name
+
+            def hoisted_global(frame):
+                value = global_vars[name]
+                if value is None:
+                    value = global_vars[name] = expr(frame)
+                return value
+
+            return hoisted_global
+        slot = node.slot
+
+        def hoisted(frame):
+            value = frame[slot]
+            if value is None:
+                value = frame[slot] = expr(frame)
+            return value
+
+        return hoisted
+
+    def compile_BinOp(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        op_value = node.op.value
+
+        set_op = SET_OPS.get(op_value)
+
+        if op_value in ("and", "or"):
+            is_and = op_value == "and"
+
+            def logical(frame):
+                l = left(frame)
+                r = right(frame)
+                if isinstance(l, set) and isinstance(r, set):
+                    raise Exception(f"Unsupported set operator {op_value}")
+                if is_and:
+                    return bool(l) and bool(r)
+                return bool(l) or bool(r)
+
+            return logical
+
+        if node.op.type == "COMPARE":
+            fn = COMPARE_OPS[op_value]
+
+            def compare(frame):
+                l = left(frame)
+                r = right(frame)
+                if isinstance(l, set) and isinstance(r, set):
+                    raise Exception(f"Unsupported set operator {op_value}")
+                return fn(l, r)
+
+            return compare
+
+        specialized = specialization(
+            op_value, inferred_kind(node.left), inferred_kind(node.right)
+        )
+        if specialized is not None:
+            fast, left_types, right_types = specialized
+            generic = binary_operator(self.interpreter, node.op.type, op_value)
+
+            def specialized_arithmetic(frame):
+                l = left(frame)
+                r = right(frame)
+                if type(l) in left_types and type(r) in right_types:
+                    result = fast(l, r)
+                    if isinstance(result, float) and result.is_integer():
+                        return int(result)
+                    return result
+                return generic(l, r)
+
+            return specialized_arithmetic
+
+        fn = self.arithmetic_ops.get(op_value)
+
+        def arithmetic(frame):
+            l = left(frame)
+            r = right(frame)
+            if isinstance(l, set) and isinstance(r, set):
+                if set_op is None:
+                    raise Exception(f"Unsupported set operator {op_value}")
+                return set_op(l, r)
+            if fn is None:
+                raise Exception(f"Unsupported operator {op_value}")
+            result = fn(l, r)
+            if isinstance(result, float) and result.is_integer():
+                return int(result)
+            return result
+
+        return arithmetic
+
+    def compile_UnaryOp(self, node):
+        expr = self.compile(node.expr)
+        op_value = node.op.value if hasattr(node.op, "value") else node.op.type
+        if op_value == "+":
+            return lambda frame: +expr(frame)
+        elif op_value == "-":
+            return lambda frame: -expr(frame)
+        elif op_value == "not":
+            return lambda frame: not expr(frame)
+        else:
+            raise Exception(f"Unsupported unary operator {op_value}")
+
+    def compile_FunctionCall(self, node):
+        func_name = node.name
+        args = tuple(self.compile(arg) for arg in node.args)
+
+        if func_name == "plot":
+
+            def plot(frame):
+                builtin_modules.plot([arg(frame) for arg in args])
+
+            return plot
+
+        if func_name == "vmap":
+            return self.compile_vmap(args)
+
+        call_function = self.call_function
+        load = self.compile_load(func_name, node.scope, node.slot)
+
+        # Small argument lists are evaluated without a list comprehension
+        if len(args) == 1:
+            (arg0,) = args
+
+            def call(frame):
+                values = [arg0(frame)]
+                return call_function(func_name, load(frame), values, frame)
+
+        elif len(args) == 2:
+            arg0, arg1 = args
+
+            def call(frame):
+                values = [arg0(frame), arg1(frame)]
+                return call_function(func_name, load(frame), values, frame)
+
+        else:
+
+            def call(frame):
+                values = [arg(frame) for arg in args]
+                return call_function(func_name, load(frame), values, frame)
+
+        return call
+
+    def compile_vmap(self, args):
+        call_function = self.call_function
+        lookup = self.lookup
+        lift_plan = self.interpreter.lift_plan
+
+        def vmap(frame):
+            def call(func, item):
+                name = getattr(func, "name", "vmap() argument")
+                return call_function(name, func, [item], frame)
+
+            values = [arg(frame) for arg in args]
+            return vectorizer.vmap(values, lift_plan, partial(lookup, frame), call)
+
+        return vmap
+
+    def function_code(self, func):
+        code = self.functions.get(func)
+        if code is None:
+            if not hasattr(func, "slots"):
+                resolve([func])
+            # Body, initial frame contents and a pool of frames to reuse
+            code = self.functions[func] = (
+                self.compile_block(func.body),
+                [UNBOUND] * len(func.slots),
+                [],
+            )
+        return code
+
+    def call_function(self, func_name, func, args, frame, memo=True):
+        if isinstance(func, FunctionDef):
+            check_arity(func_name, func.params, args)
+            if func.memo and memo:
+                return self.call_memoized(func_name, func, args, frame)
+            body, unbound, free_frames = self.function_code(func)
+            if free_frames:
+                func_frame = free_frames.pop()
+            else:
+                func_frame = Frame(unbound)
+                func_frame.names = func.slots
+            func_frame.parent = frame
+            func_frame[: len(args)] = args
+            result = None
+            if body(func_frame) is RETURN:
+                result = self.return_value
+                self.return_value = None
+            func_frame[:] = unbound
+            func_frame.parent = None
+            free_frames.append(func_frame)
+            return result
+        elif callable(func):
+            return func(*args)
+        else:
+            raise Exception(f"{func_name} is not a function")
+
+    def call_memoized(self, func_name, func, args, frame):
+        table = self.interpreter.memo_table(func, func.name)
+        key, result = table.lookup(args)
+        if result is MISSING:
+            result = self.call_function(func_name, func, args, frame, memo=False)
+            table.store(key, result)
+        return result
+
+    def compile_ListLiteral(self, node):
+        if all(self.is_constant(element) for element in node.elements):
+            # Literal matrices are built once and copied on each evaluation
+            template = np.array(
+                [self.compile(element)(None) for element in node.elements]
+            )
+            return lambda frame: template.copy()
+        elements = tuple(self.compile(element) for element in node.elements)
+        return lambda frame: np.array([element(frame) for element in elements])
+
+    def compile_SetLiteral(self, node):
+        elements = tuple(self.compile(element) for element in node.elements)
+        return lambda frame: {element(frame) for element in elements}
+
+    def compile_Subscript(self, node):
+        var = self.compile(node.var)
+        get_index = self.compile_indices(node)
+
+        def subscript(frame):
+            value = var(frame)
+            index = get_index(frame)
+            try:
+                return value[index]
+            except (IndexError, TypeError) as e:
+                raise Exception(f"Subscript error: {e}")
+
+        return subscript
+
+    def compile_indices(self, node):
+        indices = node.index if isinstance(node.index, list) else [node.index]
+        getters = tuple(self.compile_index(idx_node) for idx_node in indices)
+
+        if len(getters) == 1:
+            return getters[0]
+        return lambda frame: tuple(getter(frame) for getter in getters)
+
+    def compile_index(self, idx_node):
+        if isinstance(idx_node, Slice):
+            start = self.compile_slice_bound(idx_node.start)
+            end = self.compile_slice_bound(idx_node.end)
+            return lambda frame: slice(start(frame), end(frame))
+        index = self.compile(idx_node)
+
+        def get_index(frame):
+            value = index(frame)
+            if isinstance(value, float):
+                value = int(value)
+            return value
+
+        return get_index
+
+    def compile_slice_bound(self, node):
+        if not node:
+            return lambda frame: None
+        return self.compile_index(node)
+
+    def is_constant(self, node):
+        if isinstance(node, (Number, String, Constant)):
+            return True
+        if isinstance(node, ListLiteral):
+            return all(self.is_constant(element) for element in node.elements)
+        return False
+
+    # Statements
+    def compile_Assign(self, node):
+        value = self.compile(node.right)
+        left = node.left
+        if isinstance(left, Subscript):
+            return self.compile_assign_item(left, value)
+        if left.scope in (LOCAL, PARAM):
+            slot = left.slot
+
+            def assign_local(frame):
+                frame[slot] = value(frame)
+
+            return assign_local
+        name = left.name
+        global_vars = self.globals
+
+        def assign_global(frame):
+            global_vars[name] = value(frame)
+
+        return assign_global
+
+    def compile_AugAssign(self, node):
+        value = self.compile(node.right)
+        apply = binary_operator(self.interpreter, node.op.type, node.op.value)
+        if isinstance(node.left, Subscript):
+            return self.compile_assign_item(node.left, value, apply)
+        var = node.left
+        take = self.compile_take(var.name, var.scope, var.slot)
+        store = self.compile_store(var.name, var.scope, var.slot)
+        op_value = node.op.value
+
+        def aug_assign(frame):
+            operand = value(frame)
+            container = take(frame)
+            store(frame, update_in_place(container, operand, op_value, apply))
+
+        return aug_assign
+
+    def compile_assign_item(self, target, value, apply=None):
+        get_index = self.compile_indices(target)
+        var = target.var
+        take = self.compile_take(var.name, var.scope, var.slot)
+        store = self.compile_store(var.name, var.scope, var.slot)
+
+        def assign_item(frame):
+            item = value(frame)
+            index = get_index(frame)
+            container = take(frame)
+            store(frame, store_item(container, index, item, apply))
+
+        return assign_item
+
+    def compile_Compound(self, node):
+        return self.compile_block(node.children)
+
+    def compile_NoOp(self, node):
+        return lambda frame: None
+
+    def compile_If(self, node):
+        condition = self.compile(node.condition)
+        true_block = self.compile_block(node.true_block)
+        false_block = self.compile_block(node.false_block or [])
+
+        def if_statement(frame):
+            if condition(frame):
+                return true_block(frame)
+            return false_block(frame)
+
+        return if_statement
+
+    def compile_While(self, node):
+        condition = self.compile(node.condition)
+        body = self.compile_block(node.body)
+
+        def while_statement(frame):
+            while condition(frame):
+                if body(frame) is RETURN:
+                    return RETURN
+
+        return while_statement
+
+    def compile_For(self, node):
+        iterable = self.compile(node.iterable)
+        body = self.compile_block(node.body)
+        store = self.compile_store(node.var, node.scope, node.slot)
+
+        def for_statement(frame):
+            for value in iterable(frame):
+                store(frame, value)
+                if body(frame) is RETURN:
+                    return RETURN
+
+        return for_statement
+
+    def compile_FunctionDef(self, node):
+        self.function_code(node)
+        store = self.compile_store(node.name, node.scope, node.slot)
+
+        def function_def(frame):
+            store(frame, node)
+
+        return function_def
+
+    def compile_Return(self, node):
+        value = self.compile(node.expr) if node.expr else (lambda frame: None)
+
+        def return_statement(frame):
+            self.return_value = value(frame)
+            return RETURN
+
+        return return_statement
+
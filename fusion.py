@@ -0,0 +1,294 @@
+from ast_nodes import *
+from ranges import Range
+from resolver import binding_counts
+from vectorizer import ELEMENTWISE_OPS, UFUNCS
+import numpy as np
+
+# Elements per chunk when a fused expression is forced: each intermediate
+# buffer is 32 KiB of float64, so a whole expression stays in cache. A
+# multiple of every SIMD width, so chunk boundaries never split a vector.
+CHUNK = 4096
+
+# Operators that show an expression is meant to work on whole arrays
+DOT_OPS = (".+", ".-", ".*", "./", ".^")
+
+
+class Unfusable(Exception):
+    pass
+
+
+class Fuser:
+    """
+    Replaces elementwise array expressions by a single call to the hidden
+    `$fuse` builtin.
+
+    A maximal tree of arithmetic operators, unary +/- and elementwise
+    builtins such as `sin` becomes one plan; the operands it bottoms out in
+    (variables, subscripts, pure calls) are evaluated as usual and passed
+    alongside it. Only trees with at least two operations and at least one
+    dotted operator are fused, since those mark array code; scalar
+    arithmetic stays on the normal path. Trees whose operands could have
+    side effects are left alone, so evaluation order is unchanged.
+
+    `$fuse` evaluates the plan in chunks of CHUNK elements, writing each
+    operation into a small reused buffer and the result into one
+    preallocated output, instead of materializing a full-size temporary for
+    every operation. Anything the chunked path does not cover exactly is
+    evaluated the ordinary way.
+    """
+
+    def __init__(self, pure_calls):
+        self.pure_calls = pure_calls
+
+    def optimize(self, nodes):
+        counts = binding_counts(nodes)
+        self.ufuncs = {name for name in UFUNCS if not counts[name]}
+        self.block(nodes)
+        return nodes
+
+    def block(self, nodes):
+        for i, node in enumerate(nodes or []):
+            if isinstance(node, (Assign, AugAssign)):
+                node.right = self.expression(node.right)
+            elif isinstance(node, If):
+                node.condition = self.expression(node.condition)
+                self.block(node.true_block)
+                self.block(node.false_block)
+            elif isinstance(node, While):
+                node.condition = self.expression(node.condition)
+                self.block(node.body)
+            elif isinstance(node, For):
+                node.iterable = self.expression(node.iterable)
+                self.block(node.body)
+            elif isinstance(node, FunctionDef):
+                self.block(node.body)
+            elif isinstance(node, Return):
+                if node.expr:
+                    node.expr = self.expression(node.expr)
+            elif isinstance(node, Compound):
+                self.block(node.children)
+            elif not isinstance(node, NoOp):
+                nodes[i] = copy_position(self.expression(node), node)
+
+    def is_operation(self, node):
+        if isinstance(node, BinOp):
+            return node.op.value in ELEMENTWISE_OPS
+        if isinstance(node, UnaryOp):
+            return getattr(node.op, "value", None) in ("+", "-")
+        if isinstance(node, FunctionCall):
+            return node.name in self.ufuncs and len(node.args) == 1
+        return False
+
+    def operations(self, node):
+        """Operation count of the fusable tree rooted at `node`, and whether it has a dotted operator."""
+        if not self.is_operation(node):
+            return 0, False
+        count, dotted = 1, isinstance(node, BinOp) and node.op.value in DOT_OPS
+        for child in self.operands(node):
+            child_count, child_dotted = self.operations(child)
+            count += child_count
+            dotted = dotted or child_dotted
+        return count, dotted
+
+    def operands(self, node):
+        if isinstance(node, BinOp):
+            return [node.left, node.right]
+        if isinstance(node, UnaryOp):
+            return [node.expr]
+        return node.args
+
+    def expression(self, node):
+        count, dotted = self.operations(node)
+        if count >= 2 and dotted:
+            leaves = []
+            try:
+                plan = self.plan(node, leaves)
+            except Unfusable:
+                pass
+            else:
+                return FunctionCall("$fuse", [Constant(plan)] + leaves)
+        if isinstance(node, BinOp):
+            node.left = self.expression(node.left)
+            node.right = self.expression(node.right)
+        elif isinstance(node, UnaryOp):
+            node.expr = self.expression(node.expr)
+        elif isinstance(node, FunctionCall):
+            node.args = [self.expression(arg) for arg in node.args]
+        elif isinstance(node, (ListLiteral, SetLiteral)):
+            node.elements = [self.expression(element) for element in node.elements]
+        elif isinstance(node, Hoisted):
+            node.expr = self.expression(node.expr)
+        return node
+
+    def plan(self, node, leaves):
+        if isinstance(node, BinOp) and self.is_operation(node):
+            left = self.plan(node.left, leaves)
+            return ("op", node.op.value, left, self.plan(node.right, leaves))
+        if isinstance(node, UnaryOp) and self.is_operation(node):
+            kind = "neg" if node.op.value == "-" else "pos"
+            return (kind, self.plan(node.expr, leaves))
+        if isinstance(node, FunctionCall) and self.is_operation(node):
+            return ("call", node.name, self.plan(node.args[0], leaves))
+        if isinstance(node, Number):
+            return ("const", float(node.value))
+        if isinstance(node, Constant) and type(node.value) in (int, float):
+            return ("const", node.value)
+        if not self.is_pure(node):
+            raise Unfusable()
+        leaves.append(node)
+        return ("leaf", len(leaves) - 1)
+
+    def is_pure(self, node):
+        if node is None or isinstance(node, (Variable, Number, String, Constant, Hoisted)):
+            return True
+        if isinstance(node, FunctionCall):
+            children = node.args if node.name in self.pure_calls else [False]
+        elif isinstance(node, BinOp):
+            children = [node.left, node.right]
+        elif isinstance(node, UnaryOp):
+            children = [node.expr]
+        elif isinstance(node, (ListLiteral, SetLiteral)):
+            children = node.elements
+        elif isinstance(node, Subscript):
+            children = node.index
+        elif isinstance(node, Slice):
+            children = [node.start, node.end]
+        else:
+            return False
+        return all(child is not False and self.is_pure(child) for child in children)
+
+
+class FusedEvaluator:
+    """The `$fuse` builtin: evaluates a fused plan for an interpreter."""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.binary_ops = {}
+
+    def __call__(self, plan, *leaves):
+        leaves = [np.asarray(leaf) if isinstance(leaf, Range) else leaf for leaf in leaves]
+        try:
+            program, shape = self.compile(plan, leaves)
+        except Unfusable:
+            return self.evaluate(plan, leaves)
+        return run_chunked(program, leaves, shape)
+
+    # Ordinary evaluation, with the interpreter's operator semantics
+    def evaluate(self, plan, leaves):
+        kind = plan[0]
+        if kind == "leaf":
+            return leaves[plan[1]]
+        if kind == "const":
+            return plan[1]
+        if kind == "op":
+            left = self.evaluate(plan[2], leaves)
+            right = self.evaluate(plan[3], leaves)
+            return self.binary_operator(plan[1])(left, right)
+        if kind == "neg":
+            return -self.evaluate(plan[1], leaves)
+        if kind == "pos":
+            return +self.evaluate(plan[1], leaves)
+        return UFUNCS[plan[1]](self.evaluate(plan[2], leaves))
+
+    def binary_operator(self, op_value):
+        if op_value not in self.binary_ops:
+            from interpreter import binary_operator
+
+            op_type = "EOP" if op_value.startswith(".") else "OP"
+            self.binary_ops[op_value] = binary_operator(
+                self.interpreter, op_type, op_value
+            )
+        return self.binary_ops[op_value]
+
+    # Chunked evaluation
+    def compile(self, plan, leaves):
+        """
+        Flattens a plan into steps over array operands, evaluating the
+        scalar-only parts up front. Raises Unfusable if the chunked path
+        would not match ordinary evaluation.
+        """
+        shape = None
+        for leaf in leaves:
+            if isinstance(leaf, np.ndarray):
+                if leaf.dtype.kind not in "iuf" or not leaf.flags.c_contiguous:
+                    raise Unfusable()
+                if shape is None:
+                    shape = leaf.shape
+                elif leaf.shape != shape:
+                    raise Unfusable()
+            elif isinstance(leaf, (bool, np.bool_)) or not isinstance(
+                leaf, (int, float, np.integer, np.floating)
+            ):
+                raise Unfusable()
+        if shape is None or int(np.prod(shape)) <= CHUNK:
+            raise Unfusable()
+        steps = []
+        self.flatten(plan, leaves, steps)
+        return steps, shape
+
+    def flatten(self, plan, leaves, steps):
+        """Appends the steps for `plan`; returns its operand reference."""
+        kind = plan[0]
+        if kind == "leaf":
+            if isinstance(leaves[plan[1]], np.ndarray):
+                return ("leaf", plan[1])
+            return ("value", leaves[plan[1]])
+        if kind == "const":
+            return ("value", plan[1])
+        if kind == "op":
+            left = self.flatten(plan[2], leaves, steps)
+            right = self.flatten(plan[3], leaves, steps)
+            if left[0] == "value" and right[0] == "value":
+                value = self.binary_operator(plan[1])(left[1], right[1])
+                return ("value", value)
+            if plan[1] == "*" and left[0] != "value" and right[0] != "value":
+                # `*` of two arrays is a matrix product
+                raise Unfusable()
+            steps.append((ELEMENTWISE_OPS[plan[1]], left, right))
+        else:
+            operand = self.flatten(plan[-1], leaves, steps)
+            if operand[0] == "value":
+                return ("value", self.scalar(plan, operand[1]))
+            fn = {"neg": np.negative, "pos": np.positive}.get(kind)
+            steps.append((fn or UFUNCS[plan[1]], operand))
+        return ("step", len(steps) - 1)
+
+    def scalar(self, plan, value):
+        if plan[0] == "neg":
+            return -value
+        if plan[0] == "pos":
+            return +value
+        return UFUNCS[plan[1]](value)
+
+
+def run_chunked(steps, leaves, shape):
+    flat = [leaf.reshape(-1) if isinstance(leaf, np.ndarray) else leaf for leaf in leaves]
+    size = int(np.prod(shape))
+    buffers = None
+    out = None
+    for start in range(0, size, CHUNK):
+        stop = min(start + CHUNK, size)
+        length = stop - start
+        results = []
+        for i, (fn, *operands) in enumerate(steps):
+            args = []
+            for kind, ref in operands:
+                if kind == "leaf":
+                    args.append(flat[ref][start:stop])
+                elif kind == "value":
+                    args.append(ref)
+                else:
+                    args.append(results[ref])
+            if buffers is None:
+                results.append(fn(*args))
+            elif i == len(steps) - 1:
+                results.append(fn(*args, out=out[start:stop]))
+            else:
+                results.append(fn(*args, out=buffers[i][:length]))
+        if buffers is None:
+            # The first chunk fixes each step's dtype; later chunks reuse
+            # buffers of those dtypes
+            buffers = [np.empty(CHUNK, result.dtype) for result in results[:-1]]
+            out = np.empty(size, results[-1].dtype)
+            out[start:stop] = results[-1]
+    return out.reshape(shape)
@@ -0,0 +1,457 @@
+from ast_nodes import *
+from resolver import binding_counts
+from vectorizer import UFUNCS
+import numpy as np
+
+# Kinds of value an expression can be inferred to have
+NUMBER = "number"  # int or float scalar
+ARRAY = "array"  # ndarray (or range); Type.shape says what is known of its shape
+SET = "set"
+STRING = "string"
+UNKNOWN = "unknown"
+
+# Operators with an arithmetic meaning, as opposed to logic and comparison
+ARITHMETIC_OPS = ("+", "-", "*", "/", "^", ".+", ".-", ".*", "./", ".^")
+
+# Builtins that reduce an array to a single number
+REDUCTIONS = ("mean", "median", "std", "det")
+
+# Give up after this many passes; inference then reports nothing
+MAX_PASSES = 50
+
+
+class Type:
+    """
+    What is known about a value: its kind and, for arrays, its shape. The
+    shape is None when the rank is unknown, otherwise a tuple whose entries
+    are None for dimensions of unknown size.
+    """
+
+    def __init__(self, kind, shape=None):
+        self.kind = kind
+        self.shape = shape
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Type)
+            and self.kind == other.kind
+            and self.shape == other.shape
+        )
+
+    def __hash__(self):
+        return hash((self.kind, self.shape))
+
+    def __repr__(self):
+        if self.kind != ARRAY:
+            return self.kind
+        return f"array{format_shape(self.shape)}"
+
+    def join(self, other):
+        """The most precise type that covers both `self` and `other`."""
+        if other is None or other == self:
+            return self
+        if self.kind != ARRAY or other.kind != ARRAY:
+            return UNKNOWN_TYPE
+        if self.shape is None or other.shape is None or len(self.shape) != len(other.shape):
+            return Type(ARRAY)
+        return Type(ARRAY, tuple(a if a == b else None for a, b in zip(self.shape, other.shape)))
+
+
+NUMBER_TYPE = Type(NUMBER)
+SET_TYPE = Type(SET)
+STRING_TYPE = Type(STRING)
+UNKNOWN_TYPE = Type(UNKNOWN)
+
+
+def join(a, b):
+    return b if a is None else a.join(b)
+
+
+def format_shape(shape):
+    if shape is None:
+        return "(?)"
+    dims = ["?" if dim is None else str(dim) for dim in shape]
+    if len(dims) == 1:
+        return f"({dims[0]},)"
+    return f"({', '.join(dims)})"
+
+
+def array(shape):
+    return NUMBER_TYPE if shape == () else Type(ARRAY, tuple(shape))
+
+
+def literal_int(node):
+    """The value of a number literal that is a whole number, or None."""
+    value = getattr(node, "value", None)
+    if isinstance(node, (Number, Constant)) and type(value) in (int, float):
+        if float(value).is_integer():
+            return int(value)
+    return None
+
+
+def value_type(value):
+    """The type of a value computed ahead of time (a Constant)."""
+    if isinstance(value, bool):
+        return UNKNOWN_TYPE
+    if isinstance(value, (int, float)):
+        return NUMBER_TYPE
+    if isinstance(value, np.ndarray):
+        return Type(ARRAY, value.shape)
+    if isinstance(value, set):
+        return SET_TYPE
+    if isinstance(value, str):
+        return STRING_TYPE
+    return UNKNOWN_TYPE
+
+
+class Inference:
+    """
+    Infers the type of every expression in a program, storing it as `type`
+    on the node, and collects the shape errors the program is certain to
+    hit when it reaches the expression that contains them.
+
+    The analysis is flow-insensitive, like MathPy's dynamic scoping demands:
+    a name has one type for the whole program, covering every value any
+    assignment, loop, or call (for parameters) binds it to. User function
+    calls have the type of every value their `return` statements give. The
+    passes repeat until no name's type changes.
+
+    Types are hints: the engines check the runtime values before taking a
+    path specialized for them (see specialized_operator in interpreter.py).
+    """
+
+    def infer(self, nodes, names=None):
+        self.counts = binding_counts(nodes)
+        self.names = dict(names or {})
+        self.returns = {}
+        self.function_stack = []
+        self.functions = {}
+        self.collect_functions(nodes)
+        for _ in range(MAX_PASSES):
+            self.changed = False
+            self.errors = []
+            self.block(nodes)
+            if not self.changed:
+                return self.errors
+        return []
+
+    def collect_functions(self, nodes):
+        for node in nodes or []:
+            if isinstance(node, FunctionDef):
+                self.functions.setdefault(node.name, []).append(node)
+                self.collect_functions(node.body)
+            elif isinstance(node, If):
+                self.collect_functions(node.true_block)
+                self.collect_functions(node.false_block)
+            elif isinstance(node, (While, For)):
+                self.collect_functions(node.body)
+            elif isinstance(node, Compound):
+                self.collect_functions(node.children)
+
+    def bind(self, name, type_):
+        if type_ is None:
+            return
+        joined = join(self.names.get(name), type_)
+        if joined != self.names.get(name):
+            self.names[name] = joined
+            self.changed = True
+
+    def set_return(self, name, type_):
+        joined = join(self.returns.get(name), type_)
+        if joined != self.returns.get(name):
+            self.returns[name] = joined
+            self.changed = True
+
+    def error(self, message):
+        if message not in self.errors:
+            self.errors.append(message)
+
+    # Statements
+    def block(self, nodes):
+        for node in nodes or []:
+            self.statement(node)
+
+    def statement(self, node):
+        if isinstance(node, Assign):
+            right = self.expression(node.right)
+            if isinstance(node.left, Subscript):
+                self.expression(node.left)
+            else:
+                self.bind(node.left.name, right)
+        elif isinstance(node, AugAssign):
+            right = self.expression(node.right)
+            left = self.expression(node.left)
+            result = self.binop(node.op.type, node.op.value, left, right)
+            if isinstance(node.left, Variable):
+                self.bind(node.left.name, result)
+        elif isinstance(node, If):
+            self.expression(node.condition)
+            self.block(node.true_block)
+            self.block(node.false_block)
+        elif isinstance(node, While):
+            self.expression(node.condition)
+            self.block(node.body)
+        elif isinstance(node, For):
+            self.bind(node.var, self.element_type(self.expression(node.iterable)))
+            self.block(node.body)
+        elif isinstance(node, FunctionDef):
+            self.bind(node.name, UNKNOWN_TYPE)
+            self.function_stack.append(node.name)
+            self.block(node.body)
+            if not node.body or not isinstance(node.body[-1], Return):
+                # Falling off the end returns None
+                self.set_return(node.name, UNKNOWN_TYPE)
+            self.function_stack.pop()
+        elif isinstance(node, Return):
+            value = self.expression(node.expr) if node.expr else UNKNOWN_TYPE
+            if self.function_stack:
+                self.set_return(self.function_stack[-1], value)
+        elif isinstance(node, Compound):
+            self.block(node.children)
+        elif not isinstance(node, NoOp):
+            self.expression(node)
+
+    def element_type(self, iterable):
+        """The type of the loop variable of a for-loop over `iterable`."""
+        if iterable is None:
+            return None
+        if iterable.kind != ARRAY or iterable.shape is None:
+            return UNKNOWN_TYPE
+        return array(iterable.shape[1:])
+
+    # Expressions
+    def expression(self, node):
+        method = getattr(self, "expr_" + type(node).__name__, None)
+        type_ = method(node) if method else UNKNOWN_TYPE
+        node.type = type_ or UNKNOWN_TYPE
+        return type_
+
+    def expr_Number(self, node):
+        return NUMBER_TYPE
+
+    def expr_String(self, node):
+        return STRING_TYPE
+
+    def expr_Constant(self, node):
+        return value_type(node.value)
+
+    def expr_Variable(self, node):
+        if not self.counts[node.name] and node.name not in self.names:
+            # A builtin, or a name the program never binds
+            return NUMBER_TYPE if node.name == "pi" else UNKNOWN_TYPE
+        return self.names.get(node.name)
+
+    def expr_Hoisted(self, node):
+        return self.expression(node.expr)
+
+    def expr_BinOp(self, node):
+        left = self.expression(node.left)
+        right = self.expression(node.right)
+        return self.binop(node.op.type, node.op.value, left, right)
+
+    def expr_UnaryOp(self, node):
+        operand = self.expression(node.expr)
+        if getattr(node.op, "value", None) in ("+", "-"):
+            return operand
+        return UNKNOWN_TYPE
+
+    def expr_ListLiteral(self, node):
+        elements = [self.expression(element) for element in node.elements]
+        if any(element is None for element in elements):
+            return None
+        if all(element == NUMBER_TYPE for element in elements):
+            return Type(ARRAY, (len(elements),))
+        first = elements[0]
+        if first.kind == ARRAY and first.shape is not None and all(
+            element == first for element in elements
+        ):
+            return Type(ARRAY, (len(elements),) + first.shape)
+        return UNKNOWN_TYPE
+
+    def expr_SetLiteral(self, node):
+        for element in node.elements:
+            self.expression(element)
+        return SET_TYPE
+
+    def expr_Subscript(self, node):
+        var = self.expression(node.var)
+        indices = node.index if isinstance(node.index, list) else [node.index]
+        shape = []
+        dims = var.shape if var is not None and var.kind == ARRAY else None
+        pending = var is None
+        for position, index in enumerate(indices):
+            if isinstance(index, Slice):
+                for bound in (index.start, index.end):
+                    if bound is not None:
+                        self.expression(bound)
+                if dims is not None and position < len(dims):
+                    full = index.start is None and index.end is None
+                    shape.append(dims[position] if full else None)
+            else:
+                index_type = self.expression(index)
+                pending = pending or index_type is None
+                if index_type != NUMBER_TYPE:
+                    dims = None
+        if pending:
+            return None
+        if dims is None or len(indices) > len(dims):
+            return UNKNOWN_TYPE
+        return array(tuple(shape) + dims[len(indices) :])
+
+    def expr_Slice(self, node):
+        return UNKNOWN_TYPE
+
+    def expr_FunctionCall(self, node):
+        args = [self.expression(arg) for arg in node.args]
+        name = node.name
+        if name in self.functions:
+            for func in self.functions[name]:
+                if len(func.params) == len(args):
+                    for param, arg in zip(func.params, args):
+                        self.bind(param, arg)
+            if self.counts[name] > len(self.functions[name]):
+                return UNKNOWN_TYPE
+            return self.returns.get(name)
+        if self.counts[name]:
+            return UNKNOWN_TYPE
+        if any(arg is None for arg in args):
+            return None
+        return self.builtin(name, node.args, args)
+
+    def builtin(self, name, nodes, args):
+        if name in UFUNCS and len(args) == 1:
+            return args[0] if args[0].kind in (NUMBER, ARRAY) else UNKNOWN_TYPE
+        if name in REDUCTIONS and len(args) == 1:
+            return NUMBER_TYPE if args[0].kind in (NUMBER, ARRAY) else UNKNOWN_TYPE
+        if name == "inv" and len(args) == 1:
+            return args[0] if args[0].kind == ARRAY else UNKNOWN_TYPE
+        if name == "range" and 1 <= len(args) <= 3:
+            bounds = [literal_int(arg) for arg in nodes]
+            if len(bounds) < 3:
+                bounds = ([0] if len(bounds) == 1 else []) + bounds + [1]
+            if None in bounds or bounds[2] == 0:
+                return Type(ARRAY, (None,))
+            start, stop, step = bounds
+            return Type(ARRAY, (max(-((start - stop) // step), 0),))
+        if name == "linspace" and len(args) == 3:
+            num = literal_int(nodes[2])
+            return Type(ARRAY, (num,)) if num is None or num >= 0 else UNKNOWN_TYPE
+        if name in ("zeros", "ones") and args:
+            dims = tuple(literal_int(arg) for arg in nodes)
+            if any(dim is not None and dim < 0 for dim in dims):
+                return UNKNOWN_TYPE
+            return Type(ARRAY, dims)
+        if name == "$fuse":
+            return self.plan_type(nodes[0].value, args[1:])
+        return UNKNOWN_TYPE
+
+    def plan_type(self, plan, leaves):
+        """The type of a fused expression (see fusion.py)."""
+        kind = plan[0]
+        if kind == "leaf":
+            return leaves[plan[1]]
+        if kind == "const":
+            return NUMBER_TYPE
+        if kind == "op":
+            left = self.plan_type(plan[2], leaves)
+            right = self.plan_type(plan[3], leaves)
+            op_type = "EOP" if plan[1].startswith(".") else "OP"
+            return self.binop(op_type, plan[1], left, right)
+        operand = self.plan_type(plan[-1], leaves)
+        return operand if operand.kind in (NUMBER, ARRAY) else UNKNOWN_TYPE
+
+    # Operators
+    def binop(self, op_type, op_value, left, right):
+        if left is None or right is None:
+            return None
+        if left.kind == SET and right.kind == SET:
+            return SET_TYPE if op_value in ("|", "&", "-") else UNKNOWN_TYPE
+        if op_value in ("and", "or"):
+            return UNKNOWN_TYPE
+        numeric = (NUMBER, ARRAY)
+        if left.kind not in numeric or right.kind not in numeric:
+            return UNKNOWN_TYPE
+        if op_type == "COMPARE":
+            if left.kind == NUMBER and right.kind == NUMBER:
+                return UNKNOWN_TYPE
+            return self.broadcast(op_value, left, right)
+        if op_value not in ARITHMETIC_OPS:
+            return UNKNOWN_TYPE
+        if op_value == "*" and left.kind == ARRAY and right.kind == ARRAY:
+            return self.matrix_product(left, right)
+        return self.broadcast(op_value, left, right)
+
+    def broadcast(self, op_value, left, right):
+        if left.kind == NUMBER and right.kind == NUMBER:
+            return NUMBER_TYPE
+        if left.kind == NUMBER:
+            return right
+        if right.kind == NUMBER:
+            return left
+        if left.shape is None or right.shape is None:
+            return Type(ARRAY)
+        shape = []
+        a_shape, b_shape = left.shape, right.shape
+        rank = max(len(a_shape), len(b_shape))
+        a_shape = (1,) * (rank - len(a_shape)) + a_shape
+        b_shape = (1,) * (rank - len(b_shape)) + b_shape
+        for a, b in zip(a_shape, b_shape):
+            if a is not None and b is not None and a != b and 1 not in (a, b):
+                self.error(
+                    f"`{op_value}` cannot combine arrays of shapes "
+                    f"{format_shape(left.shape)} and {format_shape(right.shape)}"
+                )
+                return Type(ARRAY)
+            if a == 1:
+                shape.append(b)
+            elif b == 1:
+                shape.append(a)
+            else:
+                shape.append(a if a is not None else b)
+        return Type(ARRAY, tuple(shape))
+
+    def matrix_product(self, left, right):
+        """The type of `*` on two arrays, which is np.dot."""
+        a, b = left.shape, right.shape
+        if a is None or b is None or not (1 <= len(a) <= 2 and 1 <= len(b) <= 2):
+            return Type(ARRAY)
+        inner_a, inner_b = a[-1], b[0]
+        if inner_a is not None and inner_b is not None and inner_a != inner_b:
+            self.error(
+                f"`*` cannot multiply arrays of shapes {format_shape(a)} and "
+                f"{format_shape(b)}: {inner_a} columns against {inner_b} rows"
+            )
+            return Type(ARRAY)
+        return array(a[:-1] + b[1:])
+
+
+def runtime_type(value):
+    """
+    The type of a runtime value, down to the rank of arrays: what a
+    specialized version of a function is compiled for.
+    """
+    # Loops over ranges bind NumPy scalars, as np.arange's elements are
+    if type(value) in (int, float) or isinstance(value, (np.integer, np.floating)):
+        return NUMBER_TYPE
+    if type(value) is np.ndarray and value.ndim in (1, 2):
+        return Type(ARRAY, (None,) * value.ndim)
+    return UNKNOWN_TYPE
+
+
+def inferred_kind(node):
+    """The kind inference tagged an expression with, UNKNOWN if it never ran."""
+    type_ = getattr(node, "type", None)
+    return UNKNOWN if type_ is None else type_.kind
+
+
+def infer(nodes):
+    """Tags every expression in `nodes` with its type; returns the shape errors found."""
+    return Inference().infer(nodes)
+
+
+def infer_function(func, param_types):
+    """
+    Tags the body of `func` for calls whose arguments have `param_types`.
+    Names the function reads but does not bind are unknown.
+    """
+    Inference().infer(func.body, dict(zip(func.params, param_types)))
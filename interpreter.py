@@ -2,8 +2,17 @@ from ast_nodes import *
 import numpy as np
 import operator
 import math
-import matplotlib.pyplot as plt
+import copy
 import sys
+import builtin_modules
+import fusion
+import memo
+import vectorizer
+from inference import ARRAY, NUMBER, infer, infer_function, inferred_kind, runtime_type
+from resolver import resolve
+from memo import DEFAULT_CAPACITY, MISSING, MemoTable
+from ranges import Range
+from builtin_modules import LAZY_BUILTINS
 
 
 class Environment:
@@ -16,6 +25,10 @@ class Environment:
             return self.vars[name]
         elif self.parent:
             return self.parent.get(name)
+        elif name in LAZY_BUILTINS:
+            # Only the global environment has no parent
+            value = self.vars[name] = LAZY_BUILTINS[name].load()[name]
+            return value
         else:
             raise NameError(f"Name {name} is not defined")
 
@@ -31,17 +44,358 @@ class Environment:
             self.vars[name] = value
 
 
+SET_OPS = {"|": set.union, "&": set.intersection, "-": set.difference}
+
+COMPARE_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+
+
+def binary_operator(interpreter, op_type, op_value):
+    """
+    Returns a two-argument function with the same semantics as visit_BinOp
+    for the given operator token, for engines that resolve operators ahead
+    of time.
+    """
+    set_op = SET_OPS.get(op_value)
+
+    if op_value in ("and", "or"):
+        is_and = op_value == "and"
+
+        def apply(l, r):
+            if isinstance(l, set) and isinstance(r, set):
+                raise Exception(f"Unsupported set operator {op_value}")
+            if is_and:
+                return bool(l) and bool(r)
+            return bool(l) or bool(r)
+
+        return apply
+
+    if op_type == "COMPARE":
+        fn = COMPARE_OPS[op_value]
+
+        def apply(l, r):
+            if isinstance(l, set) and isinstance(r, set):
+                raise Exception(f"Unsupported set operator {op_value}")
+            return fn(l, r)
+
+        return apply
+
+    fn = interpreter.arithmetic_ops().get(op_value)
+
+    def apply(l, r):
+        if isinstance(l, set) and isinstance(r, set):
+            if set_op is None:
+                raise Exception(f"Unsupported set operator {op_value}")
+            return set_op(l, r)
+        if fn is None:
+            raise Exception(f"Unsupported operator {op_value}")
+        result = fn(l, r)
+        if isinstance(result, float) and result.is_integer():
+            return int(result)
+        return result
+
+    return apply
+
+
+# Runtime types an operand inference.py tagged with a kind must have for
+# specialized_operator's direct path
+KIND_TYPES = {NUMBER: (int, float), ARRAY: (np.ndarray,)}
+
+# What each arithmetic operator computes once its operands are known to be
+# plain numbers or arrays; `*` of two arrays is np.dot instead
+SPECIALIZED_OPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "^": operator.pow,
+    ".+": np.add,
+    ".-": np.subtract,
+    ".*": np.multiply,
+    "./": np.divide,
+    ".^": np.power,
+}
+
+
+def specialization(op_value, left_kind, right_kind):
+    """
+    For an arithmetic operator whose operands were inferred to be of the
+    given kinds: the function computing it directly and the runtime types
+    each operand must have for that, or None when there is no such path.
+    """
+    fn = SPECIALIZED_OPS.get(op_value)
+    if fn is None or left_kind not in KIND_TYPES or right_kind not in KIND_TYPES:
+        return None
+    if op_value == "*" and left_kind == right_kind == ARRAY:
+        fn = np.dot
+    return fn, KIND_TYPES[left_kind], KIND_TYPES[right_kind]
+
+
+def specialized_operator(interpreter, op_type, op_value, left_kind, right_kind):
+    """
+    Like binary_operator, for operands inferred to be of the given kinds:
+    operands of the expected runtime types skip the set and matrix checks,
+    anything else takes the binary_operator path. None when specialization
+    has nothing for these kinds.
+    """
+    specialized = specialization(op_value, left_kind, right_kind)
+    if specialized is None:
+        return None
+    fn, left_types, right_types = specialized
+    generic = binary_operator(interpreter, op_type, op_value)
+
+    def apply(l, r):
+        if type(l) in left_types and type(r) in right_types:
+            result = fn(l, r)
+            if isinstance(result, float) and result.is_integer():
+                return int(result)
+            return result
+        return generic(l, r)
+
+    return apply
+
+
+# Compound assignments whose array meaning is a ufunc, so they can write
+# into the target array; `*` only when the value is not an array as well
+IN_PLACE_UFUNCS = {
+    "+": np.add,
+    ".+": np.add,
+    "-": np.subtract,
+    ".-": np.subtract,
+    "*": np.multiply,
+    ".*": np.multiply,
+    "/": np.divide,
+    "./": np.divide,
+    "^": np.power,
+    ".^": np.power,
+}
+
+
+def _refcount(value):
+    return sys.getrefcount(value)
+
+
+def _unshared_refcount():
+    value = np.empty(0)
+    return _refcount(value)
+
+
+# What sys.getrefcount reports inside store_item and update_in_place for an
+# array that nothing but one local variable of their caller refers to
+UNSHARED_REFCOUNT = _unshared_refcount()
+
+
+def fits(value, dtype):
+    """Whether `value` can be stored in an array of `dtype` without change."""
+    if np.result_type(dtype, value) == dtype:
+        return True
+    value = np.asarray(value)
+    if dtype.kind not in "iu" or value.dtype.kind != "f":
+        return False
+    # Integral floats, such as every number literal, fit integer arrays
+    info = np.iinfo(dtype)
+    integral = value == np.floor(value)
+    return bool(np.all(integral & (value >= info.min) & (value < info.max + 1)))
+
+
+def store_item(container, index, value, apply=None):
+    """
+    Returns `container` with the element or slice at `index` set to `value`,
+    or to `apply(container[index], value)` for a compound assignment.
+
+    Assignment never changes the value of another variable: the engines
+    release the target variable's own reference before calling this, so an
+    array that is still referenced elsewhere (another variable, a cached
+    expression, a view) is copied first, and one that is not is updated in
+    place. The copy is also widened when `value` does not fit its dtype.
+    """
+    owned = sys.getrefcount(container) <= UNSHARED_REFCOUNT
+    if isinstance(container, Range):
+        container, owned = np.array(container), True
+    if isinstance(value, Range):
+        value = np.asarray(value)
+    if not isinstance(container, np.ndarray):
+        raise Exception(
+            f"Subscript error: {type(container).__name__} does not support item assignment"
+        )
+    try:
+        if apply is not None:
+            value = apply(container[index], value)
+        dtype = container.dtype
+        if isinstance(value, (np.ndarray, np.generic, int, float, complex)):
+            if not fits(value, dtype):
+                dtype = np.result_type(dtype, value)
+        if dtype != container.dtype or not (
+            owned and container.base is None and container.flags.writeable
+        ):
+            container = container.astype(dtype)
+        container[index] = value
+    except (IndexError, TypeError, ValueError) as e:
+        raise Exception(f"Subscript error: {e}")
+    return container
+
+
+def update_in_place(container, value, op_value, apply):
+    """
+    The result of `container op value` for a compound assignment, where
+    `apply` computes it the ordinary way. Like store_item, an array that
+    nothing else references is reused as the output when the result has the
+    same shape and dtype.
+    """
+    owned = sys.getrefcount(container) <= UNSHARED_REFCOUNT
+    ufunc = IN_PLACE_UFUNCS.get(op_value)
+    if (
+        owned
+        and ufunc is not None
+        and isinstance(container, np.ndarray)
+        and container.base is None
+        and container.flags.writeable
+        and not (op_value == "*" and isinstance(value, (np.ndarray, Range)))
+    ):
+        try:
+            shape = np.broadcast_shapes(container.shape, np.shape(value))
+            if shape == container.shape:
+                return ufunc(container, value, out=container, casting="safe")
+        except (TypeError, ValueError):
+            pass
+    return apply(container, value)
+
+
+class _Return:
+    def __repr__(self):
+        return "<return>"
+
+
+# Returned by statement visitors once a `return` has run; the value itself is
+# left in Interpreter.return_value for the enclosing call to pick up.
+RETURN = _Return()
+
+
+# Whether each callable registered in Interpreter.setup_builtins is free of
+# side effects and returns equal results for equal arguments. Only pure
+# calls may be cached or moved by the optimizer.
+BUILTIN_PURITY = {
+    "print": False,
+    "sin": True,
+    "cos": True,
+    "tan": True,
+    "exp": True,
+    "ln": True,
+    "log10": True,
+    "log2": True,
+    "sqrt": True,
+    "range": True,
+    "zeros": True,
+    "ones": True,
+    "linspace": True,
+    "mean": True,
+    "median": True,
+    "std": True,
+    "det": True,
+    "inv": True,
+    "eig": True,
+    "ceil": True,
+    "floor": True,
+    "abs": True,
+    "round": True,
+    "memoize": False,
+    # Only meaningful at the call sites the optimizer generates
+    "$vectorizable": False,
+    "$vectorized": False,
+    "$fuse": False,
+}
+
+
+def referenced_names(nodes):
+    """
+    The names a program reads or calls, except `plot` and `vmap`, which
+    every engine handles itself.
+    """
+    names = set()
+    for node in memo.walk(nodes):
+        if isinstance(node, Variable):
+            names.add(node.name)
+        elif isinstance(node, FunctionCall) and node.name not in ("plot", "vmap"):
+            names.add(node.name)
+    return names
+
+
+def check_arity(func_name, params, args):
+    if len(args) != len(params):
+        raise Exception(
+            f"{func_name}() takes {len(params)} arguments ({len(args)} given)"
+        )
+
+
+# Calls with the same argument types after which the tree engine compiles
+# a user function specialized for those types
+TIER_THRESHOLD = 50
+
+# Most specialized versions compiled per function
+MAX_VARIANTS = 4
+
+
+class TierStats:
+    """Counts of what tiered execution did during a tree engine run."""
+
+    def __init__(self):
+        self.promoted = 0  # functions with at least one compiled version
+        self.variants = 0  # compiled versions, over all functions
+        self.compiled_calls = 0  # calls run by a compiled version
+        self.guard_failures = 0  # calls to a promoted function whose
+        # argument types matched none of its compiled versions
+
+    def __str__(self):
+        return (
+            f"{self.promoted} functions promoted ({self.variants} versions), "
+            f"{self.compiled_calls} compiled calls, "
+            f"{self.guard_failures} guard failures"
+        )
+
+
 class Interpreter:
-    def __init__(self, output_stream=None):
+    ENGINES = ("tree", "closure", "python", "vm")
+
+    def __init__(
+        self, output_stream=None, engine="tree", memo_capacity=DEFAULT_CAPACITY
+    ):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}")
         self.global_env = Environment()
         self.setup_builtins()
-        self.output_stream = output_stream or sys.stdout
+        # None prints to whatever sys.stdout is at the time
+        self.output_stream = output_stream
+        self.engine = engine
+        self.return_value = None
+        # Environments of finished calls, reused by later calls
+        self.free_envs = []
+        # Operator functions, by token and inferred operand kinds
+        self.binary_ops = {}
+        # Tiered execution: calls per (function, argument types), and the
+        # compiled versions of each hot function by argument types
+        self.call_counts = {}
+        self.variants = {}
+        self.compiler = None
+        self.tier_stats = TierStats()
+        self.tier_threshold = TIER_THRESHOLD
+        # vmap plans of user functions, None for those that do not lift
+        self.lifts = {}
+        # Result caches of memoized functions, by function
+        self.memo_capacity = memo_capacity
+        self.memo_tables = {}
 
     def setup_builtins(self):
-        # Add built-in functions to the global environment
+        # Add built-in functions to the global environment; those in
+        # builtin_modules are added on first lookup
         self.global_env.vars.update(
             {
-                "print": print,
+                "print": self.print_wrapper,
                 "sin": np.sin,
                 "cos": np.cos,
                 "tan": np.tan,
@@ -55,21 +409,46 @@ class Interpreter:
                 "ones": self.ones_wrapper,
                 "linspace": self.linspace_wrapper,
                 "pi": math.pi,
-                "mean": np.mean,
-                "median": np.median,
-                "std": np.std,
-                "det": np.linalg.det,
-                "inv": np.linalg.inv,
-                "eig": np.linalg.eig,
                 "ceil": np.ceil,
                 "floor": np.floor,
                 "abs": np.abs,
                 "round": np.round,
+                "memoize": self.memoize_wrapper,
                 "True": True,
                 "False": False,
+                # Hidden helpers for loops rewritten by the vectorizer
+                "$vectorizable": vectorizer.vectorizable,
+                "$vectorized": vectorizer.vectorized,
+                "$fuse": fusion.FusedEvaluator(self),
             }
         )
 
+    def reset(self):
+        """
+        Forgets everything the programs run so far defined or compiled, so
+        that the next program starts from fresh globals. Imported builtin
+        modules and operator functions are kept.
+        """
+        self.global_env = Environment()
+        self.setup_builtins()
+        self.return_value = None
+        self.call_counts = {}
+        self.variants = {}
+        self.compiler = None
+        self.tier_stats = TierStats()
+        self.lifts = {}
+        self.memo_tables = {}
+
+    def load_builtins(self, names):
+        """
+        Loads the lazy builtins among `names`, for engines that read the
+        global variables directly instead of through Environment.get.
+        """
+        global_vars = self.global_env.vars
+        for name in names:
+            if name in LAZY_BUILTINS and name not in global_vars:
+                self.global_env.get(name)
+
     def visit(self, node, env):
         method_name = "visit_" + type(node).__name__
         method = getattr(self, method_name, self.generic_visit)
@@ -79,8 +458,52 @@ class Interpreter:
         raise Exception(f"No visit_{type(node).__name__} method")
 
     def interpret(self, nodes):
+        self.load_builtins(referenced_names(nodes))
+        if self.engine == "closure":
+            from compiler import Compiler
+
+            program = Compiler(self).compile_program(nodes)
+            program()
+            return
+        if self.engine == "python":
+            import codegen
+
+            codegen.execute(self, codegen.compile_program(self, nodes))
+            return
+        if self.engine == "vm":
+            import vm
+
+            vm.VM(self).execute(vm.compile_program(self, nodes))
+            return
+        # Slots for the closure compiler, which runs hot functions
+        resolve(nodes)
+        infer(nodes)
+        memo.check(nodes)
         for node in nodes:
-            self.visit(node, self.global_env)
+            if self.visit(node, self.global_env) is RETURN:
+                raise ReturnException(self.return_value)
+
+    def interpret_stream(self, statements):
+        """
+        Runs each top-level statement as soon as `statements` yields it, so
+        the whole program is never held in memory. Only the tree engine runs
+        programs this way, and it does not compile hot functions, whose
+        scopes depend on the rest of the program.
+        """
+        if self.engine != "tree":
+            raise ValueError(f"The {self.engine} engine cannot run a stream")
+        self.tier_threshold = math.inf
+        functions = []
+        for node in statements:
+            nodes = [node]
+            self.load_builtins(referenced_names(nodes))
+            infer(nodes)
+            # A memoized function may only call functions defined before it
+            memo.check(functions + nodes)
+            if isinstance(node, FunctionDef):
+                functions.append(node)
+            if self.visit(node, self.global_env) is RETURN:
+                raise ReturnException(self.return_value)
 
     # Visitor methods for AST nodes
     def visit_Number(self, node, env):
@@ -93,61 +516,37 @@ class Interpreter:
     def visit_String(self, node, env):
         return node.value
 
+    def visit_Constant(self, node, env):
+        return node.value
+
+    def visit_Hoisted(self, node, env):
+        value = env.get(node.name)
+        if value is None:
+            value = self.visit(node.expr, env)
+            env.set(node.name, value)
+        return value
+
     def visit_BinOp(self, node, env):
         left = self.visit(node.left, env)
         right = self.visit(node.right, env)
-        op_value = node.op.value
-
-        if isinstance(left, set) and isinstance(right, set):
-            if op_value == "|":
-                return left.union(right)
-            elif op_value == "&":
-                return left.intersection(right)
-            elif op_value == "-":
-                return left.difference(right)
-            else:
-                raise Exception(f"Unsupported set operator {op_value}")
-        elif op_value in ("and", "or"):
-            left = bool(left)
-            right = bool(right)
-            if op_value == "and":
-                return left and right
-            elif op_value == "or":
-                return left or right
-        elif node.op.type == "COMPARE":
-            ops = {
-                "==": operator.eq,
-                "!=": operator.ne,
-                "<": operator.lt,
-                ">": operator.gt,
-                "<=": operator.le,
-                ">=": operator.ge,
-            }
-            return ops[op_value](left, right)
-        else:
-            ops = {
-                "+": operator.add,
-                "-": operator.sub,
-                "*": self.multiply,
-                "/": operator.truediv,
-                "^": operator.pow,
-                ".+": self.elementwise_add,
-                ".-": self.elementwise_sub,
-                ".*": self.elementwise_mul,
-                "./": self.elementwise_div,
-                ".^": self.elementwise_pow,
-            }
-
-            if op_value in ops:
-                result = ops[op_value](left, right)
-                if isinstance(result, float) and result.is_integer():
-                    result = int(result)
-                return result
-            else:
-                raise Exception(f"Unsupported operator {op_value}")
+        return self.operator_for(node)(left, right)
+
+    def arithmetic_ops(self):
+        return {
+            "+": operator.add,
+            "-": operator.sub,
+            "*": self.multiply,
+            "/": operator.truediv,
+            "^": operator.pow,
+            ".+": self.elementwise_add,
+            ".-": self.elementwise_sub,
+            ".*": self.elementwise_mul,
+            "./": self.elementwise_div,
+            ".^": self.elementwise_pow,
+        }
 
     def multiply(self, a, b):
-        if isinstance(a, np.ndarray) and isinstance(b, np.ndarray):
+        if isinstance(a, (np.ndarray, Range)) and isinstance(b, (np.ndarray, Range)):
             return np.dot(a, b)
         else:
             return a * b
@@ -183,13 +582,56 @@ class Interpreter:
         return env.get(node.name)
 
     def visit_Assign(self, node, env):
+        if isinstance(node.left, Subscript):
+            self.assign_item(node.left, self.visit(node.right, env), env)
+            return
         var_name = node.left.name
         value = self.visit(node.right, env)
         env.set(var_name, value)
 
+    def visit_AugAssign(self, node, env):
+        value = self.visit(node.right, env)
+        apply = self.binary_operator(node.op)
+        if isinstance(node.left, Subscript):
+            self.assign_item(node.left, value, env, apply)
+            return
+        container = self.take(node.left.name, env)
+        env.set(node.left.name, update_in_place(container, value, node.op.value, apply))
+
+    def assign_item(self, target, value, env, apply=None):
+        index = self.evaluate_index(target, env)
+        container = self.take(target.var.name, env)
+        env.set(target.var.name, store_item(container, index, value, apply))
+
+    def take(self, name, env):
+        """
+        The value of a variable about to be reassigned, removed from the
+        current environment so that it is no longer referenced there.
+        """
+        if name in env.vars:
+            return env.vars.pop(name)
+        return env.get(name)
+
+    def binary_operator(self, op):
+        key = (op.type, op.value)
+        if key not in self.binary_ops:
+            self.binary_ops[key] = binary_operator(self, *key)
+        return self.binary_ops[key]
+
+    def operator_for(self, node):
+        """The handler for a BinOp, specialized for its operands' inferred kinds where possible."""
+        op = node.op
+        key = (op.type, op.value, inferred_kind(node.left), inferred_kind(node.right))
+        handler = self.binary_ops.get(key)
+        if handler is None:
+            handler = specialized_operator(self, *key) or self.binary_operator(op)
+            self.binary_ops[key] = handler
+        return handler
+
     def visit_Compound(self, node, env):
         for child in node.children:
-            self.visit(child, env)
+            if self.visit(child, env) is RETURN:
+                return RETURN
 
     def visit_NoOp(self, node, env):
         pass
@@ -198,22 +640,26 @@ class Interpreter:
         condition = self.visit(node.condition, env)
         if condition:
             for stmt in node.true_block:
-                self.visit(stmt, env)
+                if self.visit(stmt, env) is RETURN:
+                    return RETURN
         elif node.false_block:
             for stmt in node.false_block:
-                self.visit(stmt, env)
+                if self.visit(stmt, env) is RETURN:
+                    return RETURN
 
     def visit_While(self, node, env):
         while self.visit(node.condition, env):
             for stmt in node.body:
-                self.visit(stmt, env)
+                if self.visit(stmt, env) is RETURN:
+                    return RETURN
 
     def visit_For(self, node, env):
         iterable = self.visit(node.iterable, env)
         for value in iterable:
             env.set(node.var, value)
             for stmt in node.body:
-                self.visit(stmt, env)
+                if self.visit(stmt, env) is RETURN:
+                    return RETURN
 
     def visit_FunctionDef(self, node, env):
         func_name = node.name
@@ -224,34 +670,141 @@ class Interpreter:
         args = [self.visit(arg, env) for arg in node.args]
 
         if func_name == "plot":
-            # Handle the 'plot' function
-            if len(args) == 1:
-                plt.plot(args[0])
-            elif len(args) == 2:
-                plt.plot(args[0], args[1])
-            else:
-                raise Exception(f"plot() takes 1 or 2 arguments ({len(args)} given)")
-            plt.show()
+            builtin_modules.plot(args)
+        elif func_name == "vmap":
+            return self.vmap(args, env)
         else:
             func = env.get(func_name)
             if isinstance(func, FunctionDef):
-                # User-defined function
-                func_env = Environment(parent=env)
-                for param, arg in zip(func.params, args):
-                    func_env.set(param, arg)
-                try:
-                    for stmt in func.body:
-                        self.visit(stmt, func_env)
-                except ReturnException as e:
-                    return e.value
-                # If no return statement, return None
-                return None
+                return self.call_function(func_name, func, args, env)
             elif callable(func):
                 # Built-in function
                 return func(*args)
             else:
                 raise Exception(f"{func_name} is not a function")
 
+    def call_function(self, func_name, func, args, env, memo=True):
+        """
+        Runs a user-defined function in a fresh (recycled) environment.
+        A memoized function first looks its arguments up in its cache,
+        unless `memo` is false.
+        """
+        check_arity(func_name, func.params, args)
+        if func.memo and memo:
+            return self.call_memoized(func_name, func, args, env)
+        types = tuple(map(runtime_type, args))
+        variants = self.variants.get(func)
+        if variants is not None:
+            variant = variants.get(types)
+            if variant is not None:
+                self.tier_stats.compiled_calls += 1
+                return self.compiler.call_function(func_name, variant, args, env)
+            self.tier_stats.guard_failures += 1
+        key = (func, types)
+        count = self.call_counts[key] = self.call_counts.get(key, 0) + 1
+        if count >= self.tier_threshold and len(variants or ()) < MAX_VARIANTS:
+            variant = self.promote(func, types)
+            self.tier_stats.compiled_calls += 1
+            return self.compiler.call_function(func_name, variant, args, env)
+        free_envs = self.free_envs
+        func_env = free_envs.pop() if free_envs else Environment()
+        func_env.parent = env
+        func_env.vars.update(zip(func.params, args))
+        result = None
+        for stmt in func.body:
+            if self.visit(stmt, func_env) is RETURN:
+                result = self.return_value
+                self.return_value = None
+                break
+        func_env.vars.clear()
+        func_env.parent = None
+        free_envs.append(func_env)
+        return result
+
+    def call_memoized(self, func_name, func, args, env):
+        table = self.memo_table(func, func.name)
+        key, result = table.lookup(args)
+        if result is MISSING:
+            result = self.call_function(func_name, func, args, env, memo=False)
+            table.store(key, result)
+        return result
+
+    def vmap(self, args, env):
+        def call(func, item):
+            if isinstance(func, FunctionDef):
+                return self.call_function(func.name, func, [item], env)
+            elif callable(func):
+                return func(item)
+            else:
+                raise Exception("vmap() argument is not a function")
+
+        return vectorizer.vmap(args, self.lift_plan, env.get, call)
+
+    def lift_plan(self, func):
+        """The vmap plan of a user function (see vectorizer.lift), or None."""
+        if not isinstance(func, FunctionDef):
+            return None
+        if func not in self.lifts:
+            self.lifts[func] = vectorizer.lift(func)
+        return self.lifts[func]
+
+    def promote(self, func, types):
+        """
+        Compiles a version of `func` specialized for arguments of `types`,
+        which later calls with those argument types run instead of the
+        tree walk. Calls with other types keep being interpreted.
+        """
+        if self.compiler is None:
+            from compiler import Compiler
+
+            self.compiler = Compiler(self)
+        # A copy, so that its inferred types do not affect other versions
+        variant = copy.deepcopy(func)
+        # Calls reach the variant after call_function looked them up
+        variant.memo = False
+        infer_function(variant, types)
+        if func not in self.variants:
+            self.variants[func] = {}
+            self.tier_stats.promoted += 1
+        self.variants[func][types] = variant
+        self.tier_stats.variants += 1
+        return variant
+
+    def memo_table(self, key, name, capacity=None):
+        """The result cache of a memoized function, made on first use."""
+        table = self.memo_tables.get(key)
+        if table is None:
+            table = MemoTable(name, capacity or self.memo_capacity)
+            self.memo_tables[key] = table
+        return table
+
+    def memoize_wrapper(self, func, capacity=None):
+        """`memoize(f)`: a version of `f` that caches its results."""
+        if capacity is not None:
+            if not float(capacity).is_integer() or capacity < 1:
+                raise Exception("memoize() capacity must be a positive integer")
+            capacity = int(capacity)
+        import codegen
+        import vm
+
+        capacity = capacity or self.memo_capacity
+        func = getattr(func, "__wrapped__", func)
+        if isinstance(func, FunctionDef):
+            table = MemoTable(func.name, capacity)
+            memoized = copy.copy(func)
+            memoized.memo = True
+        elif isinstance(func, vm.Function):
+            table = MemoTable(func.name, capacity)
+            memoized = vm.Function(func.code, table)
+        elif codegen.is_generated(func):
+            table = MemoTable(codegen.function_name(func), capacity)
+            memoized = codegen.memoized(func, table)
+        else:
+            raise Exception("memoize() takes a user-defined function")
+        # Each call makes a new cache, with its own capacity
+        self.memo_tables[memoized] = table
+        return memoized
+
     def visit_ListLiteral(self, node, env):
         elements = [self.visit(element, env) for element in node.elements]
         return np.array(elements)
@@ -265,6 +818,14 @@ class Interpreter:
 
     def visit_Subscript(self, node, env):
         var = self.visit(node.var, env)
+        index = self.evaluate_index(node, env)
+        try:
+            return var[index]
+        except (IndexError, TypeError) as e:
+            raise Exception(f"Subscript error: {e}")
+
+    def evaluate_index(self, node, env):
+        """The Python index for a Subscript node's index expressions."""
         if not isinstance(node.index, list):
             indices = [node.index]
         else:
@@ -288,26 +849,28 @@ class Interpreter:
 
         # For a single index, don't convert it to a tuple
         if len(evaluated_indices) == 1:
-            index = evaluated_indices[0]
-        else:
-            index = tuple(evaluated_indices)
-        try:
-            return var[index]
-        except (IndexError, TypeError) as e:
-            raise Exception(f"Subscript error: {e}")
+            return evaluated_indices[0]
+        return tuple(evaluated_indices)
+
+    def print_wrapper(self, *args):
+        print(*args, file=self.output_stream)
 
     def linspace_wrapper(self, start, stop, num):
         return np.linspace(start, stop, int(num))
 
     def range_wrapper(self, *args):
         if len(args) == 1:
-            return np.arange(args[0])
+            args = (0, args[0], 1)
         elif len(args) == 2:
-            return np.arange(args[0], args[1])
-        elif len(args) == 3:
-            return np.arange(args[0], args[1], args[2])
-        else:
+            args = (args[0], args[1], 1)
+        elif len(args) != 3:
             raise Exception(f"range() takes 1 to 3 arguments ({len(args)} given)")
+        try:
+            return Range(*args)
+        except (TypeError, ValueError, OverflowError):
+            # Arguments np.arange rejects or cannot size lazily (an
+            # infinite bound, NaN); let it report them
+            return np.arange(*args)
 
     def zeros_wrapper(self, *args):
         if len(args) == 1:
@@ -323,10 +886,11 @@ class Interpreter:
             return np.ones(tuple(map(int, args)))
 
     def visit_Return(self, node, env):
-        value = self.visit(node.expr, env) if node.expr else None
-        raise ReturnException(value)
+        self.return_value = self.visit(node.expr, env) if node.expr else None
+        return RETURN
 
 
+# Raised only for a `return` outside of any function
 class ReturnException(Exception):
     def __init__(self, value):
         self.value = value
@@ -1,3 +1,5 @@
+from array import array
+import io
 import re
 
 # Token specification
@@ -5,6 +7,7 @@ TOKEN_SPECIFICATION = [
     ("NUMBER", r"\d+(\.\d+)?"),  # Integer or decimal number
     ("STRING", r'"[^"\n]*"'),  # String literal
     ("COMPARE", r"==|!=|<=|>=|<|>"),  # Comparison operators
+    ("AUGASSIGN", r"\.?[-+*/^]=|[|&]="),  # Compound assignment, e.g. .+=
     ("ASSIGN", r"="),  # Assignment operator
     ("END", r";"),  # Statement terminator
     ("EOP", r"\.\+|\.\-|\.\*|\.\/|\.\^"),  # Element-wise operators
@@ -42,6 +45,8 @@ KEYWORDS = {
 
 
 class Token:
+    __slots__ = ("type", "value", "line", "column")
+
     def __init__(self, type, value, line, column):
         self.type = type
         self.value = value
@@ -52,31 +57,92 @@ class Token:
         return f"Token({self.type}, {self.value!r}, Line: {self.line}, Column: {self.column})"
 
 
+class TokenArray:
+    """
+    A compact token stream: parallel arrays of type codes, value indexes,
+    lines and columns, with each distinct value stored once. Indexing and
+    iterating create Token objects on demand, so a Parser reading the array
+    only ever holds the few tokens it is looking at.
+    """
+
+    # Every token type, in the order of their type codes
+    TYPES = [name for name, _ in TOKEN_SPECIFICATION] + sorted(KEYWORDS) + ["EOF"]
+
+    def __init__(self, tokens):
+        self.types = array("B")
+        self.values = array("I")
+        self.lines = array("I")
+        self.columns = array("i")
+        self.value_table = []
+        type_codes = {name: code for code, name in enumerate(self.TYPES)}
+        value_codes = {}
+        for token in tokens:
+            value_code = value_codes.get(token.value)
+            if value_code is None:
+                value_code = value_codes[token.value] = len(self.value_table)
+                self.value_table.append(token.value)
+            self.types.append(type_codes[token.type])
+            self.values.append(value_code)
+            self.lines.append(token.line)
+            self.columns.append(token.column)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return Token(
+            self.TYPES[self.types[index]],
+            self.value_table[self.values[index]],
+            self.lines[index],
+            self.columns[index],
+        )
+
+    def __iter__(self):
+        types, value_table = self.TYPES, self.value_table
+        for code, value, line, column in zip(
+            self.types, self.values, self.lines, self.columns
+        ):
+            yield Token(types[code], value_table[value], line, column)
+
+
 def tokenize(code):
-    tokens = []
-    line_num = 1
-    line_start = 0
-    pos = 0
-    mo = get_token(code)
-    while mo is not None:
-        typ = mo.lastgroup
-        value = mo.group(typ)
-        if typ == "NEWLINE":
-            line_start = mo.end()
-            line_num += 1
-        elif typ == "SKIP" or typ == "COMMENT":
-            pass
-        elif typ == "ID" and value in KEYWORDS:
-            typ = value
-        else:
-            pass
-        if typ not in ("SKIP", "COMMENT"):
-            column = mo.start() - line_start
-            tokens.append(Token(typ, value, line_num, column))
-        pos = mo.end()
-        mo = get_token(code, pos)
-    if pos != len(code):
-        raise SyntaxError(f"Unexpected character {code[pos]} at position {pos}")
+    return list(generate_tokens(io.StringIO(code)))
+
+
+def generate_tokens(lines):
+    """
+    Yields the tokens of a program given as lines ending in newlines, such as
+    an open file, reading one line at a time.
+    """
+    line_num = 0
+    offset = 0  # position of the current line in the program
+    line = "\n"
+    for line in lines:
+        line_num += 1
+        pos = 0
+        mo = get_token(line)
+        while mo is not None:
+            typ = mo.lastgroup
+            if typ != "SKIP" and typ != "COMMENT":
+                value = mo.group(typ)
+                if typ == "ID" and value in KEYWORDS:
+                    typ = value
+                elif typ == "NEWLINE":
+                    # Newlines have always been reported at the start of the
+                    # next line
+                    yield Token(typ, value, line_num + 1, -1)
+                    pos = mo.end()
+                    break
+                yield Token(typ, value, line_num, mo.start())
+            pos = mo.end()
+            mo = get_token(line, pos)
+        if pos != len(line):
+            raise SyntaxError(
+                f"Unexpected character {line[pos]} at position {offset + pos}"
+            )
+        offset += len(line)
     # Add EOF token
-    tokens.append(Token("EOF", None, line_num, pos - line_start))
-    return tokens
+    if line.endswith("\n"):
+        yield Token("EOF", None, line_num + 1, 0)
+    else:
+        yield Token("EOF", None, line_num, len(line))
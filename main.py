@@ -1,23 +1,204 @@
+import time
+
+# Measured before the imports below, for --startup-trace
+STARTED = time.perf_counter()
+
+import argparse
+import contextlib
+import os
 import sys
-from lexer import tokenize
+from lexer import generate_tokens, tokenize
 from parser import Parser
 from interpreter import Interpreter
+from memo import DEFAULT_CAPACITY
+from inference import infer
+import astcache
+import batch
+import builtin_modules
+import optimizer
+
+IMPORTED = time.perf_counter()
+
+
+# Options that only apply when main.py runs one script
+SINGLE_SCRIPT_OPTIONS = [
+    "--compile",
+    "--aot",
+    "--stream",
+    "--dump-ast",
+    "--vectorize-report",
+    "--tier-stats",
+    "--memo-stats",
+    "--profile",
+    "--profile-json",
+    "--memstats",
+]
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 main.py <path_to_file>/<filename>.mpy")
+    arg_parser = argparse.ArgumentParser(
+        usage="python3 main.py <path_to_file>/<filename>.mpy [more files] [options]"
+    )
+    arg_parser.add_argument(
+        "filenames",
+        nargs="+",
+        metavar="filename",
+        help="script to run; several scripts, directories or glob patterns run "
+        "as a batch",
+    )
+    arg_parser.add_argument(
+        "--engine",
+        choices=Interpreter.ENGINES,
+        default="tree",
+        help="execution engine (default: tree)",
+    )
+    arg_parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="write VM bytecode to <filename>.mpyc instead of running the script",
+    )
+    arg_parser.add_argument(
+        "--aot",
+        action="store_true",
+        help="translate the script to Python bytecode, cached in __mpycache__",
+    )
+    arg_parser.add_argument(
+        "--no-optimize",
+        dest="optimize",
+        action="store_false",
+        help="skip constant folding and propagation",
+    )
+    arg_parser.add_argument(
+        "--vectorize-report",
+        action="store_true",
+        help="list which for-loops were rewritten into array operations",
+    )
+    arg_parser.add_argument(
+        "--tier-stats",
+        action="store_true",
+        help="report which functions the tree engine compiled after running",
+    )
+    arg_parser.add_argument(
+        "--startup-trace",
+        action="store_true",
+        help="report how long importing the interpreter and each builtin module took",
+    )
+    arg_parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="parse the script instead of reusing its syntax tree from __mpycache__",
+    )
+    arg_parser.add_argument(
+        "--memo-capacity",
+        type=int,
+        default=DEFAULT_CAPACITY,
+        metavar="N",
+        help=f"results cached per memoized function (default: {DEFAULT_CAPACITY})",
+    )
+    arg_parser.add_argument(
+        "--memo-stats",
+        action="store_true",
+        help="report cache hits and misses of memoized functions after running",
+    )
+    arg_parser.add_argument(
+        "--no-check",
+        dest="check",
+        action="store_false",
+        help="run the script even if shape inference finds an error in it",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="run each statement as soon as it is read, without optimizing or "
+        "checking the script (tree engine only)",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="report the calls and time of every line and function after running "
+        "(tree engine only)",
+    )
+    arg_parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        help="write the profile to FILE as JSON (tree engine only)",
+    )
+    arg_parser.add_argument(
+        "--memstats",
+        action="store_true",
+        help="report the array memory each line allocated and the peak resident "
+        "array memory after running (tree engine only)",
+    )
+    arg_parser.add_argument(
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="worker processes running a batch of scripts (default: one per CPU)",
+    )
+    arg_parser.add_argument(
+        "--dump-ast",
+        action="store_true",
+        help="print the (optimized) syntax tree instead of running the script",
+    )
+    args = arg_parser.parse_args()
+    if args.memo_capacity < 1:
+        arg_parser.error("--memo-capacity must be at least 1")
+    if args.jobs is not None and args.jobs < 1:
+        arg_parser.error("--jobs must be at least 1")
+
+    filenames = batch.expand(args.filenames)
+    if not filenames:
+        arg_parser.error("no scripts match " + " ".join(args.filenames))
+    if filenames != args.filenames or len(filenames) > 1:
+        for option in SINGLE_SCRIPT_OPTIONS:
+            if getattr(args, option[2:].replace("-", "_")):
+                arg_parser.error(f"{option} only applies to a single script")
+        failed = run_batch(filenames, args)
+        print_stats(None, args)
+        sys.exit(1 if failed else 0)
+    args.filename = filenames[0]
+
+    instrumented = args.profile or args.profile_json or args.memstats
+    compiled = args.filenames[0].endswith(".mpyc")
+    tree_engine = not (args.aot or args.compile or compiled)
+    if instrumented and not (args.engine == "tree" and tree_engine):
+        arg_parser.error("--profile and --memstats only run on the tree engine")
+
+    filename = args.filename
+    if filename.endswith(".mpyc"):
+        import vm
+
+        try:
+            program = vm.load(filename)
+        except FileNotFoundError:
+            print(f"File not found: {filename}")
+            return
+        interpreter = Interpreter(memo_capacity=args.memo_capacity)
+        vm.VM(interpreter).execute(program)
+        print_stats(interpreter, args)
         return
 
-    if not sys.argv[1].endswith(".mpy"):
+    if not filename.endswith(".mpy"):
         print("File must have a .mpy extension")
         return
 
-    if len(sys.argv) > 2:
-        print("Too many arguments")
+    if args.stream:
+        if args.engine != "tree":
+            arg_parser.error("--stream only runs on the tree engine")
+        try:
+            f = open(filename, "r")
+        except FileNotFoundError:
+            print(f"File not found: {filename}")
+            return
+        with f:
+            interpreter = Interpreter(memo_capacity=args.memo_capacity)
+            statements = Parser(generate_tokens(f)).statements()
+            with instrument(interpreter, args, filename):
+                interpreter.interpret_stream(statements)
+        print_stats(interpreter, args)
         return
 
-    filename = sys.argv[1]
     try:
         with open(filename, "r") as f:
             code = f.read()
@@ -25,13 +206,122 @@ def main():
         print(f"File not found: {filename}")
         return
 
-    tokens = tokenize(code)
-    # for token in tokens:
-    #     print(token)
-    parser = Parser(tokens)
-    ast = parser.parse()
-    interpreter = Interpreter()
-    interpreter.interpret(ast)
+    if args.aot and not args.dump_ast:
+        import codegen
+
+        program = codegen.load_cached(filename, code, optimize=args.optimize)
+        interpreter = Interpreter(memo_capacity=args.memo_capacity)
+        codegen.execute(interpreter, program)
+        print_stats(interpreter, args)
+        return
+
+    if args.cache:
+        ast = astcache.load_cached(filename, code)
+    else:
+        ast = Parser(tokenize(code)).parse()
+    if args.optimize:
+        report = []
+        ast = optimizer.optimize(ast, report=report)
+        if args.vectorize_report:
+            for line in report:
+                print(line, file=sys.stderr)
+    if args.dump_ast:
+        print(optimizer.dump(ast))
+        return
+    if args.check:
+        errors = infer(ast)
+        for error in errors:
+            print(f"Shape error: {error}")
+        if errors:
+            return
+    if args.compile:
+        import vm
+
+        vm.dump(vm.compile_program(Interpreter(), ast), filename + "c")
+        return
+    interpreter = Interpreter(engine=args.engine, memo_capacity=args.memo_capacity)
+    with instrument(interpreter, args, filename, code):
+        interpreter.interpret(ast)
+    if args.tier_stats:
+        print(f"Tiering: {interpreter.tier_stats}", file=sys.stderr)
+    print_stats(interpreter, args)
+
+
+@contextlib.contextmanager
+def instrument(interpreter, args, filename, source=None):
+    """Profiles and tracks the memory of the block if the options asked for it."""
+    if not (args.profile or args.profile_json or args.memstats):
+        yield
+        return
+    if source is None:
+        # A streamed script is read again only for the reports
+        with open(filename, "r") as f:
+            source = f.read()
+    reports = []
+    hooks = []
+    if args.memstats:
+        from memstats import MemoryTracker
+
+        tracker = MemoryTracker(source)
+        tracker.attach(interpreter)
+        hooks.append(tracker)
+        reports.append(tracker.report)
+    if args.profile or args.profile_json:
+        from profiler import Profiler
+
+        profiler = Profiler(source)
+        profiler.attach(interpreter)
+        hooks.append(profiler)
+        if args.profile:
+            reports.append(profiler.report)
+    try:
+        yield
+    finally:
+        # The last hook attached wraps the others, so it comes off first
+        for hook in reversed(hooks):
+            hook.detach()
+        if reports:
+            print("\n\n".join(report() for report in reports), file=sys.stderr)
+        if args.profile_json:
+            profiler.write_json(args.profile_json)
+
+
+def run_batch(filenames, args):
+    """
+    Runs several scripts on worker processes, printing each one's output
+    under its name and then a summary. Returns how many scripts failed.
+    """
+    start = time.perf_counter()
+    jobs = min(args.jobs or os.cpu_count() or 1, len(filenames))
+    results = []
+    for result in batch.run_scripts(filenames, args, jobs):
+        print(f"==> {result.filename} <==")
+        print(result.output, end="", flush=True)
+        results.append(result)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for result in results if result.error)
+    workers = "1 worker" if jobs == 1 else f"{jobs} workers"
+    print(
+        f"Batch: {len(results)} scripts, {failed} failed, in {elapsed:.3f} s "
+        f"on {workers}",
+        file=sys.stderr,
+    )
+    for result in results:
+        print(f"Batch: {result}", file=sys.stderr)
+    return failed
+
+
+def print_stats(interpreter, args):
+    """Prints the statistics that the options asked for after a run."""
+    if args.memo_stats:
+        for table in interpreter.memo_tables.values():
+            print(f"Memo: {table}", file=sys.stderr)
+    if args.startup_trace:
+        imports = [("interpreter", IMPORTED - STARTED)]
+        imports.extend(builtin_modules.IMPORT_TIMES.items())
+        for name, seconds in imports:
+            milliseconds = seconds * 1000
+            print(f"Startup: imported {name} in {milliseconds:.1f} ms", file=sys.stderr)
 
 
 if __name__ == "__main__":
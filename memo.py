@@ -0,0 +1,219 @@
+from ast_nodes import *
+from collections import OrderedDict
+from ranges import Range
+from resolver import assigned_names, binding_counts, function_defs
+import hashlib
+import numpy as np
+
+# Results kept per memoized function unless the program asks for another
+# capacity, by `memoize(f, capacity)` or main.py's --memo-capacity
+DEFAULT_CAPACITY = 1024
+
+# Arrays larger than this are not hashed; calls passing one are not cached
+MAX_KEY_BYTES = 1 << 20
+
+# Builtin names a pure function may read as values
+CONSTANTS = ("pi", "True", "False")
+
+# Returned by MemoTable.lookup when the arguments have no cached result
+MISSING = object()
+
+
+class MemoTable:
+    """
+    The results of one memoized function, keyed by its arguments, keeping
+    the `capacity` most recently used ones.
+    """
+
+    def __init__(self, name, capacity=DEFAULT_CAPACITY):
+        self.name = name
+        self.capacity = capacity
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncached = 0  # calls whose arguments could not be hashed
+
+    def lookup(self, args):
+        """The key of `args` and their cached result, or MISSING."""
+        key = argument_key(args)
+        if key is None:
+            self.uncached += 1
+            return None, MISSING
+        value = self.results.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+        return key, value
+
+    def store(self, key, value):
+        if key is None:
+            return
+        self.results[key] = value
+        if len(self.results) > self.capacity:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions, {self.uncached} uncached calls"
+        )
+
+
+def argument_key(args):
+    """A hashable key equal for equal argument lists, or None."""
+    key = []
+    for arg in args:
+        part = value_key(arg)
+        if part is None:
+            return None
+        key.append(part)
+    return tuple(key)
+
+
+def value_key(value):
+    # The type is part of the key: a function may return 2 for 2 and 2.0
+    # for 2.0, which print differently
+    if isinstance(value, (bool, int, float, str, np.bool_, np.integer, np.floating)):
+        return (type(value), value)
+    if isinstance(value, Range):
+        return (Range, value.args)
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind not in "biuf" or value.nbytes > MAX_KEY_BYTES:
+            return None
+        digest = hashlib.blake2b(np.ascontiguousarray(value).data, digest_size=16)
+        return (np.ndarray, value.dtype.str, value.shape, digest.digest())
+    if isinstance(value, set):
+        try:
+            return (set, frozenset(value))
+        except TypeError:
+            return None
+    return None
+
+
+class Purity:
+    """
+    Decides whether user functions are pure: whether their result depends
+    only on their arguments, so that it can be cached.
+
+    Assignments inside a function always bind its own locals, so a MathPy
+    function cannot modify its caller's variables. It is impure if it calls
+    a builtin with effects such as `print`, or a function that is impure
+    itself or not known statically, or if it reads a name it does not bind:
+    with dynamic scoping that is a variable of whichever function called it.
+    """
+
+    def __init__(self, nodes):
+        from interpreter import BUILTIN_PURITY
+
+        self.counts = binding_counts(nodes)
+        self.functions = {}
+        for func in function_defs(nodes):
+            self.functions.setdefault(func.name, []).append(func)
+        self.pure_builtins = {
+            name
+            for name, pure in BUILTIN_PURITY.items()
+            if pure and not self.counts[name]
+        }
+        self.reasons = {}
+
+    def is_function(self, name):
+        """Whether `name` is only ever bound by function definitions."""
+        funcs = self.functions.get(name, [])
+        return bool(funcs) and self.counts[name] == len(funcs)
+
+    def impurity(self, func):
+        """Why `func` is not pure, or None if it is."""
+        if func not in self.reasons:
+            # Counts as pure while it is checked, so recursion is allowed
+            self.reasons[func] = None
+            reason = self.reasons[func] = self.body_impurity(func)
+            if reason is not None:
+                # Functions checked meanwhile may have relied on it being pure
+                checked = list(self.reasons)
+                for other in checked[checked.index(func) + 1 :]:
+                    del self.reasons[other]
+        return self.reasons[func]
+
+    def body_impurity(self, func):
+        local_names = set(func.params) | set(assigned_names(func.body))
+        for node in walk(func.body):
+            if isinstance(node, FunctionDef):
+                return f"it defines {node.name}"
+            if isinstance(node, Variable):
+                name = node.name
+                if name in local_names or name.startswith("$"):
+                    continue
+                if name in CONSTANTS and not self.counts[name]:
+                    continue
+                return f"it reads {name}, which it does not define"
+            if isinstance(node, FunctionCall):
+                reason = self.call_impurity(node.name)
+                if reason is not None:
+                    return reason
+        return None
+
+    def call_impurity(self, name):
+        # Hidden helpers are only called the way the optimizer built them
+        if name in self.pure_builtins or name.startswith("$"):
+            return None
+        if not self.is_function(name):
+            return f"it calls {name}"
+        for func in self.functions[name]:
+            if self.impurity(func) is not None:
+                return f"it calls {name}, which is not pure"
+        return None
+
+
+def walk(nodes):
+    """Every node of a block, each before the nodes below it."""
+    from optimizer import expression_children
+
+    stack = list(reversed(nodes or []))
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, (Assign, AugAssign)):
+            children = [node.right, node.left]
+        elif isinstance(node, If):
+            children = [node.condition] + node.true_block + (node.false_block or [])
+        elif isinstance(node, While):
+            children = [node.condition] + node.body
+        elif isinstance(node, For):
+            children = [node.iterable] + node.body
+        elif isinstance(node, FunctionDef):
+            children = node.body
+        elif isinstance(node, Return):
+            children = [node.expr] if node.expr else []
+        elif isinstance(node, Compound):
+            children = node.children
+        else:
+            children = expression_children(node)
+        stack.extend(reversed(children))
+
+
+def check(nodes):
+    """
+    Raises if a `memo def`, or a function passed to `memoize`, is not pure.
+    """
+    purity = Purity(nodes)
+    for func in function_defs(nodes):
+        if func.memo:
+            reason = purity.impurity(func)
+            if reason is not None:
+                raise Exception(f"Cannot memoize {func.name}: {reason}")
+    if purity.counts["memoize"]:
+        return
+    for node in walk(nodes):
+        if not isinstance(node, FunctionCall) or node.name != "memoize":
+            continue
+        target = node.args[0] if node.args else None
+        if not isinstance(target, Variable) or not purity.is_function(target.name):
+            raise Exception("memoize() takes the name of a user-defined function")
+        for func in purity.functions[target.name]:
+            reason = purity.impurity(func)
+            if reason is not None:
+                raise Exception(f"Cannot memoize {func.name}: {reason}")
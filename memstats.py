@@ -0,0 +1,164 @@
+"""
+Array memory instrumentation for the tree engine. While attached to an
+interpreter, every new NumPy array that an expression evaluates to is
+charged to the statement being run, and watched with a weak reference
+until it is freed, so the tracker knows how much array memory is resident.
+"""
+import math
+import sys
+import weakref
+
+import numpy as np
+
+# Largest global variables listed in the report
+LARGEST_VARIABLES = 10
+
+
+class LineStats:
+    __slots__ = ("arrays", "bytes")
+
+    def __init__(self):
+        self.arrays = 0
+        self.bytes = 0
+
+
+class MemoryTracker:
+    def __init__(self, source=None):
+        self.source_lines = source.splitlines() if source is not None else []
+        self.lines = {}  # allocations by line number, None outside statements
+        self.arrays = 0
+        self.allocated = 0  # bytes, over all arrays
+        self.resident = 0  # bytes in arrays that are still alive
+        self.peak = 0
+        self.peak_line = None
+        # (name, bytes, shape, dtype) of the largest global arrays at peak
+        self.peak_variables = []
+        self.line = None  # line of the innermost running statement
+        # Weak references to the live arrays, by id, with their sizes
+        self.live = {}
+        self.interpreter = None
+        self.saved = None
+
+    def attach(self, interpreter):
+        """Tracks the arrays that `interpreter` creates until `detach`."""
+        if interpreter.engine != "tree":
+            raise ValueError(f"The {interpreter.engine} engine cannot track memory")
+        self.interpreter = interpreter
+        # Compiled functions would create arrays the tracker never sees
+        self.saved = (
+            vars(interpreter).get("visit"),
+            interpreter.tier_threshold,
+            sys.getrecursionlimit(),
+        )
+        interpreter.tier_threshold = math.inf
+        # Every visit now goes through one more Python frame
+        sys.setrecursionlimit(sys.getrecursionlimit() * 2)
+        visit = interpreter.visit
+
+        def tracked_visit(node, env):
+            line = getattr(node, "line", None)
+            if line is None:
+                value = visit(node, env)
+            else:
+                outer = self.line
+                self.line = line
+                try:
+                    value = visit(node, env)
+                finally:
+                    self.line = outer
+            if type(value) is np.ndarray and id(value) not in self.live:
+                self.allocate(value)
+            return value
+
+        interpreter.visit = tracked_visit
+
+    def detach(self):
+        """
+        Stops tracking. Other hooks on the interpreter's `visit`, such as a
+        profiler, must be attached before or detached first.
+        """
+        interpreter = self.interpreter
+        visit, interpreter.tier_threshold, limit = self.saved
+        sys.setrecursionlimit(limit)
+        if visit is None:
+            del interpreter.visit
+        else:
+            interpreter.visit = visit
+        self.interpreter = None
+
+    def allocate(self, array):
+        # A view shares the memory of the array it was taken from, which is
+        # new too when a builtin returned a view of its own temporary
+        size = 0
+        base = array
+        while isinstance(base.base, np.ndarray):
+            base = base.base
+        if base is not array and id(base) not in self.live:
+            self.allocate(base)
+            self.arrays -= 1
+            self.lines[self.line].arrays -= 1
+        elif base is array:
+            size = array.nbytes
+        key = id(array)
+
+        def freed(_, key=key):
+            _, size = self.live.pop(key)
+            self.resident -= size
+
+        self.live[key] = (weakref.ref(array, freed), size)
+        stats = self.lines.get(self.line)
+        if stats is None:
+            stats = self.lines[self.line] = LineStats()
+        stats.arrays += 1
+        stats.bytes += size
+        self.arrays += 1
+        self.allocated += size
+        self.resident += size
+        if self.resident > self.peak:
+            self.peak = self.resident
+            self.peak_line = self.line
+            self.peak_variables = self.largest_variables()
+
+    def largest_variables(self):
+        variables = []
+        for name, value in self.interpreter.global_env.vars.items():
+            # Names starting with $ hold the optimizer's hoisted values
+            if isinstance(value, np.ndarray) and not name.startswith("$"):
+                variables.append((name, value.nbytes, value.shape, value.dtype))
+        variables.sort(key=lambda variable: variable[1], reverse=True)
+        return variables[:LARGEST_VARIABLES]
+
+    def source(self, line):
+        if line is not None and 1 <= line <= len(self.source_lines):
+            return self.source_lines[line - 1].strip()
+        return ""
+
+    def report(self, limit=None):
+        """The allocations as text, keeping the `limit` largest lines."""
+        where = f" at line {self.peak_line}" if self.peak_line is not None else ""
+        out = [
+            f"Memory: {self.arrays} arrays, {format_bytes(self.allocated)} "
+            f"allocated, peak {format_bytes(self.peak)} resident{where}",
+            "",
+            "Allocated by line:",
+            f"{'arrays':>9} {'bytes':>12}  line",
+        ]
+        rows = sorted(self.lines.items(), key=lambda row: row[1].bytes, reverse=True)
+        for line, stats in rows[:limit]:
+            label = f"{line:>4}  {self.source(line)}" if line is not None else "   ?"
+            out.append(f"{stats.arrays:>9} {format_bytes(stats.bytes):>12}  {label}")
+        if self.peak_variables:
+            out.append("")
+            out.append("Largest variables at peak:")
+            out.append(f"{'bytes':>12}  variable")
+            for name, size, shape, dtype in self.peak_variables:
+                out.append(f"{format_bytes(size):>12}  {name} {shape} {dtype}")
+        return "\n".join(out)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
@@ -0,0 +1,533 @@
+from ast_nodes import *
+from interpreter import BUILTIN_PURITY, Interpreter, binary_operator
+from resolver import binding_counts
+from vectorizer import Vectorizer
+from fusion import Fuser
+from lexer import Token
+import math
+import operator
+import warnings
+
+# Builtin names that hold a fixed value unless the program rebinds them
+BUILTIN_CONSTANTS = ("pi", "True", "False")
+
+UNARY_OPS = {"+": operator.pos, "-": operator.neg, "not": operator.not_}
+
+# Only plain scalars are folded, so a Constant behaves exactly like the
+# value the interpreter would have computed at run time
+FOLDABLE_TYPES = (int, float, bool)
+
+# Expressions that are cheaper to re-evaluate than to cache, or that build a
+# fresh mutable value each time they are evaluated
+NOT_CACHED = (
+    Variable,
+    Number,
+    String,
+    Constant,
+    ListLiteral,
+    SetLiteral,
+    Slice,
+    Hoisted,
+)
+
+
+class Optimizer:
+    """
+    Rewrites a parsed program before it is run.
+
+    BinOp and UnaryOp trees whose operands are all known are evaluated once
+    and replaced by a Constant, using the interpreter's own operator
+    semantics so the int/float normalization of visit_BinOp is unchanged.
+    Operands are Number literals, builtin constants such as `pi` that the
+    program never rebinds, and names assigned exactly once, at top level, to
+    a constant. The latter are only substituted in statements that follow
+    the assignment, so reading them early still raises NameError. An
+    expression whose evaluation fails is left alone to fail at run time.
+    """
+
+    def __init__(self, interpreter=None):
+        self.interpreter = interpreter or Interpreter()
+        self.binary_ops = {}
+
+    def optimize(self, nodes):
+        counts = binding_counts(nodes)
+        builtins = self.interpreter.global_env.vars
+        self.constants = {
+            name: builtins[name] for name in BUILTIN_CONSTANTS if not counts[name]
+        }
+        optimized = []
+        for node in nodes:
+            node = self.statement(node)
+            if (
+                isinstance(node, Assign)
+                and isinstance(node.left, Variable)
+                and counts[node.left.name] == 1
+            ):
+                value = self.constant_value(node.right)
+                if value is not None:
+                    self.constants[node.left.name] = value
+            optimized.append(node)
+        return optimized
+
+    def constant_value(self, node):
+        if isinstance(node, Number):
+            return self.interpreter.visit_Number(node, None)
+        if isinstance(node, (Constant, String)):
+            return node.value
+        return None
+
+    def fold(self, compute, *operands):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                value = compute(*operands)
+        except Exception:
+            return None
+        if type(value) not in FOLDABLE_TYPES:
+            return None
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return Constant(value)
+
+    def binary_operator(self, op):
+        key = (op.type, op.value)
+        if key not in self.binary_ops:
+            self.binary_ops[key] = binary_operator(self.interpreter, *key)
+        return self.binary_ops[key]
+
+    # Statements
+    def statement(self, node):
+        method = getattr(self, "stmt_" + type(node).__name__, None)
+        if method is None:
+            return copy_position(self.expression(node), node)
+        method(node)
+        return node
+
+    def block(self, nodes):
+        if nodes is None:
+            return None
+        return [self.statement(node) for node in nodes]
+
+    def stmt_Assign(self, node):
+        node.right = self.expression(node.right)
+        if isinstance(node.left, Subscript):
+            node.left = self.expression(node.left)
+
+    stmt_AugAssign = stmt_Assign
+
+    def stmt_Compound(self, node):
+        node.children = self.block(node.children)
+
+    def stmt_NoOp(self, node):
+        pass
+
+    def stmt_If(self, node):
+        node.condition = self.expression(node.condition)
+        node.true_block = self.block(node.true_block)
+        node.false_block = self.block(node.false_block)
+
+    def stmt_While(self, node):
+        node.condition = self.expression(node.condition)
+        node.body = self.block(node.body)
+
+    def stmt_For(self, node):
+        node.iterable = self.expression(node.iterable)
+        node.body = self.block(node.body)
+
+    def stmt_FunctionDef(self, node):
+        node.body = self.block(node.body)
+
+    def stmt_Return(self, node):
+        if node.expr:
+            node.expr = self.expression(node.expr)
+
+    # Expressions
+    def expression(self, node):
+        method = getattr(self, "expr_" + type(node).__name__, None)
+        if method is None:
+            return node
+        return method(node)
+
+    def expr_Variable(self, node):
+        if node.name in self.constants:
+            return Constant(self.constants[node.name])
+        return node
+
+    def expr_BinOp(self, node):
+        node.left = self.expression(node.left)
+        node.right = self.expression(node.right)
+        left = self.constant_value(node.left)
+        right = self.constant_value(node.right)
+        if left is None or right is None:
+            return node
+        if isinstance(left, str) or isinstance(right, str):
+            return node
+        return self.fold(self.binary_operator(node.op), left, right) or node
+
+    def expr_UnaryOp(self, node):
+        node.expr = self.expression(node.expr)
+        value = self.constant_value(node.expr)
+        if value is None or isinstance(value, str):
+            return node
+        op_value = node.op.value if hasattr(node.op, "value") else node.op.type
+        if op_value not in UNARY_OPS:
+            return node
+        return self.fold(UNARY_OPS[op_value], value) or node
+
+    def expr_FunctionCall(self, node):
+        node.args = [self.expression(arg) for arg in node.args]
+        return node
+
+    def expr_ListLiteral(self, node):
+        node.elements = [self.expression(element) for element in node.elements]
+        return node
+
+    expr_SetLiteral = expr_ListLiteral
+
+    def expr_Subscript(self, node):
+        indices = node.index if isinstance(node.index, list) else [node.index]
+        node.index = [self.expression(idx_node) for idx_node in indices]
+        return node
+
+    def expr_Slice(self, node):
+        if node.start:
+            node.start = self.expression(node.start)
+        if node.end:
+            node.end = self.expression(node.end)
+        return node
+
+
+def pure_builtins(nodes):
+    """Names of the pure builtins that a program never rebinds."""
+    counts = binding_counts(nodes)
+    return {name for name, pure in BUILTIN_PURITY.items() if pure and not counts[name]}
+
+
+def expression_children(node):
+    """The direct subexpressions of an expression node, in evaluation order."""
+    if isinstance(node, BinOp):
+        return [node.left, node.right]
+    if isinstance(node, UnaryOp):
+        return [node.expr]
+    if isinstance(node, FunctionCall):
+        return node.args
+    if isinstance(node, (ListLiteral, SetLiteral)):
+        return node.elements
+    if isinstance(node, Subscript):
+        return [node.var] + node.index
+    if isinstance(node, Slice):
+        return [child for child in (node.start, node.end) if child]
+    if isinstance(node, Hoisted):
+        return [node.expr]
+    return []
+
+
+def map_children(node, fn):
+    """Replaces each direct subexpression of `node` by `fn(child)`."""
+    if isinstance(node, BinOp):
+        node.left = fn(node.left)
+        node.right = fn(node.right)
+    elif isinstance(node, UnaryOp):
+        node.expr = fn(node.expr)
+    elif isinstance(node, FunctionCall):
+        node.args = [fn(arg) for arg in node.args]
+    elif isinstance(node, (ListLiteral, SetLiteral)):
+        node.elements = [fn(element) for element in node.elements]
+    elif isinstance(node, Subscript):
+        node.index = [fn(idx_node) for idx_node in node.index]
+    elif isinstance(node, Slice):
+        if node.start:
+            node.start = fn(node.start)
+        if node.end:
+            node.end = fn(node.end)
+
+
+def map_expressions(nodes, fn):
+    """
+    Replaces every top-level expression of a block by `fn(expr)`, descending
+    into nested control flow but not into function bodies.
+    """
+    for i, node in enumerate(nodes or []):
+        if isinstance(node, (Assign, AugAssign)):
+            node.right = fn(node.right)
+        elif isinstance(node, If):
+            node.condition = fn(node.condition)
+            map_expressions(node.true_block, fn)
+            map_expressions(node.false_block, fn)
+        elif isinstance(node, While):
+            node.condition = fn(node.condition)
+            map_expressions(node.body, fn)
+        elif isinstance(node, For):
+            node.iterable = fn(node.iterable)
+            map_expressions(node.body, fn)
+        elif isinstance(node, Return):
+            if node.expr:
+                node.expr = fn(node.expr)
+        elif isinstance(node, Compound):
+            map_expressions(node.children, fn)
+        elif not isinstance(node, (FunctionDef, NoOp)):
+            nodes[i] = fn(node)
+
+
+def statement_expression(node):
+    """The expression a simple statement evaluates, or None for control flow."""
+    if isinstance(node, (Assign, AugAssign)):
+        return node.right
+    if isinstance(node, Return):
+        return node.expr
+    if isinstance(node, (If, While, For, FunctionDef, Compound, NoOp)):
+        return None
+    return node
+
+
+class CodeMotion:
+    """
+    Avoids re-evaluating pure expressions.
+
+    Loop-invariant code motion: inside a While or For loop, a pure
+    expression none of whose names is bound anywhere in the loop is wrapped
+    in a Hoisted node, and its hidden variable is reset just before the
+    loop. Common-subexpression elimination: within a block, a pure
+    expression that occurs in several simple statements (or twice in one)
+    with no rebinding of its names in between is cached the same way.
+
+    Hoisted evaluates its expression the first time it is reached and
+    reuses the value until the next reset, so expressions are still only
+    evaluated where the original program would have evaluated them: a loop
+    that never runs, or a branch that is never taken, evaluates nothing, and
+    errors surface at the same point as before. A call is pure only if
+    BUILTIN_PURITY says so and the program never rebinds its name; calls to
+    user functions are never cached.
+    """
+
+    def __init__(self):
+        self.temp_count = 0
+
+    def optimize(self, nodes):
+        self.pure_calls = pure_builtins(nodes)
+        self.block(nodes)
+        return nodes
+
+    def new_temp(self):
+        name = f"${self.temp_count}"
+        self.temp_count += 1
+        return name
+
+    def reset(self, name):
+        return Assign(Variable(name), Constant(None))
+
+    def key(self, node):
+        """A structural key for a pure expression, or None if it may have effects."""
+        if isinstance(node, Variable):
+            return ("Variable", node.name)
+        if isinstance(node, Hoisted):
+            return ("Hoisted", node.name)
+        if isinstance(node, (Number, String, Constant)):
+            return (type(node).__name__, type(node.value), repr(node.value))
+        if isinstance(node, FunctionCall) and node.name not in self.pure_calls:
+            return None
+        if isinstance(node, BinOp):
+            label = node.op.value
+        elif isinstance(node, UnaryOp):
+            label = node.op.value if hasattr(node.op, "value") else node.op.type
+        elif isinstance(node, FunctionCall):
+            label = node.name
+        elif isinstance(node, Slice):
+            label = (node.start is None, node.end is None)
+        elif isinstance(node, (ListLiteral, SetLiteral, Subscript)):
+            label = None
+        else:
+            return None
+        children = []
+        for child in expression_children(node):
+            child_key = self.key(child)
+            if child_key is None:
+                return None
+            children.append(child_key)
+        return (type(node).__name__, label, tuple(children))
+
+    def names(self, node):
+        """Every variable an expression reads, callees and hidden variables included."""
+        names = set()
+        if isinstance(node, (Variable, FunctionCall, Hoisted)):
+            names.add(node.name)
+        for child in expression_children(node):
+            names |= self.names(child)
+        return names
+
+    def cacheable(self, node):
+        if isinstance(node, NOT_CACHED):
+            return None
+        return self.key(node)
+
+    # Blocks
+    def block(self, nodes):
+        if not nodes:
+            return
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            if isinstance(node, (While, For)):
+                resets = self.hoist(node)
+                nodes[i:i] = resets
+                i += len(resets)
+            i += 1
+        for node in nodes:
+            if isinstance(node, If):
+                self.block(node.true_block)
+                self.block(node.false_block)
+            elif isinstance(node, (While, For, FunctionDef)):
+                self.block(node.body)
+            elif isinstance(node, Compound):
+                self.block(node.children)
+        self.common_subexpressions(nodes)
+
+    # Loop-invariant code motion
+    def hoist(self, loop):
+        """Caches the loop's invariant expressions; returns the resets to run before it."""
+        bound = set(binding_counts([loop]))
+        temps = {}
+        resets = []
+
+        def visit(node):
+            key = self.cacheable(node)
+            if key is not None and not self.names(node) & bound:
+                if key not in temps:
+                    temps[key] = self.new_temp()
+                    resets.append(self.reset(temps[key]))
+                return Hoisted(temps[key], node)
+            if not isinstance(node, Hoisted):
+                map_children(node, visit)
+            return node
+
+        if isinstance(loop, While):
+            loop.condition = visit(loop.condition)
+        map_expressions(loop.body, visit)
+        return resets
+
+    # Common-subexpression elimination
+    def common_subexpressions(self, nodes):
+        live = {}  # key -> [first statement, last statement, count, names]
+        groups = []
+
+        def occurrences(node, found):
+            key = self.cacheable(node)
+            if key is not None:
+                found.append((key, node))
+            if not isinstance(node, Hoisted):
+                for child in expression_children(node):
+                    occurrences(child, found)
+
+        for i, node in enumerate(nodes):
+            expr = statement_expression(node)
+            if expr is not None:
+                found = []
+                occurrences(expr, found)
+                for key, sub in found:
+                    entry = live.get(key)
+                    if entry is None:
+                        live[key] = [i, i, 1, self.names(sub)]
+                    else:
+                        entry[1] = i
+                        entry[2] += 1
+            # The statement's own expression is evaluated before it binds
+            # anything, so rebinding ends a group after the statement
+            bound = set(binding_counts([node]))
+            for key, entry in list(live.items()):
+                if entry[3] & bound:
+                    groups.append((key, entry))
+                    del live[key]
+        groups.extend(live.items())
+
+        covering = [{} for _ in nodes]
+        resets = [[] for _ in nodes]
+        for key, (first, last, count, _) in groups:
+            if count < 2:
+                continue
+            name = self.new_temp()
+            resets[first].append(self.reset(name))
+            for i in range(first, last + 1):
+                covering[i][key] = name
+
+        for i, node in enumerate(nodes):
+            temps = covering[i]
+            expr = statement_expression(node)
+            if not temps or expr is None:
+                continue
+
+            def visit(expr):
+                key = self.cacheable(expr)
+                if not isinstance(expr, Hoisted):
+                    map_children(expr, visit)
+                if key in temps:
+                    return Hoisted(temps[key], expr)
+                return expr
+
+            replaced = visit(expr)
+            if isinstance(node, (Assign, AugAssign)):
+                node.right = replaced
+            elif isinstance(node, Return):
+                node.expr = replaced
+            else:
+                nodes[i] = replaced
+        for i in reversed(range(len(nodes))):
+            nodes[i:i] = resets[i]
+
+
+def optimize(nodes, interpreter=None, report=None):
+    """
+    Runs every optimization pass over a parsed program. Messages about which
+    loops were vectorized are appended to `report` when one is given.
+    """
+    nodes = Optimizer(interpreter).optimize(nodes)
+    vectorizer = Vectorizer()
+    nodes = vectorizer.optimize(nodes)
+    if report is not None:
+        report.extend(vectorizer.report)
+    nodes = CodeMotion().optimize(nodes)
+    return Fuser(pure_builtins(nodes)).optimize(nodes)
+
+
+def node_fields(node):
+    """The attributes set on a node, as (name, value) pairs."""
+    for cls in type(node).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if hasattr(node, name):
+                yield name, getattr(node, name)
+
+
+def dump(nodes):
+    """Renders a program's AST as indented text, one node per line."""
+    lines = []
+
+    def field_text(value):
+        if isinstance(value, Token):
+            return repr(value.value)
+        return repr(value)
+
+    def walk(node, indent, label=""):
+        fields = []
+        children = []
+        for name, value in node_fields(node):
+            if name in ("line", "column"):
+                continue
+            if isinstance(value, ASTNode):
+                children.append((name, [value]))
+            elif isinstance(value, list) and any(
+                isinstance(item, ASTNode) for item in value
+            ):
+                children.append((name, value))
+            elif (value is not None or name == "value") and value != []:
+                fields.append(f"{name}={field_text(value)}")
+        lines.append(indent + label + " ".join([type(node).__name__] + fields))
+        for name, items in children:
+            if len(items) == 1 and not isinstance(getattr(node, name), list):
+                walk(items[0], indent + "  ", name + ": ")
+            else:
+                lines.append(f"{indent}  {name}:")
+                for item in items:
+                    walk(item, indent + "    ")
+
+    for node in nodes:
+        walk(node, "")
+    return "\n".join(lines)
@@ -2,11 +2,46 @@ from ast_nodes import *
 from lexer import Token
 
 
+# How tightly each binary operator binds its operands, by token value. Only
+# OP, EOP, COMPARE, `and` and `or` tokens have one of these values.
+BINARY_POWERS = {
+    "or": 10,
+    "and": 20,
+    "==": 30,
+    "!=": 30,
+    "<": 30,
+    ">": 30,
+    "<=": 30,
+    ">=": 30,
+    "+": 40,
+    "-": 40,
+    ".+": 40,
+    ".-": 40,
+    "|": 40,
+    "&": 40,
+    "*": 50,
+    "/": 50,
+    ".*": 50,
+    "./": 50,
+    "^": 70,
+    ".^": 70,
+}
+EXPONENT_POWER = 70
+# The operand of a prefix `+`, `-` or `not`, and an exponent, take every
+# operator that binds more tightly than this: only `^` and `.^`
+UNARY_POWER = 60
+
+
 class Parser:
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
-        self.current_token = self.tokens[self.pos]
+        # Any iterable of tokens ending in EOF, such as a generator: the
+        # parser reads one token ahead at most
+        self.tokens = iter(tokens)
+        # Tokens to read before the next one from self.tokens, last first
+        self.pending = []
+        # Tokens consumed since mark(), while a rewind may follow
+        self.consumed = None
+        self.current_token = next(self.tokens)
 
     def error(self, msg="Invalid syntax"):
         line = self.current_token.line
@@ -17,35 +52,73 @@ class Parser:
         )
 
     def eat(self, token_type):
-        if self.current_token.type == token_type:
-            self.advance()
-        else:
+        if self.current_token.type != token_type:
             self.error(f"Expected token {token_type}, got {self.current_token.type}")
+        # advance(), inlined: this runs for nearly every token
+        if self.consumed is not None:
+            self.consumed.append(self.current_token)
+        if self.pending:
+            self.current_token = self.pending.pop()
+        else:
+            self.current_token = next(self.tokens, self.current_token)
 
     def advance(self):
-        self.pos += 1
-        if self.pos < len(self.tokens):
-            self.current_token = self.tokens[self.pos]
+        if self.consumed is not None:
+            self.consumed.append(self.current_token)
+        if self.pending:
+            self.current_token = self.pending.pop()
+        else:
+            # Past the end, the EOF token stays current
+            self.current_token = next(self.tokens, self.current_token)
+
+    def mark(self):
+        """Starts remembering tokens, so that rewind() can go back here."""
+        self.consumed = []
+
+    def rewind(self):
+        self.pending.append(self.current_token)
+        self.pending.extend(reversed(self.consumed[1:]))
+        self.current_token = self.consumed[0]
+        self.consumed = None
 
     def parse(self):
         nodes = self.program()
         return nodes
 
+    def statements(self):
+        """
+        Yields the top-level statements one at a time, each as soon as it
+        has been parsed.
+        """
+        while self.current_token.type != "EOF":
+            while self.current_token.type == "NEWLINE":
+                self.eat("NEWLINE")
+            token = self.current_token
+            node = self.statement()
+            if node is not None:
+                node.line = token.line
+                node.column = token.column
+                yield node
+
     def program(self):
         """program : statement_list"""
         nodes = self.statement_list()
         return nodes
 
-    def statement_list(self, end_tokens=[]):
+    def statement_list(self, end_tokens=()):
         """statement_list : { statement }"""
         nodes = []
-        while self.current_token.type not in ["EOF"] + end_tokens:
+        stop_tokens = ("EOF",) + end_tokens
+        while self.current_token.type not in stop_tokens:
             while self.current_token.type == "NEWLINE":
                 self.eat("NEWLINE")
             if self.current_token.type in end_tokens:
                 break
+            token = self.current_token
             node = self.statement()
             if node is not None:
+                node.line = token.line
+                node.column = token.column
                 nodes.append(node)
             # Do not raise an error if node is None
         return nodes
@@ -63,8 +136,22 @@ class Parser:
         if self.current_token.type == "EOF":
             return None
         elif self.current_token.type == "ID":
-            if self.peek().type == "ASSIGN":
+            next_type = self.peek().type
+            if self.current_token.value == "memo" and next_type == "def":
+                # `memo` is only a keyword in front of `def`
+                return self.function_definition()
+            if next_type in ("ASSIGN", "AUGASSIGN"):
                 return self.assignment_statement()
+            elif next_type == "LBRACKET":
+                # Either an element assignment or an expression starting
+                # with a subscript; parse the subscript to find out
+                self.mark()
+                target = self.subscript()
+                if self.current_token.type in ("ASSIGN", "AUGASSIGN"):
+                    self.consumed = None
+                    return self.assignment_statement(target)
+                self.rewind()
+                return self.expression_statement()
             else:
                 return self.expression_statement()
         elif self.current_token.type == "def":
@@ -86,19 +173,31 @@ class Parser:
                 f"Unexpected token '{self.current_token.value}' at line {self.current_token.line}"
             )
 
-    def assignment_statement(self):
-        """assignment_statement : ID ASSIGN expression"""
-        left = Variable(self.current_token.value)
-        self.eat("ID")
-        self.eat("ASSIGN")
-        right = self.expression()
+    def assignment_statement(self, left=None):
+        """assignment_statement : ( ID | subscript ) ( ASSIGN | AUGASSIGN ) expression"""
+        if left is None:
+            left = Variable(self.current_token.value)
+            self.eat("ID")
+        token = self.current_token
+        if token.type == "AUGASSIGN":
+            self.eat("AUGASSIGN")
+            op_value = token.value[:-1]
+            op_type = "EOP" if op_value.startswith(".") else "OP"
+            op = Token(op_type, op_value, token.line, token.column)
+            node = AugAssign(left, op, self.expression())
+        else:
+            self.eat("ASSIGN")
+            node = Assign(left, self.expression())
         # Consume any NEWLINE tokens after an assignment
         while self.current_token.type == "NEWLINE":
             self.eat("NEWLINE")
-        return Assign(left, right)
+        return node
 
     def function_definition(self):
-        """function_definition : def ID LPAREN parameter_list RPAREN COLON statement_list end"""
+        """function_definition : [memo] def ID LPAREN parameter_list RPAREN COLON statement_list end"""
+        memo = self.current_token.type == "ID"
+        if memo:
+            self.eat("ID")
         self.eat("def")
         func_name = self.current_token.value
         self.eat("ID")
@@ -106,9 +205,9 @@ class Parser:
         params = self.parameter_list()
         self.eat("RPAREN")
         self.eat("COLON")
-        body = self.statement_list(end_tokens=["end"])
+        body = self.statement_list(end_tokens=("end",))
         self.eat("end")
-        return FunctionDef(func_name, params, body)
+        return FunctionDef(func_name, params, body, memo)
 
     def parameter_list(self):
         """parameter_list : ID { COMMA ID }"""
@@ -118,6 +217,8 @@ class Parser:
             self.eat("ID")
             while self.current_token.type == "COMMA":
                 self.eat("COMMA")
+                if self.current_token.value in params:
+                    self.error(f"Duplicate parameter {self.current_token.value}")
                 params.append(self.current_token.value)
                 self.eat("ID")
         return params
@@ -127,12 +228,12 @@ class Parser:
         self.eat("if")
         condition = self.expression()
         self.eat("COLON")
-        true_block = self.statement_list(end_tokens=["else", "end"])
+        true_block = self.statement_list(end_tokens=("else", "end"))
         false_block = None
         if self.current_token.type == "else":
             self.eat("else")
             self.eat("COLON")
-            false_block = self.statement_list(end_tokens=["end"])
+            false_block = self.statement_list(end_tokens=("end",))
         self.eat("end")
         return If(condition, true_block, false_block)
 
@@ -141,7 +242,7 @@ class Parser:
         self.eat("while")
         condition = self.expression()
         self.eat("COLON")
-        body = self.statement_list(end_tokens=["end"])
+        body = self.statement_list(end_tokens=("end",))
         self.eat("end")
         return While(condition, body)
 
@@ -153,7 +254,7 @@ class Parser:
         self.eat("in")
         iterable = self.expression()
         self.eat("COLON")
-        body = self.statement_list(end_tokens=["end"])
+        body = self.statement_list(end_tokens=("end",))
         self.eat("end")
         return For(var, iterable, body)
 
@@ -173,91 +274,32 @@ class Parser:
             self.eat(self.current_token.type)
         return expr
 
-    def expression(self):
-        """expression : logical_or"""
-        return self.logical_or()
-
-    def logical_or(self):
-        """logical_or : logical_and { 'or' logical_and }"""
-        node = self.logical_and()
-        while self.current_token.type == "or":
-            token = self.current_token
-            self.eat("or")
-            node = BinOp(left=node, op=token, right=self.logical_and())
-        return node
-
-    def logical_and(self):
-        """logical_and : comparison { 'and' comparison }"""
-        node = self.comparison()
-        while self.current_token.type == "and":
-            token = self.current_token
-            self.eat("and")
-            node = BinOp(left=node, op=token, right=self.comparison())
-        return node
-
-    def comparison(self):
-        """comparison : arithmetic_expr { ( '==' | '!=' | '<' | '>' | '<=' | '>=' ) arithmetic_expr }"""
-        node = self.arithmetic_expr()
-        while self.current_token.type == "COMPARE":
-            token = self.current_token
-            self.eat("COMPARE")
-            node = BinOp(left=node, op=token, right=self.arithmetic_expr())
-        return node
-
-    def arithmetic_expr(self):
-        """arithmetic_expr : term { ( '+' | '-' | '.+' | '.-' | '|' | '&' ) term }"""
-        node = self.term()
-        while self.current_token.type in ("OP", "EOP") and self.current_token.value in (
-            "+",
-            "-",
-            ".+",
-            ".-",
-            "|",
-            "&",
-        ):
-            token = self.current_token
-            self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.term())
-        return node
-
-    def term(self):
-        """term : factor { ( '*' | '/' | '.*' | './' ) factor }"""
-        node = self.factor()
-        while self.current_token.type in ("OP", "EOP") and self.current_token.value in (
-            "*",
-            "/",
-            ".*",
-            "./",
-        ):
-            token = self.current_token
-            self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.factor())
-        return node
+    def expression(self, min_power=0):
+        """
+        expression : ( '+' | '-' | 'not' ) expression
+                   | primary { binary_operator expression }
 
-    def factor(self):
-        """factor : ( '+' | '-' | 'not' ) factor | power"""
+        Operators bind as listed in BINARY_POWERS; only those binding more
+        tightly than `min_power` are part of this expression.
+        """
         token = self.current_token
-        if token.type in ("OP", "EOP") and token.value in ("+", "-"):
-            self.eat(token.type)
-            node = UnaryOp(op=token, expr=self.factor())
-            return node
-        elif token.type == "not":
-            self.eat("not")
-            return UnaryOp(op=token, expr=self.factor())
+        if token.type == "not" or (token.type == "OP" and token.value in ("+", "-")):
+            self.advance()
+            node = UnaryOp(op=token, expr=self.expression(UNARY_POWER))
         else:
-            return self.power()
-
-    def power(self):
-        """power : primary { ( '^' | '.^' ) factor }"""
-        node = self.primary()
-        while self.current_token.type in ("OP", "EOP") and self.current_token.value in (
-            "^",
-            ".^",
-        ):
+            node = self.primary()
+        while True:
             token = self.current_token
-            self.eat(token.type)
-            node = BinOp(left=node, op=token, right=self.factor())
-        return node
+            power = BINARY_POWERS.get(token.value)
+            if power is None or power <= min_power:
+                return node
+            self.advance()
+            if power == EXPONENT_POWER:
+                # Right-associative, and the exponent may be negated
+                right = self.expression(UNARY_POWER)
+            else:
+                right = self.expression(power)
+            node = BinOp(left=node, op=token, right=right)
 
     def primary(self):
         """primary : NUMBER | STRING | ID | LPAREN expression RPAREN | list_literal | function_call | subscript"""
@@ -269,9 +311,10 @@ class Parser:
             self.eat("STRING")
             return String(token.value.strip('"'))
         elif token.type == "ID":
-            if self.peek().type == "LPAREN":
+            next_type = self.peek().type
+            if next_type == "LPAREN":
                 return self.function_call()
-            elif self.peek().type == "LBRACKET":
+            elif next_type == "LBRACKET":
                 return self.subscript()
             else:
                 self.eat("ID")
@@ -335,12 +378,13 @@ class Parser:
 
     def peek(self):
         """Look ahead to the next token without consuming the current one."""
-        if self.pos + 1 < len(self.tokens):
-            return self.tokens[self.pos + 1]
-        else:
-            return Token(
-                "EOF", None, self.current_token.line, self.current_token.column
-            )
+        if not self.pending:
+            token = next(self.tokens, None)
+            if token is None:
+                # Only past the end, where the current token is EOF
+                return self.current_token
+            self.pending.append(token)
+        return self.pending[-1]
 
     def set_literal(self):
         """set_literal : LBRACE [ expression { COMMA expression } ] RBRACE"""
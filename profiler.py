@@ -0,0 +1,169 @@
+"""
+A statement-level profiler for the tree engine. Attaching it to an
+interpreter wraps the interpreter's `visit` and `call_function` on that
+instance only, so runs without --profile take the usual code path.
+"""
+import json
+import math
+import sys
+import time
+
+
+class Entry:
+    """Timings of one source line or one user function."""
+
+    __slots__ = ("calls", "cumulative", "self_time", "active")
+
+    def __init__(self):
+        self.calls = 0
+        self.cumulative = 0.0  # seconds, from its outermost calls only
+        self.self_time = 0.0  # seconds, without nested lines or calls
+        self.active = 0  # calls still running, for recursive functions
+
+
+class Profiler:
+    def __init__(self, source=None):
+        self.source_lines = source.splitlines() if source is not None else []
+        self.lines = {}  # by line number
+        self.functions = {}  # by (name, line of its def)
+        # Time spent in nested entries of each running entry
+        self.line_stack = []
+        self.function_stack = []
+        self.interpreter = None
+        self.saved = None
+
+    def attach(self, interpreter):
+        """Profiles everything `interpreter` runs until `detach`."""
+        if interpreter.engine != "tree":
+            raise ValueError(f"The {interpreter.engine} engine cannot be profiled")
+        self.interpreter = interpreter
+        # Compiled functions would skip the statements they run
+        self.saved = (
+            vars(interpreter).get("visit"),
+            vars(interpreter).get("call_function"),
+            interpreter.tier_threshold,
+            sys.getrecursionlimit(),
+        )
+        interpreter.tier_threshold = math.inf
+        # Every visit now goes through one more Python frame
+        sys.setrecursionlimit(sys.getrecursionlimit() * 2)
+        visit = interpreter.visit
+        call_function = interpreter.call_function
+        lines = self.lines
+        functions = self.functions
+
+        def profiled_visit(node, env):
+            line = getattr(node, "line", None)
+            if line is None:
+                return visit(node, env)
+            return self.measure(lines, line, self.line_stack, visit, node, env)
+
+        def profiled_call(func_name, func, args, env, memo=True):
+            if not memo:
+                # The miss of a memoized call, which is already being timed
+                return call_function(func_name, func, args, env, memo)
+            key = (func.name, getattr(func, "line", None))
+            stack = self.function_stack
+            return self.measure(
+                functions, key, stack, call_function, func_name, func, args, env
+            )
+
+        interpreter.visit = profiled_visit
+        interpreter.call_function = profiled_call
+
+    def detach(self):
+        """
+        Stops profiling. Other hooks on the interpreter's `visit`, such as a
+        memory tracker, must be attached before or detached first.
+        """
+        interpreter = self.interpreter
+        visit, call_function, interpreter.tier_threshold, limit = self.saved
+        sys.setrecursionlimit(limit)
+        for name, hook in (("visit", visit), ("call_function", call_function)):
+            if hook is None:
+                delattr(interpreter, name)
+            else:
+                setattr(interpreter, name, hook)
+        self.interpreter = None
+
+    def measure(self, entries, key, stack, action, *args):
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = Entry()
+        entry.calls += 1
+        entry.active += 1
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return action(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            entry.self_time += elapsed - stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            entry.active -= 1
+            if not entry.active:
+                entry.cumulative += elapsed
+
+    def source(self, line):
+        if 1 <= line <= len(self.source_lines):
+            return self.source_lines[line - 1].strip()
+        return ""
+
+    def function_rows(self):
+        """(name, line, entry) of every called function, slowest first."""
+        rows = [(name, line, entry) for (name, line), entry in self.functions.items()]
+        rows.sort(key=lambda row: row[2].self_time, reverse=True)
+        return rows
+
+    def line_rows(self):
+        """(line, entry) of every line that ran, slowest first."""
+        rows = list(self.lines.items())
+        rows.sort(key=lambda row: row[1].self_time, reverse=True)
+        return rows
+
+    def report(self, limit=None):
+        """The profile as text, keeping the `limit` slowest rows of each table."""
+        out = []
+        if self.functions:
+            out.append("Functions (by self time):")
+            out.append(f"{'calls':>9} {'cumul ms':>10} {'self ms':>10}  function")
+            for name, line, entry in self.function_rows()[:limit]:
+                where = f"{name} (line {line})" if line is not None else name
+                out.append(format_row(entry, where))
+            out.append("")
+        out.append("Lines (by self time):")
+        out.append(f"{'calls':>9} {'cumul ms':>10} {'self ms':>10}  line")
+        for line, entry in self.line_rows()[:limit]:
+            out.append(format_row(entry, f"{line:>4}  {self.source(line)}"))
+        return "\n".join(out)
+
+    def to_json(self):
+        functions = [
+            dict(name=name, line=line, **entry_fields(entry))
+            for name, line, entry in self.function_rows()
+        ]
+        lines = [
+            dict(line=line, source=self.source(line), **entry_fields(entry))
+            for line, entry in self.line_rows()
+        ]
+        return {"functions": functions, "lines": lines}
+
+    def write_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+
+def format_row(entry, label):
+    cumulative = entry.cumulative * 1000
+    self_time = entry.self_time * 1000
+    return f"{entry.calls:>9} {cumulative:>10.3f} {self_time:>10.3f}  {label}"
+
+
+def entry_fields(entry):
+    # Times in seconds
+    return {
+        "calls": entry.calls,
+        "cumulative": entry.cumulative,
+        "self": entry.self_time,
+    }
@@ -0,0 +1,115 @@
+import itertools
+import math
+import operator
+import numpy as np
+
+
+class Range:
+    """
+    The value of `range(start, stop, step)`: the numbers np.arange returns
+    for the same arguments, without storing them.
+
+    A for-loop iterates it in O(1) memory, yielding the same NumPy scalars
+    as np.arange and so their arithmetic (`1 / 0` is inf). Used in
+    any other way (operators, builtins, slicing, printing) it behaves as
+    the array np.arange would have returned, which is built on first use
+    and kept; indexing a single element does not build it.
+    """
+
+    def __init__(self, start, stop, step):
+        for arg in (start, stop, step):
+            if isinstance(arg, (bool, np.bool_)) or not isinstance(
+                arg, (int, float, np.integer, np.floating)
+            ):
+                raise TypeError(f"range() argument must be a number, not {type(arg).__name__}")
+        self.args = (start, stop, step)
+        self.dtype = np.result_type(start, stop, step)
+        # Same length computation as np.arange; raises for a zero step
+        self.length = max(math.ceil((stop - start) / step), 0)
+        if self.dtype.kind == "f":
+            # np.arange sets the first two elements and fills the others
+            # as first + k * (second - first), not start + k * step
+            self.first = float(start)
+            self.second = float(start + step)
+            self.delta = self.second - self.first
+        else:
+            self.first, self.delta = int(start), int(step)
+            self.second = self.first + self.delta
+        self.array = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        scalar = self.dtype.type
+        if self.dtype.kind != "f":
+            stop = self.first + self.length * self.delta
+            return map(scalar, range(self.first, stop, self.delta))
+        head = [self.first, self.second][: self.length]
+        rest = map(self.first.__add__, map(self.delta.__mul__, range(2, self.length)))
+        return map(scalar, itertools.chain(head, rest))
+
+    def item(self, k):
+        if k == 0:
+            value = self.first
+        elif k == 1:
+            value = self.second
+        else:
+            value = self.first + k * self.delta
+        return self.dtype.type(value)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)) and not isinstance(index, (bool, np.bool_)):
+            k = index + self.length if index < 0 else index
+            if not 0 <= k < self.length:
+                raise IndexError(
+                    f"index {index} is out of bounds for axis 0 with size {self.length}"
+                )
+            return self.item(int(k))
+        return self.__array__()[index]
+
+    def __array__(self, dtype=None, copy=None):
+        if self.array is None:
+            self.array = np.arange(*self.args)
+            # Shared by every later use, so it must never be written to
+            self.array.flags.writeable = False
+        if dtype is not None and dtype != self.array.dtype:
+            return self.array.astype(dtype)
+        if copy:
+            return self.array.copy()
+        return self.array
+
+    def __bool__(self):
+        return bool(self.__array__())
+
+    def __str__(self):
+        return str(self.__array__())
+
+    def __repr__(self):
+        return repr(self.__array__())
+
+
+def _array_method(fn, reflected=False):
+    if reflected:
+        return lambda self, other: fn(other, self.__array__())
+    return lambda self, *other: fn(self.__array__(), *other)
+
+
+# Operators act on the materialized array, as they did on np.arange
+for _name, _fn in [
+    ("add", operator.add),
+    ("sub", operator.sub),
+    ("mul", operator.mul),
+    ("truediv", operator.truediv),
+    ("floordiv", operator.floordiv),
+    ("mod", operator.mod),
+    ("pow", operator.pow),
+    ("matmul", operator.matmul),
+    ("and", operator.and_),
+    ("or", operator.or_),
+]:
+    setattr(Range, f"__{_name}__", _array_method(_fn))
+    setattr(Range, f"__r{_name}__", _array_method(_fn, reflected=True))
+for _name in ("eq", "ne", "lt", "le", "gt", "ge", "neg", "pos", "abs", "invert"):
+    setattr(Range, f"__{_name}__", _array_method(getattr(operator, _name)))
+Range.__hash__ = None
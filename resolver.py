@@ -0,0 +1,229 @@
+from ast_nodes import *
+from collections import Counter
+
+
+class _Unbound:
+    def __repr__(self):
+        return "<unbound>"
+
+
+# Marks a local slot that has not been assigned yet in the current call
+UNBOUND = _Unbound()
+
+# Scopes a name can be resolved to
+PARAM = "param"  # parameter slot in the current frame; always bound
+LOCAL = "local"  # other slot in the current function's frame
+GLOBAL = "global"  # entry in the global environment (builtins included)
+DYNAMIC = "dynamic"  # local of some caller; walk the active frames
+
+
+def assigned_name(node):
+    """The variable an Assign or AugAssign binds, for `x = ...` and `x[i] = ...` alike."""
+    if isinstance(node.left, Subscript):
+        return node.left.var.name
+    return node.left.name
+
+
+def assigned_names(body):
+    """Names bound directly in a block (not inside nested function bodies)."""
+    names = {}
+
+    def collect(nodes):
+        for node in nodes or []:
+            if isinstance(node, (Assign, AugAssign)):
+                names[assigned_name(node)] = None
+            elif isinstance(node, For):
+                names[node.var] = None
+                collect(node.body)
+            elif isinstance(node, FunctionDef):
+                names[node.name] = None
+            elif isinstance(node, If):
+                collect(node.true_block)
+                collect(node.false_block)
+            elif isinstance(node, While):
+                collect(node.body)
+            elif isinstance(node, Compound):
+                collect(node.children)
+
+    collect(body)
+    return list(names)
+
+
+def function_defs(body):
+    """Every FunctionDef in a block, including nested ones."""
+    for node in body:
+        if isinstance(node, FunctionDef):
+            yield node
+            yield from function_defs(node.body)
+        elif isinstance(node, If):
+            yield from function_defs(node.true_block)
+            yield from function_defs(node.false_block or [])
+        elif isinstance(node, (While, For)):
+            yield from function_defs(node.body)
+        elif isinstance(node, Compound):
+            yield from function_defs(node.children)
+
+
+def binding_counts(nodes):
+    """How many places in a program bind each name, nested functions included."""
+    counts = Counter()
+    for node in nodes or []:
+        if isinstance(node, (Assign, AugAssign)):
+            counts[assigned_name(node)] += 1
+        elif isinstance(node, For):
+            counts[node.var] += 1
+            counts.update(binding_counts(node.body))
+        elif isinstance(node, FunctionDef):
+            counts[node.name] += 1
+            counts.update(node.params)
+            counts.update(binding_counts(node.body))
+        elif isinstance(node, If):
+            counts.update(binding_counts(node.true_block))
+            counts.update(binding_counts(node.false_block))
+        elif isinstance(node, While):
+            counts.update(binding_counts(node.body))
+        elif isinstance(node, Compound):
+            counts.update(binding_counts(node.children))
+    return counts
+
+
+def function_slots(node):
+    """Maps each local of a function to its frame slot; parameters come first."""
+    slots = {}
+    for name in list(node.params) + assigned_names(node.body):
+        slots.setdefault(name, len(slots))
+    return slots
+
+
+class Resolver:
+    """
+    Binds every name in a parsed program to a frame slot or a global entry.
+    Calls check their argument count, so parameter slots are always bound.
+
+    MathPy scoping is dynamic: a function that reads a name it has not bound
+    sees its caller's variable. A name is therefore only resolved straight to
+    the global environment when no function anywhere in the program binds it;
+    otherwise the read is DYNAMIC and walks the active frames. Reads of a
+    LOCAL slot that is still UNBOUND fall back to the same walk.
+
+    Results are stored on the nodes: `scope` and `slot` on Variable,
+    FunctionCall (for the callee), For, FunctionDef and Hoisted (for the
+    bound name), and `slots` on FunctionDef.
+    """
+
+    def resolve(self, nodes):
+        self.function_locals = set()
+        for func in function_defs(nodes):
+            func.slots = function_slots(func)
+            self.function_locals.update(func.slots)
+        self.slots = None
+        self.param_count = 0
+        self.block(nodes)
+        return nodes
+
+    def lookup(self, name):
+        if self.slots is None:
+            return GLOBAL, None
+        if name in self.slots:
+            slot = self.slots[name]
+            return (PARAM if slot < self.param_count else LOCAL), slot
+        if name in self.function_locals:
+            return DYNAMIC, None
+        return GLOBAL, None
+
+    def bind(self, name):
+        if self.slots is None:
+            return GLOBAL, None
+        return LOCAL, self.slots[name]
+
+    def visit(self, node):
+        method = getattr(self, "visit_" + type(node).__name__, None)
+        if method is not None:
+            method(node)
+
+    def block(self, nodes):
+        for node in nodes or []:
+            self.visit(node)
+
+    def visit_Variable(self, node):
+        node.scope, node.slot = self.lookup(node.name)
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        if isinstance(node.left, Subscript):
+            self.visit(node.left)
+        else:
+            node.left.scope, node.left.slot = self.bind(node.left.name)
+
+    def visit_AugAssign(self, node):
+        # The target is read and written in the same place: a slot of the
+        # current function, or a global at top level
+        self.visit(node.right)
+        self.visit(node.left)
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+
+    def visit_FunctionCall(self, node):
+        for arg in node.args:
+            self.visit(arg)
+        node.scope, node.slot = self.lookup(node.name)
+
+    def visit_ListLiteral(self, node):
+        for element in node.elements:
+            self.visit(element)
+
+    visit_SetLiteral = visit_ListLiteral
+
+    def visit_Hoisted(self, node):
+        self.visit(node.expr)
+        node.scope, node.slot = self.bind(node.name)
+
+    def visit_Subscript(self, node):
+        self.visit(node.var)
+        indices = node.index if isinstance(node.index, list) else [node.index]
+        for idx_node in indices:
+            self.visit(idx_node)
+
+    def visit_Slice(self, node):
+        if node.start:
+            self.visit(node.start)
+        if node.end:
+            self.visit(node.end)
+
+    def visit_Compound(self, node):
+        self.block(node.children)
+
+    def visit_If(self, node):
+        self.visit(node.condition)
+        self.block(node.true_block)
+        self.block(node.false_block)
+
+    def visit_While(self, node):
+        self.visit(node.condition)
+        self.block(node.body)
+
+    def visit_For(self, node):
+        self.visit(node.iterable)
+        node.scope, node.slot = self.bind(node.var)
+        self.block(node.body)
+
+    def visit_FunctionDef(self, node):
+        node.scope, node.slot = self.bind(node.name)
+        outer = self.slots, self.param_count
+        self.slots = node.slots
+        self.param_count = len(set(node.params))
+        self.block(node.body)
+        self.slots, self.param_count = outer
+
+    def visit_Return(self, node):
+        if node.expr:
+            self.visit(node.expr)
+
+
+def resolve(nodes):
+    return Resolver().resolve(nodes)
@@ -1,11 +1,24 @@
 import unittest
+import argparse
+import itertools
+import json
 import os
+import subprocess
 import sys
+import tempfile
 from io import StringIO
 from contextlib import redirect_stdout
-from lexer import tokenize
+from unittest import mock
+import numpy as np
+from lexer import TokenArray, generate_tokens, tokenize
 from parser import Parser
-from interpreter import Interpreter
+from interpreter import TIER_THRESHOLD, Interpreter, store_item
+from optimizer import dump, optimize
+from inference import infer
+from profiler import Profiler
+import batch
+from memstats import MemoryTracker
+import astcache
 
 
 class TestExamples(unittest.TestCase):
@@ -15,34 +28,382 @@ class TestExamples(unittest.TestCase):
 
         for filename in os.listdir(examples_dir):
             if filename.endswith(".mpy"):
-                with self.subTest(filename=filename):
-                    # Read the input file
-                    with open(os.path.join(examples_dir, filename), "r") as f:
-                        code = f.read()
-
-                    # Read the expected output
-                    expected_output_file = filename.replace(".mpy", ".txt")
-                    with open(
-                        os.path.join(expected_outputs_dir, expected_output_file), "r"
-                    ) as f:
-                        expected_output = f.read()
-
-                    # Redirect stdout to capture the interpreter output
-                    with StringIO() as buf, redirect_stdout(buf):
-                        # Run the interpreter
-                        try:
-                            tokens = tokenize(code)
-                            parser = Parser(tokens)
-                            ast = parser.parse()
-                            interpreter = Interpreter()
-                            interpreter.interpret(ast)
-                        except Exception as e:
-                            output = f"Error: {e}"
-                        else:
-                            output = buf.getvalue()
-
-                    # Compare the output
-                    self.assertEqual(output.strip(), expected_output.strip())
+                for engine, optimized in itertools.product(
+                    Interpreter.ENGINES, (False, True)
+                ):
+                    with self.subTest(
+                        filename=filename, engine=engine, optimized=optimized
+                    ):
+                        # Read the input file
+                        with open(os.path.join(examples_dir, filename), "r") as f:
+                            code = f.read()
+
+                        # Read the expected output
+                        expected_output_file = filename.replace(".mpy", ".txt")
+                        with open(
+                            os.path.join(expected_outputs_dir, expected_output_file),
+                            "r",
+                        ) as f:
+                            expected_output = f.read()
+
+                        # Redirect stdout to capture the interpreter output
+                        with StringIO() as buf, redirect_stdout(buf):
+                            # Run the interpreter
+                            try:
+                                tokens = tokenize(code)
+                                parser = Parser(tokens)
+                                ast = parser.parse()
+                                if optimized:
+                                    ast = optimize(ast)
+                                interpreter = Interpreter(engine=engine)
+                                interpreter.interpret(ast)
+                            except Exception as e:
+                                output = f"Error: {e}"
+                            else:
+                                output = buf.getvalue()
+
+                        # Compare the output
+                        self.assertEqual(output.strip(), expected_output.strip())
+
+    def test_deep_recursion(self):
+        code = (
+            "def depth(n):\n"
+            "    if n == 0:\n"
+            "        return 0\n"
+            "    end\n"
+            "    return 1 + depth(n - 1)\n"
+            "end\n"
+            "print(depth(100000))\n"
+        )
+        with StringIO() as buf, redirect_stdout(buf):
+            interpreter = Interpreter(engine="vm")
+            interpreter.interpret(Parser(tokenize(code)).parse())
+            output = buf.getvalue()
+        self.assertEqual(output.strip(), "100000")
+
+    def test_ast_cache(self):
+        source = "x = [1, 2] .+ 3\nif x[0] > 1:\n    print(-x)\nend\n"
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "cached.mpy")
+            path = astcache.cache_path(filename)
+            expected = dump(Parser(tokenize(source)).parse())
+            self.assertEqual(dump(astcache.load_cached(filename, source)), expected)
+            self.assertTrue(os.path.exists(path))
+            # The second load must come from the cache, not the parser
+            with mock.patch.object(astcache, "Parser", None):
+                nodes = astcache.load_cached(filename, source)
+            self.assertEqual(dump(nodes), expected)
+            # A changed source or a damaged cache is parsed again
+            changed = source.replace("3", "4")
+            nodes = astcache.load_cached(filename, changed)
+            self.assertEqual(dump(nodes), dump(Parser(tokenize(changed)).parse()))
+            with open(path, "r+b") as f:
+                f.seek(-4, os.SEEK_END)
+                f.truncate()
+            self.assertEqual(dump(astcache.load_cached(filename, changed)), dump(nodes))
+
+    def test_lazy_builtins(self):
+        # A script that never plots must not import matplotlib
+        code = (
+            "import sys\n"
+            "from interpreter import Interpreter\n"
+            "from lexer import tokenize\n"
+            "from parser import Parser\n"
+            "source = 'print(det([[1, 2], [3, 4]]))'\n"
+            "Interpreter().interpret(Parser(tokenize(source)).parse())\n"
+            "print('matplotlib' in sys.modules)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.split(), ["-2.0000000000000004", "False"])
+
+        interpreter = Interpreter()
+        self.assertNotIn("inv", interpreter.global_env.vars)
+        self.assertIs(interpreter.global_env.get("inv"), np.linalg.inv)
+        self.assertIn("inv", interpreter.global_env.vars)
+
+    def test_benchmark_runner(self):
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        runner = [sys.executable, os.path.join(root, "benchmarks", "run.py")]
+        runner += ["--scale", "0.01", "--repeat", "1"]
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            subprocess.run(
+                runner + ["--output", output], capture_output=True, check=True
+            )
+            with open(output) as f:
+                results = json.load(f)
+            self.assertEqual(results["engine"], "tree")
+            loops = results["workloads"]["scalar_loops"]
+            self.assertGreater(loops["statements"], loops["nodes"])
+
+            # Against a baseline ten times faster, every workload regressed
+            for result in results["workloads"].values():
+                for key in ("tokens_per_s", "nodes_per_s", "statements_per_s"):
+                    result[key] *= 10
+            baseline = os.path.join(directory, "baseline.json")
+            with open(baseline, "w") as f:
+                json.dump(results, f)
+            run = subprocess.run(
+                runner + ["--workloads", "recursion", "--baseline", baseline],
+                capture_output=True,
+                text=True,
+            )
+            self.assertEqual(run.returncode, 1)
+            self.assertEqual(run.stdout.count("REGRESSION"), 3)
+
+    def test_batch(self):
+        # print writes to the interpreter's output stream
+        output = StringIO()
+        interpreter = Interpreter(output_stream=output)
+        interpreter.interpret(Parser(tokenize("x = 2\nprint(x + 1)")).parse())
+        self.assertEqual(output.getvalue(), "3\n")
+        interpreter.reset()
+        self.assertNotIn("x", interpreter.global_env.vars)
+
+        scripts = {
+            "a.mpy": "def f(x):\n    return x + 1\nend\nprint(f(1))\n",
+            "b.mpy": "print(1 / 0)\n",
+            # Sees neither f nor x from the scripts before it
+            "c.mpy": "x = 5\nprint(x)\nprint(f(x))\n",
+            "d.mpy": "print(x)\n",
+        }
+        args = argparse.Namespace(
+            engine="tree", memo_capacity=8, cache=False, optimize=True, check=True
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for name, source in scripts.items():
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(source)
+            filenames = batch.expand([directory])
+            self.assertEqual(len(filenames), 4)
+            pattern = os.path.join(directory, "[ab].mpy")
+            self.assertEqual(batch.expand([pattern]), filenames[:2])
+            for jobs in (1, 2):
+                results = list(batch.run_scripts(filenames, args, jobs))
+                names = [os.path.basename(result.filename) for result in results]
+                self.assertEqual(names, list(scripts))
+                outputs = [result.output for result in results]
+                self.assertEqual(outputs, ["2\n", "", "5.0\n", ""])
+                errors = [result.error for result in results]
+                self.assertIsNone(errors[0])
+                self.assertIn("ZeroDivisionError", errors[1])
+                self.assertEqual(errors[2], "NameError: Name f is not defined")
+                self.assertEqual(errors[3], "NameError: Name x is not defined")
+
+    def test_streaming(self):
+        def lines(buf):
+            yield "def double(x):\n"
+            yield "    return 2 * x\n"
+            yield "end\n"
+            yield "print(double(1))\n"
+            yield "\n"
+            yield "v = [1, 2]\n"
+            # print ran as soon as the parser saw where the next statement
+            # starts, long before the end of the script
+            self.assertEqual(buf.getvalue(), "2\n")
+            yield "v[0] = 3\n"
+            yield "print(v[0] + 1)"
+
+        with StringIO() as buf, redirect_stdout(buf):
+            statements = Parser(generate_tokens(lines(buf))).statements()
+            Interpreter().interpret_stream(statements)
+            output = buf.getvalue()
+        self.assertEqual(output.split(), ["2", "4"])
+
+    def test_profiler(self):
+        source = (
+            "def f(n):\n"
+            "    if n < 2:\n"
+            "        return n\n"
+            "    end\n"
+            "    return f(n - 1) + f(n - 2)\n"
+            "end\n"
+            "for i in range(3):\n"
+            "    x = f(5)\n"
+            "end\n"
+        )
+        # Statements keep their positions through the optimizer and the cache
+        nodes = optimize(Parser(tokenize(source)).parse())
+        self.assertEqual([(n.line, n.column) for n in nodes], [(1, 0), (7, 0)])
+        cached = astcache.decode(astcache.encode(nodes))
+        self.assertEqual(nodes[1].body[0].line, cached[1].body[0].line)
+
+        interpreter = Interpreter()
+        limit = sys.getrecursionlimit()
+        profiler = Profiler(source)
+        profiler.attach(interpreter)
+        interpreter.interpret(nodes)
+        self.assertEqual(interpreter.global_env.get("x"), 5)
+        calls = {line: entry.calls for line, entry in profiler.lines.items()}
+        # f(5) makes 15 calls, 8 of which return n
+        self.assertEqual(calls, {1: 1, 7: 1, 8: 3, 2: 45, 3: 24, 5: 21})
+        entry = profiler.functions[("f", 1)]
+        self.assertEqual(entry.calls, 45)
+        # Recursive calls count once towards cumulative time
+        loop = profiler.lines[7]
+        self.assertLessEqual(entry.cumulative, loop.cumulative)
+        self.assertLessEqual(loop.self_time, loop.cumulative)
+        self.assertIn("x = f(5)", profiler.report())
+        self.assertEqual(profiler.to_json()["functions"][0]["name"], "f")
+
+        # Detaching restores the interpreter and the recursion limit
+        profiler.detach()
+        self.assertEqual(sys.getrecursionlimit(), limit)
+        self.assertEqual(interpreter.tier_threshold, TIER_THRESHOLD)
+        self.assertNotIn("visit", vars(interpreter))
+        self.assertNotIn("call_function", vars(interpreter))
+
+    def test_memory_tracking(self):
+        source = "x = zeros(1000)\ny = x .* 2\nx[0] = 1\nv = [1, 2]\nx = 0\n"
+        interpreter = Interpreter()
+        limit = sys.getrecursionlimit()
+        tracker = MemoryTracker(source)
+        tracker.attach(interpreter)
+        interpreter.interpret(Parser(tokenize(source)).parse())
+        tracker.detach()
+        self.assertNotIn("visit", vars(interpreter))
+        self.assertEqual(sys.getrecursionlimit(), limit)
+        allocated = {line: stats.bytes for line, stats in tracker.lines.items()}
+        # x[0] = 1 updates x in place, the tracker holding no reference to it
+        self.assertEqual(allocated, {1: 8000, 2: 8000, 4: 16})
+        self.assertEqual(tracker.peak, 16016)
+        self.assertEqual(tracker.peak_line, 4)
+        names = sorted(name for name, *_ in tracker.peak_variables)
+        self.assertEqual(names, ["x", "y"])
+        # x = 0 freed the array of line 1
+        self.assertEqual(tracker.resident, 8016)
+        self.assertIn("y = x .* 2", tracker.report())
+
+    def test_compact_tokens(self):
+        source = "def f(x):\n    return -x ^ 2\nend\nv[1] += f(2) .* [1, 2]\n"
+        tokens = tokenize(source)
+        arena = TokenArray(tokens)
+        self.assertEqual(len(arena), len(tokens))
+        for token, copy in zip(tokens, arena):
+            self.assertEqual(repr(token), repr(copy))
+        self.assertEqual(repr(arena[3]), repr(tokens[3]))
+        nodes = Parser(arena).parse()
+        self.assertEqual(dump(nodes), dump(Parser(tokens).parse()))
+        # Tokens and nodes have no per-instance dictionary
+        self.assertFalse(hasattr(tokens[0], "__dict__"))
+        self.assertFalse(hasattr(nodes[0], "__dict__"))
+
+    def test_element_assignment_copy_elision(self):
+        array = np.zeros(3)
+        self.assertIs(store_item(array, 0, 1.0), array)
+        alias = array
+        updated = store_item(array, 1, 2.0)
+        self.assertIsNot(updated, alias)
+        self.assertEqual(alias.tolist(), [1.0, 0.0, 0.0])
+        self.assertEqual(updated.tolist(), [1.0, 2.0, 0.0])
+
+    def test_shape_inference(self):
+        code = (
+            "A = [[1, 2, 3], [4, 5, 6]]\n"
+            "v = A * [1, 2, 3]\n"
+            "def scale(x):\n"
+            "    return x .* 2\n"
+            "end\n"
+            "w = scale(v) .+ linspace(0, 1, 3)\n"
+            "B = A * A\n"
+        )
+        ast = Parser(tokenize(code)).parse()
+        errors = infer(ast)
+        self.assertEqual(
+            errors,
+            [
+                "`.+` cannot combine arrays of shapes (2,) and (3,)",
+                "`*` cannot multiply arrays of shapes (2, 3) and (2, 3): "
+                "3 columns against 2 rows",
+            ],
+        )
+        self.assertEqual(repr(ast[1].right.type), "array(2,)")
+
+    def test_tiered_execution(self):
+        code = (
+            "def twice(x):\n"
+            "    return 2 * x\n"
+            "end\n"
+            "for i in range(0, 60):\n"
+            "    a = twice(i)\n"
+            "    b = twice([i, 1])\n"
+            "end\n"
+            "print(a, b, twice([[[1]]]))\n"
+        )
+        with StringIO() as buf, redirect_stdout(buf):
+            interpreter = Interpreter()
+            interpreter.interpret(Parser(tokenize(code)).parse())
+            output = buf.getvalue()
+        self.assertEqual(output.strip(), "118 [118.   2.] [[[2.]]]")
+        stats = interpreter.tier_stats
+        self.assertEqual((stats.promoted, stats.variants), (1, 2))
+        self.assertEqual(stats.compiled_calls, 22)
+        self.assertEqual(stats.guard_failures, 2)
+
+    def test_vmap_lifting(self):
+        code = (
+            "def f(x):\n"
+            "    y = sqrt(x) + 1\n"
+            "    return y .* y\n"
+            "end\n"
+            "def g(x):\n"
+            "    if x > 1:\n"
+            "        return x\n"
+            "    end\n"
+            "    return 0\n"
+            "end\n"
+            "a = vmap(f, range(0, 1000))\n"
+            "b = vmap(g, range(0, 3))\n"
+        )
+        interpreter = Interpreter()
+        interpreter.interpret(Parser(tokenize(code)).parse())
+        env = interpreter.global_env
+        f, g = env.get("f"), env.get("g")
+        expected = [(np.sqrt(x) + 1) * (np.sqrt(x) + 1) for x in range(1000)]
+        np.testing.assert_array_equal(env.get("a"), expected)
+        np.testing.assert_array_equal(env.get("b"), [0, 0, 2])
+        # f ran once on the whole array, g once per element
+        self.assertIsNotNone(interpreter.lifts[f])
+        self.assertIsNone(interpreter.lifts[g])
+        calls = {func: 0 for func in (f, g)}
+        for (func, _), count in interpreter.call_counts.items():
+            calls[func] += count
+        self.assertEqual(calls, {f: 0, g: 3})
+
+    def test_memoization(self):
+        code = (
+            "memo def fib(n):\n"
+            "    if n < 2:\n"
+            "        return n\n"
+            "    end\n"
+            "    return fib(n - 1) + fib(n - 2)\n"
+            "end\n"
+            "def square(x):\n"
+            "    return x * x\n"
+            "end\n"
+            "a = fib(30)\n"
+            "s = memoize(square, 2)\n"
+            "b = [s(1), s(2), s(1), s(3), s(2)]\n"
+        )
+        for engine in Interpreter.ENGINES:
+            with self.subTest(engine=engine):
+                interpreter = Interpreter(engine=engine, memo_capacity=8)
+                interpreter.interpret(Parser(tokenize(code)).parse())
+                self.assertEqual(interpreter.global_env.get("a"), 832040)
+                np.testing.assert_array_equal(
+                    interpreter.global_env.get("b"), [1, 4, 1, 9, 4]
+                )
+                fib, square = interpreter.memo_tables.values()
+                self.assertEqual((fib.hits, fib.misses), (28, 31))
+                self.assertEqual(fib.evictions, 23)
+                self.assertEqual((square.hits, square.misses), (1, 4))
+                self.assertEqual(square.evictions, 2)
+
+        impure = "memo def f(x):\n    print(x)\n    return x\nend\n"
+        with self.assertRaisesRegex(Exception, "Cannot memoize f: it calls print"):
+            Interpreter().interpret(Parser(tokenize(impure)).parse())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,556 @@
+from ast_nodes import *
+from ranges import Range
+from resolver import binding_counts
+import numpy as np
+
+# Builtins that apply elementwise, by the name Interpreter.setup_builtins
+# registers them under
+UFUNCS = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "exp": np.exp,
+    "ln": np.log,
+    "log10": np.log10,
+    "log2": np.log2,
+    "sqrt": np.sqrt,
+    "abs": np.abs,
+    "ceil": np.ceil,
+    "floor": np.floor,
+}
+
+# Arithmetic operators whose scalar meaning is the elementwise one
+ELEMENTWISE_OPS = {
+    "+": np.add,
+    ".+": np.add,
+    "-": np.subtract,
+    ".-": np.subtract,
+    "*": np.multiply,
+    ".*": np.multiply,
+    "/": np.divide,
+    "./": np.divide,
+    "^": np.power,
+    ".^": np.power,
+}
+
+# The interpreter turns integral float results into Python ints, whose
+# arithmetic is exact; float64 arrays only agree with it below this bound
+EXACT_LIMIT = 2.0**53
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Fallback(Exception):
+    pass
+
+
+class Vectorizer:
+    """
+    Rewrites elementwise `for` loops into whole-array NumPy operations.
+
+    A loop qualifies when its body is a sequence of assignments, each either
+    a reduction `acc = acc + e` / `acc = e + acc` / `acc = acc - e` (or
+    `acc += e` / `acc -= e`), or a scalar temporary `t = e` assigned once
+    and not read before it. Each `e` is built from the loop variable,
+    earlier temporaries, names not bound in the loop, numbers, arithmetic,
+    elementwise builtins such as `sin`, and one-dimensional subscripts
+    `x[...]`. The loop is replaced by a call to the hidden `$vectorized`
+    builtin, which evaluates a plan of the body over the whole iterable, and
+    the original loop is kept as the fallback.
+
+    The fallback runs whenever the plan cannot reproduce the loop exactly:
+    an empty or non-numeric iterable, array-valued inputs, an index out of
+    range, a floating point error, or values beyond EXACT_LIMIT. Reductions
+    are evaluated as running sums, in the same order as the loop.
+
+    Calls to user functions that are defined once, at top level before the
+    loop, may appear in `e` when the function body is a formula: local
+    assignments followed by `return e`. The body is inlined into the plan
+    (see inline).
+    """
+
+    def __init__(self):
+        self.temp_count = 0
+        self.report = []
+        # Top-level functions that loops may inline, and the plans bound to
+        # the parameters and locals of the calls being inlined
+        self.functions = {}
+        self.bindings = {}
+        self.inlining = []
+        self.lifting = False
+
+    def optimize(self, nodes):
+        self.counts = binding_counts(nodes)
+        self.ufuncs = {name for name in UFUNCS if not self.counts[name]}
+        self.block(nodes, top=True)
+        return nodes
+
+    def block(self, nodes, top=False):
+        if not nodes:
+            return
+        for i, node in enumerate(nodes):
+            if isinstance(node, If):
+                self.block(node.true_block)
+                self.block(node.false_block)
+            elif isinstance(node, FunctionDef):
+                self.block(node.body)
+                if top and self.counts[node.name] == 1:
+                    self.functions[node.name] = node
+            elif isinstance(node, While):
+                self.block(node.body)
+            elif isinstance(node, Compound):
+                self.block(node.children)
+            elif isinstance(node, For):
+                try:
+                    replacement = self.vectorize(node)
+                except Unsupported as e:
+                    self.report.append(f"for {node.var}: not vectorized, {e}")
+                    self.block(node.body)
+                    continue
+                nodes[i] = copy_position(replacement, node)
+
+    def vectorize(self, loop):
+        self.changing = set(binding_counts(loop.body)) | {loop.var}
+        self.loop_var = loop.var
+        self.invariants = []
+        self.kinds = []
+        self.temps = {}
+        statements = []
+        accumulators = []
+        targets = []
+        for stmt in loop.body:
+            if not isinstance(stmt, (Assign, AugAssign)):
+                raise Unsupported(f"{type(stmt).__name__} in loop body")
+            if isinstance(stmt.left, Subscript):
+                raise Unsupported(f"assignment to an element of {stmt.left.var.name}")
+            name = stmt.left.name
+            if name == loop.var or name in self.temps or name in accumulators:
+                raise Unsupported(f"{name} is assigned more than once")
+            if isinstance(stmt, AugAssign):
+                reduction = self.compound_reduction(stmt)
+            else:
+                reduction = self.reduction(name, stmt.right)
+            if reduction is not None:
+                op, expr = reduction
+                statements.append(("reduce", op, self.element(expr)))
+                accumulators.append(name)
+            else:
+                expr = self.element(stmt.right)
+                statements.append(("temp", isinstance(stmt.right, BinOp), expr))
+                self.temps[name] = len(self.temps)
+            targets.append(name)
+        if not statements:
+            raise Unsupported("empty loop body")
+
+        plan = ("loop", len(accumulators), tuple(self.kinds), tuple(statements))
+        items = self.new_temp("items")
+        results = self.new_temp("results")
+        arguments = [Constant(plan), Variable(items)]
+        arguments += [Variable(name) for name in accumulators]
+        arguments += [Variable(name) for name in self.invariants]
+        assigns = [
+            Assign(Variable(name), Subscript(Variable(results), [Number(k)]))
+            for k, name in enumerate(targets + [loop.var])
+        ]
+        self.report.append(f"for {loop.var}: vectorized ({', '.join(targets)})")
+        compound = Compound()
+        compound.children = [
+            Assign(Variable(items), loop.iterable),
+            Assign(Variable(results), Constant(())),
+            If(
+                FunctionCall("$vectorizable", [Variable(items)]),
+                [
+                    Assign(
+                        Variable(results), FunctionCall("$vectorized", arguments)
+                    )
+                ],
+            ),
+            If(
+                Variable(results),
+                assigns,
+                [For(loop.var, Variable(items), loop.body)],
+            ),
+        ]
+        return compound
+
+    def new_temp(self, label):
+        name = f"${label}{self.temp_count}"
+        self.temp_count += 1
+        return name
+
+    def reduction(self, name, node):
+        if not isinstance(node, BinOp):
+            return None
+        op = node.op.value
+        is_acc = lambda side: isinstance(side, Variable) and side.name == name
+        if op in ("+", ".+") and is_acc(node.left):
+            return "+", node.right
+        if op in ("+", ".+") and is_acc(node.right):
+            return "+", node.left
+        if op in ("-", ".-") and is_acc(node.left):
+            return "-", node.right
+        return None
+
+    def compound_reduction(self, stmt):
+        op = stmt.op.value
+        if op in ("+", ".+"):
+            return "+", stmt.right
+        if op in ("-", ".-"):
+            return "-", stmt.right
+        raise Unsupported(f"operator {op}=")
+
+    def element(self, node):
+        """The plan of an expression evaluated once per element."""
+        plan = self.expression(node)
+        if not self.depends(plan):
+            raise Unsupported("assignment does not depend on the loop variable")
+        return plan
+
+    def depends(self, plan):
+        if plan[0] in ("item", "temp"):
+            return True
+        return any(isinstance(part, tuple) and self.depends(part) for part in plan)
+
+    def invariant(self, name, kind):
+        if name not in self.invariants:
+            self.invariants.append(name)
+            self.kinds.append(kind)
+        index = self.invariants.index(name)
+        if self.kinds[index] != kind:
+            raise Unsupported(f"{name} is used both as a scalar and as an array")
+        return index
+
+    def expression(self, node):
+        if isinstance(node, Number):
+            return ("const", float(node.value))
+        if isinstance(node, Constant) and type(node.value) in (int, float):
+            return ("const", node.value)
+        if isinstance(node, Variable):
+            if node.name in self.bindings:
+                return self.bindings[node.name]
+            if node.name == self.loop_var:
+                return ("item",)
+            if node.name in self.temps:
+                return ("temp", self.temps[node.name])
+            if node.name in self.changing:
+                raise Unsupported(f"{node.name} changes inside the loop")
+            return ("value", self.invariant(node.name, "scalar"))
+        if isinstance(node, BinOp):
+            if node.op.value not in ELEMENTWISE_OPS:
+                raise Unsupported(f"operator {node.op.value}")
+            return (
+                "op",
+                node.op.value,
+                self.expression(node.left),
+                self.expression(node.right),
+            )
+        if isinstance(node, UnaryOp):
+            op_value = node.op.value if hasattr(node.op, "value") else node.op.type
+            if op_value == "-":
+                return ("neg", self.expression(node.expr))
+            if op_value == "+":
+                return ("pos", self.expression(node.expr))
+            raise Unsupported(f"operator {op_value}")
+        if isinstance(node, FunctionCall):
+            if node.name == "$fuse":
+                return self.unfuse(node.args[0].value, node.args[1:])
+            args = [self.expression(arg) for arg in node.args]
+            if node.name in self.ufuncs and len(args) == 1:
+                if self.lifting:
+                    self.lifted_ufuncs.add(node.name)
+                return ("call", node.name, args[0])
+            if node.name in self.functions:
+                return self.inline(self.functions[node.name], args)
+            raise Unsupported(f"call to {node.name}")
+        if isinstance(node, Subscript):
+            if len(node.index) != 1 or isinstance(node.index[0], Slice):
+                raise Unsupported("subscript is not a single index")
+            name = node.var.name
+            if name in self.changing:
+                raise Unsupported(f"{name} changes inside the loop")
+            return (
+                "gather",
+                self.invariant(name, "array"),
+                self.expression(node.index[0]),
+            )
+        raise Unsupported(f"{type(node).__name__} expression")
+
+    def unfuse(self, plan, leaves):
+        """The plan of an expression the Fuser replaced (see fusion.py)."""
+        kind = plan[0]
+        if kind == "leaf":
+            return self.expression(leaves[plan[1]])
+        if kind == "const":
+            return plan
+        if kind == "op":
+            left = self.unfuse(plan[2], leaves)
+            return ("op", plan[1], left, self.unfuse(plan[3], leaves))
+        if kind in ("neg", "pos"):
+            return (kind, self.unfuse(plan[1], leaves))
+        if self.lifting:
+            self.lifted_ufuncs.add(plan[1])
+        return ("call", plan[1], self.unfuse(plan[2], leaves))
+
+    def inline(self, func, args):
+        """
+        The plan of a call to `func` with arguments whose plans are `args`.
+
+        Scoping is dynamic, so names the body does not bind mean what they
+        mean at the call site; the parameters and locals are added on top
+        of the bindings of the caller, each local once it is assigned.
+        """
+        if func.name in self.inlining:
+            raise Unsupported(f"recursive call to {func.name}")
+        if len(args) != len(func.params) or not func.body:
+            raise Unsupported(f"call to {func.name}")
+        *assigns, result = func.body
+        outer = self.bindings
+        self.bindings = dict(outer, **dict(zip(func.params, args)))
+        self.inlining.append(func.name)
+        try:
+            for stmt in assigns:
+                if not isinstance(stmt, Assign) or isinstance(stmt.left, Subscript):
+                    raise Unsupported(f"{type(stmt).__name__} in {func.name}")
+                plan = self.expression(stmt.right)
+                self.bindings = dict(self.bindings, **{stmt.left.name: plan})
+            if not isinstance(result, Return) or result.expr is None:
+                raise Unsupported(f"{func.name} does not end in a return")
+            return self.expression(result.expr)
+        finally:
+            self.bindings = outer
+            self.inlining.pop()
+
+    def lift(self, func):
+        """The plan of `vmap(func, xs)` evaluated on all of `xs` at once."""
+        if len(func.params) != 1:
+            raise Unsupported(f"{func.name} does not take one argument")
+        self.changing = set()
+        self.loop_var = None
+        self.invariants = []
+        self.kinds = []
+        self.temps = {}
+        # The builtins are looked up where vmap is called, and the plan is
+        # only used if they still are the ufuncs
+        self.ufuncs = set(UFUNCS)
+        self.lifting = True
+        self.lifted_ufuncs = set()
+        expr = self.inline(func, [("item",)])
+        if not self.depends(expr):
+            raise Unsupported(f"{func.name} does not depend on its argument")
+        return (
+            "lift",
+            tuple(self.invariants),
+            tuple(self.kinds),
+            tuple(sorted(self.lifted_ufuncs)),
+            expr,
+            folds(expr),
+        )
+
+
+def lift(func):
+    """
+    The plan vmap uses to apply the user function `func` to a whole array
+    in one pass, or None when its body is not an elementwise formula.
+    """
+    try:
+        return Vectorizer().lift(func)
+    except Unsupported:
+        return None
+
+
+def folds(plan):
+    """Whether the interpreter turns the integral values of `plan` into ints."""
+    kind = plan[0]
+    if kind == "op":
+        return True
+    if kind in ("neg", "pos"):
+        return folds(plan[1])
+    if kind == "call" and plan[1] == "abs":
+        return folds(plan[2])
+    return False
+
+
+# Runtime side, registered as hidden builtins by Interpreter.setup_builtins
+def vectorizable(items):
+    """Whether a loop over `items` may be evaluated as whole arrays."""
+    if isinstance(items, Range):
+        return len(items) > 0
+    return (
+        isinstance(items, np.ndarray)
+        and items.ndim == 1
+        and len(items) > 0
+        and items.dtype.kind in "iuf"
+    )
+
+
+def is_scalar(value):
+    if isinstance(value, (bool, np.bool_)):
+        return False
+    return isinstance(value, (int, float, np.integer, np.floating))
+
+
+def check_exact(values):
+    if np.abs(values).max() >= EXACT_LIMIT:
+        raise Fallback()
+
+
+def normalize(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def evaluate(plan, items, values, temps):
+    kind = plan[0]
+    if kind == "item":
+        return items
+    if kind == "const":
+        return plan[1]
+    if kind == "value":
+        return values[plan[1]]
+    if kind == "temp":
+        return temps[plan[1]]
+    if kind == "op":
+        left = evaluate(plan[2], items, values, temps)
+        right = evaluate(plan[3], items, values, temps)
+        result = ELEMENTWISE_OPS[plan[1]](left, right)
+        if result.dtype.kind in "iu":
+            # Integer arrays wrap around silently; redo the operation in
+            # floating point to see whether it stayed in range
+            left, right = np.asarray(left, float), np.asarray(right, float)
+            check_exact(ELEMENTWISE_OPS[plan[1]](left, right))
+    elif kind == "neg":
+        result = np.negative(evaluate(plan[1], items, values, temps))
+    elif kind == "pos":
+        result = np.positive(evaluate(plan[1], items, values, temps))
+    elif kind == "call":
+        result = UFUNCS[plan[1]](evaluate(plan[2], items, values, temps))
+    elif kind == "gather":
+        array = values[plan[1]]
+        index = np.asarray(evaluate(plan[2], items, values, temps))
+        if index.dtype.kind == "f":
+            if not np.isfinite(index).all():
+                raise Fallback()
+            index = np.trunc(index).astype(np.intp)
+        if index.min() < -len(array) or index.max() >= len(array):
+            raise Fallback()
+        result = array[index]
+    else:
+        raise Exception(f"Unknown vector plan {kind}")
+    check_exact(result)
+    return result
+
+
+def usable(kinds, values):
+    """Whether a plan's invariant inputs have the kinds it was built for."""
+    for kind, value in zip(kinds, values):
+        if kind == "scalar" and not is_scalar(value):
+            return False
+        if kind == "array" and not (
+            isinstance(value, np.ndarray)
+            and value.ndim == 1
+            and value.dtype.kind in "iuf"
+        ):
+            return False
+    return True
+
+
+def vectorized(plan, items, *args):
+    """
+    Runs a loop plan over `items`, returning the final values of the loop's
+    targets followed by the loop variable, or () to run the loop instead.
+    """
+    _, accumulator_count, kinds, statements = plan
+    totals = list(args[:accumulator_count])
+    values = [
+        np.asarray(value) if isinstance(value, Range) else value
+        for value in args[accumulator_count:]
+    ]
+    # The loop variable keeps the value iterating `items` would leave it
+    last_item = items[-1]
+    items = np.asarray(items)
+    if not all(is_scalar(total) and abs(total) < EXACT_LIMIT for total in totals):
+        return ()
+    if not usable(kinds, values):
+        return ()
+    results = []
+    temps = []
+    try:
+        with np.errstate(all="raise"):
+            for statement in statements:
+                if statement[0] == "reduce":
+                    _, op, expr = statement
+                    elements = evaluate(expr, items, values, temps)
+                    running = np.concatenate(([totals.pop(0)], elements))
+                    if op == "-":
+                        running = np.subtract.accumulate(running)
+                    else:
+                        running = np.add.accumulate(running)
+                    check_exact(running)
+                    results.append(normalize(running[-1]))
+                else:
+                    _, is_binop, expr = statement
+                    elements = evaluate(expr, items, values, temps)
+                    temps.append(elements)
+                    last = elements[-1]
+                    results.append(normalize(last) if is_binop else last)
+    except Exception:
+        return ()
+    results.append(last_item)
+    return tuple(results)
+
+
+def lifted(plan, items, lookup):
+    """
+    Evaluates a lift plan over `items`, or returns None when that would not
+    give the array the per-element calls build.
+    """
+    _, names, kinds, ufuncs, expr, fold = plan
+    try:
+        values = [lookup(name) for name in names]
+        if any(lookup(name) is not UFUNCS[name] for name in ufuncs):
+            return None
+    except NameError:
+        return None
+    values = [
+        np.asarray(value) if isinstance(value, Range) else value for value in values
+    ]
+    if not usable(kinds, values):
+        return None
+    items = np.asarray(items)
+    try:
+        with np.errstate(all="raise"):
+            result = evaluate(expr, items, values, [])
+    except Exception:
+        return None
+    if result is items:
+        return items.copy()
+    if fold and result.dtype.kind == "f" and (result == np.trunc(result)).all():
+        # Every call would have returned an int
+        return result.astype(np.int64)
+    return result
+
+
+def vmap(args, plan_of, lookup, call):
+    """
+    `vmap(f, xs)`: the array of `f(x)` for each `x` in `xs`.
+
+    `plan_of(f)` is the lift plan of a user function or None, `lookup`
+    resolves a name where vmap is called and `call(f, x)` makes one call,
+    all in the terms of the engine running the program. The plan is used
+    when it applies to `xs`; otherwise `f` is called once per element.
+    """
+    if len(args) != 2:
+        raise Exception(f"vmap() takes 2 arguments ({len(args)} given)")
+    func, items = args
+    if vectorizable(items):
+        if any(func is ufunc for ufunc in UFUNCS.values()):
+            return func(np.asarray(items))
+        plan = plan_of(func)
+        if plan is not None:
+            result = lifted(plan, items, lookup)
+            if result is not None:
+                return result
+    return np.array([call(func, item) for item in items])
@@ -0,0 +1,796 @@
+from ast_nodes import *
+from interpreter import (
+    KIND_TYPES,
+    ReturnException,
+    binary_operator,
+    check_arity,
+    specialization,
+    specialized_operator,
+    store_item,
+    update_in_place,
+)
+from inference import infer, inferred_kind
+from resolver import DYNAMIC, LOCAL, PARAM, UNBOUND, resolve
+from memo import MISSING
+import builtin_modules
+import memo
+import vectorizer
+from array import array
+import marshal
+import numpy as np
+
+BYTECODE_VERSION = 7
+BYTECODE_MAGIC = b"MPYB" + bytes([BYTECODE_VERSION])
+
+# Each instruction is one unsigned 32-bit word: the low byte holds the opcode
+# and the upper 24 bits its argument.
+OPCODE_BITS = 8
+OPCODE_MASK = (1 << OPCODE_BITS) - 1
+MAX_ARG = (1 << (32 - OPCODE_BITS)) - 1
+
+LOAD_CONST = 0
+LOAD_NAME = 1
+STORE_NAME = 2
+BINARY_OP = 3
+UNARY_POS = 4
+UNARY_NEG = 5
+UNARY_NOT = 6
+POP_TOP = 7
+JUMP = 8
+POP_JUMP_IF_FALSE = 9
+GET_ITER = 10
+FOR_ITER = 11
+BUILD_ARRAY = 12
+BUILD_SET = 13
+BUILD_SLICE = 14
+BUILD_TUPLE = 15
+TO_INDEX = 16
+SUBSCRIPT = 17
+CALL = 18
+CALL_PLOT = 19
+MAKE_FUNCTION = 20
+RETURN_VALUE = 21
+RAISE_RETURN = 22
+LOAD_FAST = 23
+LOAD_LOCAL = 24
+LOAD_DYNAMIC = 25
+STORE_FAST = 26
+DUP_TOP = 27
+JUMP_IF_NOT_NONE = 28
+TAKE_FAST = 29
+TAKE_NAME = 30
+STORE_ITEM = 31
+INPLACE_OP = 32
+CALL_VMAP = 33
+MEMO_STORE = 34
+
+OPCODES = [
+    "LOAD_CONST",
+    "LOAD_NAME",
+    "STORE_NAME",
+    "BINARY_OP",
+    "UNARY_POS",
+    "UNARY_NEG",
+    "UNARY_NOT",
+    "POP_TOP",
+    "JUMP",
+    "POP_JUMP_IF_FALSE",
+    "GET_ITER",
+    "FOR_ITER",
+    "BUILD_ARRAY",
+    "BUILD_SET",
+    "BUILD_SLICE",
+    "BUILD_TUPLE",
+    "TO_INDEX",
+    "SUBSCRIPT",
+    "CALL",
+    "CALL_PLOT",
+    "MAKE_FUNCTION",
+    "RETURN_VALUE",
+    "RAISE_RETURN",
+    "LOAD_FAST",
+    "LOAD_LOCAL",
+    "LOAD_DYNAMIC",
+    "STORE_FAST",
+    "DUP_TOP",
+    "JUMP_IF_NOT_NONE",
+    "TAKE_FAST",
+    "TAKE_NAME",
+    "STORE_ITEM",
+    "INPLACE_OP",
+    "CALL_VMAP",
+    "MEMO_STORE",
+]
+
+# Binary operators are referenced by their index in this table
+BINARY_OPS = [
+    ("OP", "+"),
+    ("OP", "-"),
+    ("OP", "*"),
+    ("OP", "/"),
+    ("OP", "^"),
+    ("OP", "|"),
+    ("OP", "&"),
+    ("EOP", ".+"),
+    ("EOP", ".-"),
+    ("EOP", ".*"),
+    ("EOP", "./"),
+    ("EOP", ".^"),
+    ("COMPARE", "=="),
+    ("COMPARE", "!="),
+    ("COMPARE", "<"),
+    ("COMPARE", ">"),
+    ("COMPARE", "<="),
+    ("COMPARE", ">="),
+    ("and", "and"),
+    ("or", "or"),
+]
+BINARY_OP_INDEX = {op_value: i for i, (_, op_value) in enumerate(BINARY_OPS)}
+
+# Arithmetic operators specialized for the operand kinds inference.py
+# inferred; BINARY_OP numbers them after the generic ones
+SPECIALIZED_BINARY_OPS = [
+    (op_type, op_value, left_kind, right_kind)
+    for op_type, op_value in BINARY_OPS
+    for left_kind in KIND_TYPES
+    for right_kind in KIND_TYPES
+    if specialization(op_value, left_kind, right_kind) is not None
+]
+SPECIALIZED_INDEX = {
+    key[1:]: len(BINARY_OPS) + i for i, key in enumerate(SPECIALIZED_BINARY_OPS)
+}
+
+# CALL packs the function name index (for error messages) and the argument
+# count into one argument; the function itself is on top of the stack
+CALL_ARGC_BITS = 8
+CALL_ARGC_MASK = (1 << CALL_ARGC_BITS) - 1
+
+
+class CodeObject:
+    """
+    A flat instruction stream with its constant, name and function tables.
+    `slots` lists a function's locals in frame order, parameters first,
+    `lift` is the function's vmap plan (see vectorizer.lift), if any, and
+    `memo` whether it was declared with `memo def`.
+    """
+
+    def __init__(self, name="<module>", params=(), slots=(), lift=None, memo=False):
+        self.name = name
+        self.params = tuple(params)
+        self.slots = tuple(slots)
+        self.lift = lift
+        self.memo = memo
+        self.instructions = array("I")
+        self.constants = []
+        self.names = []
+        self.functions = []
+        # Slot lookup for dynamic scoping, and the initial contents of the
+        # non-parameter slots of a new frame
+        self.slot_index = {name: slot for slot, name in enumerate(self.slots)}
+        self.unbound = [UNBOUND] * (len(self.slots) - len(self.params))
+        # Reverse lookups used while compiling; not serialized
+        self.constant_index = {}
+        self.name_index = {}
+
+    def to_tuple(self):
+        return (
+            self.name,
+            self.params,
+            self.slots,
+            self.lift,
+            self.memo,
+            self.instructions.tobytes(),
+            tuple(self.constants),
+            tuple(self.names),
+            tuple(func.to_tuple() for func in self.functions),
+        )
+
+    @classmethod
+    def from_tuple(cls, data):
+        name, params, slots, lift, memoized, instructions, constants, names, functions = (
+            data
+        )
+        code = cls(name, params, slots, lift, memoized)
+        code.instructions.frombytes(instructions)
+        code.constants = list(constants)
+        code.names = list(names)
+        code.functions = [cls.from_tuple(func) for func in functions]
+        return code
+
+    def all_names(self):
+        """The names used by this code and the functions it defines."""
+        names = set(self.names)
+        for func in self.functions:
+            names |= func.all_names()
+        return names
+
+    def disassemble(self, indent=""):
+        lines = [f"{indent}code {self.name}({', '.join(self.params)})"]
+        for pc, word in enumerate(self.instructions):
+            op, arg = word & OPCODE_MASK, word >> OPCODE_BITS
+            detail = ""
+            if op == LOAD_CONST:
+                detail = repr(self.constants[arg])
+            elif op in (LOAD_NAME, STORE_NAME, LOAD_DYNAMIC, TAKE_NAME):
+                detail = self.names[arg]
+            elif op in (LOAD_FAST, LOAD_LOCAL, STORE_FAST, TAKE_FAST):
+                detail = self.slots[arg]
+            elif op == BINARY_OP and arg >= len(BINARY_OPS):
+                _, op_value, left_kind, right_kind = SPECIALIZED_BINARY_OPS[
+                    arg - len(BINARY_OPS)
+                ]
+                detail = f"{op_value} ({left_kind}, {right_kind})"
+            elif op in (BINARY_OP, INPLACE_OP):
+                detail = BINARY_OPS[arg][1]
+            elif op == STORE_ITEM and arg:
+                detail = BINARY_OPS[arg - 1][1]
+            elif op == CALL:
+                detail = f"{self.names[arg >> CALL_ARGC_BITS]}/{arg & CALL_ARGC_MASK}"
+            lines.append(f"{indent}  {pc:4d} {OPCODES[op]:<18} {arg:<6} {detail}")
+        for func in self.functions:
+            lines.append(func.disassemble(indent + "  "))
+        return "\n".join(lines)
+
+
+# The code of the frame a memoized function returns into, which caches the
+# result; its `fast` holds the function's MemoTable and the call's key
+MEMO_RETURN = CodeObject("<memo>")
+MEMO_RETURN.instructions.extend([MEMO_STORE, RETURN_VALUE])
+
+
+class Function:
+    """
+    A user-defined function as seen by the VM; `memo` is the MemoTable of a
+    memoized function.
+    """
+
+    def __init__(self, code, memo=None):
+        self.name = code.name
+        self.params = code.params
+        self.code = code
+        self.memo = memo
+
+    def __repr__(self):
+        return f"<function {self.name}>"
+
+
+class BytecodeCompiler:
+    """Compiles the ast_nodes tree into CodeObjects for the VM."""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def compile_program(self, nodes):
+        resolve(nodes)
+        infer(nodes)
+        memo.check(nodes)
+        code = CodeObject()
+        self.code = code
+        for node in nodes:
+            self.statement(node)
+        self.emit(LOAD_CONST, self.constant(None))
+        self.emit(RETURN_VALUE)
+        return code
+
+    def compile_function(self, node):
+        outer = self.code
+        slots = sorted(node.slots, key=node.slots.get)
+        plan = vectorizer.lift(node)
+        code = self.code = CodeObject(node.name, node.params, slots, plan, node.memo)
+        for stmt in node.body:
+            self.statement(stmt)
+        self.emit(LOAD_CONST, self.constant(None))
+        self.emit(RETURN_VALUE)
+        self.code = outer
+        return code
+
+    def emit(self, op, arg=0):
+        if arg > MAX_ARG:
+            raise Exception(f"Bytecode argument {arg} out of range")
+        self.code.instructions.append((arg << OPCODE_BITS) | op)
+        return len(self.code.instructions) - 1
+
+    def patch(self, pc, target):
+        op = self.code.instructions[pc] & OPCODE_MASK
+        self.code.instructions[pc] = (target << OPCODE_BITS) | op
+
+    def here(self):
+        return len(self.code.instructions)
+
+    def constant(self, value):
+        key = (type(value), repr(value))
+        index = self.code.constant_index.get(key)
+        if index is None:
+            index = self.code.constant_index[key] = len(self.code.constants)
+            self.code.constants.append(value)
+        return index
+
+    def name(self, name):
+        index = self.code.name_index.get(name)
+        if index is None:
+            index = self.code.name_index[name] = len(self.code.names)
+            self.code.names.append(name)
+        return index
+
+    def load(self, name, scope, slot):
+        if scope == PARAM:
+            self.emit(LOAD_FAST, slot)
+        elif scope == LOCAL:
+            self.emit(LOAD_LOCAL, slot)
+        elif scope == DYNAMIC:
+            self.emit(LOAD_DYNAMIC, self.name(name))
+        else:
+            self.emit(LOAD_NAME, self.name(name))
+
+    def take(self, name, scope, slot):
+        """Loads a variable about to be reassigned and clears it."""
+        if scope in (LOCAL, PARAM):
+            self.emit(TAKE_FAST, slot)
+        else:
+            self.emit(TAKE_NAME, self.name(name))
+
+    def store(self, name, scope, slot):
+        if scope in (LOCAL, PARAM):
+            self.emit(STORE_FAST, slot)
+        else:
+            self.emit(STORE_NAME, self.name(name))
+
+    # Statements
+    def statement(self, node):
+        method = getattr(self, "stmt_" + type(node).__name__, None)
+        if method is None:
+            self.expression(node)
+            self.emit(POP_TOP)
+        else:
+            method(node)
+
+    def block(self, nodes):
+        for node in nodes or []:
+            self.statement(node)
+
+    def stmt_Assign(self, node):
+        self.expression(node.right)
+        if isinstance(node.left, Subscript):
+            self.assign_item(node.left)
+            return
+        self.store(node.left.name, node.left.scope, node.left.slot)
+
+    def stmt_AugAssign(self, node):
+        self.expression(node.right)
+        op_value = node.op.value
+        if op_value not in BINARY_OP_INDEX:
+            raise Exception(f"Unsupported operator {op_value}")
+        if isinstance(node.left, Subscript):
+            self.assign_item(node.left, BINARY_OP_INDEX[op_value] + 1)
+            return
+        var = node.left
+        self.take(var.name, var.scope, var.slot)
+        self.emit(INPLACE_OP, BINARY_OP_INDEX[op_value])
+        self.store(var.name, var.scope, var.slot)
+
+    def assign_item(self, target, op=0):
+        """
+        Stores the value on top of the stack into an element of a variable;
+        `op` is 0 for `=`, or one more than the BINARY_OPS index for `op=`.
+        """
+        self.subscript_index(target)
+        var = target.var
+        self.take(var.name, var.scope, var.slot)
+        self.emit(STORE_ITEM, op)
+        self.store(var.name, var.scope, var.slot)
+
+    def stmt_Compound(self, node):
+        self.block(node.children)
+
+    def stmt_NoOp(self, node):
+        pass
+
+    def stmt_If(self, node):
+        self.expression(node.condition)
+        to_else = self.emit(POP_JUMP_IF_FALSE)
+        self.block(node.true_block)
+        if node.false_block:
+            to_end = self.emit(JUMP)
+            self.patch(to_else, self.here())
+            self.block(node.false_block)
+            self.patch(to_end, self.here())
+        else:
+            self.patch(to_else, self.here())
+
+    def stmt_While(self, node):
+        start = self.here()
+        self.expression(node.condition)
+        to_end = self.emit(POP_JUMP_IF_FALSE)
+        self.block(node.body)
+        self.emit(JUMP, start)
+        self.patch(to_end, self.here())
+
+    def stmt_For(self, node):
+        self.expression(node.iterable)
+        self.emit(GET_ITER)
+        start = self.emit(FOR_ITER)
+        self.store(node.var, node.scope, node.slot)
+        self.block(node.body)
+        self.emit(JUMP, start)
+        self.patch(start, self.here())
+
+    def stmt_FunctionDef(self, node):
+        self.code.functions.append(self.compile_function(node))
+        self.emit(MAKE_FUNCTION, len(self.code.functions) - 1)
+        self.store(node.name, node.scope, node.slot)
+
+    def stmt_Return(self, node):
+        if node.expr:
+            self.expression(node.expr)
+        else:
+            self.emit(LOAD_CONST, self.constant(None))
+        self.emit(RETURN_VALUE if self.code.name != "<module>" else RAISE_RETURN)
+
+    # Expressions
+    def expression(self, node):
+        method = getattr(self, "expr_" + type(node).__name__, None)
+        if method is None:
+            raise Exception(f"No bytecode for {type(node).__name__}")
+        method(node)
+
+    def expr_Number(self, node):
+        value = self.interpreter.visit_Number(node, None)
+        self.emit(LOAD_CONST, self.constant(value))
+
+    def expr_String(self, node):
+        self.emit(LOAD_CONST, self.constant(node.value))
+
+    expr_Constant = expr_String
+
+    def expr_Variable(self, node):
+        self.load(node.name, node.scope, node.slot)
+
+    def expr_Hoisted(self, node):
+        self.load(node.name, node.scope, node.slot)
+        cached = self.emit(JUMP_IF_NOT_NONE)
+        self.expression(node.expr)
+        self.emit(DUP_TOP)
+        self.store(node.name, node.scope, node.slot)
+        self.patch(cached, self.here())
+
+    def expr_BinOp(self, node):
+        self.expression(node.left)
+        self.expression(node.right)
+        op_value = node.op.value
+        if op_value not in BINARY_OP_INDEX:
+            raise Exception(f"Unsupported operator {op_value}")
+        key = (op_value, inferred_kind(node.left), inferred_kind(node.right))
+        self.emit(BINARY_OP, SPECIALIZED_INDEX.get(key, BINARY_OP_INDEX[op_value]))
+
+    def expr_UnaryOp(self, node):
+        self.expression(node.expr)
+        op_value = node.op.value if hasattr(node.op, "value") else node.op.type
+        if op_value == "+":
+            self.emit(UNARY_POS)
+        elif op_value == "-":
+            self.emit(UNARY_NEG)
+        elif op_value == "not":
+            self.emit(UNARY_NOT)
+        else:
+            raise Exception(f"Unsupported unary operator {op_value}")
+
+    def expr_FunctionCall(self, node):
+        for arg in node.args:
+            self.expression(arg)
+        argc = len(node.args)
+        if node.name == "plot":
+            self.emit(CALL_PLOT, argc)
+            return
+        if node.name == "vmap":
+            self.emit(CALL_VMAP, argc)
+            return
+        if argc >= 1 << CALL_ARGC_BITS:
+            raise Exception(f"Too many arguments in call to {node.name}")
+        self.load(node.name, node.scope, node.slot)
+        self.emit(CALL, (self.name(node.name) << CALL_ARGC_BITS) | argc)
+
+    def expr_ListLiteral(self, node):
+        for element in node.elements:
+            self.expression(element)
+        self.emit(BUILD_ARRAY, len(node.elements))
+
+    def expr_SetLiteral(self, node):
+        for element in node.elements:
+            self.expression(element)
+        self.emit(BUILD_SET, len(node.elements))
+
+    def expr_Subscript(self, node):
+        self.expression(node.var)
+        self.subscript_index(node)
+        self.emit(SUBSCRIPT)
+
+    def subscript_index(self, node):
+        indices = node.index if isinstance(node.index, list) else [node.index]
+        for idx_node in indices:
+            if isinstance(idx_node, Slice):
+                self.slice_bound(idx_node.start)
+                self.slice_bound(idx_node.end)
+                self.emit(BUILD_SLICE)
+            else:
+                self.expression(idx_node)
+                self.emit(TO_INDEX)
+        if len(indices) != 1:
+            self.emit(BUILD_TUPLE, len(indices))
+
+    def slice_bound(self, node):
+        if node:
+            self.expression(node)
+            self.emit(TO_INDEX)
+        else:
+            self.emit(LOAD_CONST, self.constant(None))
+
+
+class VM:
+    """
+    A stack machine executing CodeObjects against the interpreter's globals.
+
+    MathPy calls do not recurse in Python: CALL saves the caller's frame on
+    an explicit frame stack and switches to the callee's code, and
+    RETURN_VALUE pops it again, so recursion depth is bounded by memory.
+    A frame is a tuple (code, pc, stack, fast) where `fast` holds the
+    function's local slots. Because scoping is dynamic, the frame stack is
+    also the chain searched by names that are not bound locally.
+
+    Element assignment updates an array in place only when nothing else
+    references it (see store_item), so run() takes care not to leave
+    values behind in its own local variables.
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.global_env.vars
+        self.binary_ops = [
+            binary_operator(interpreter, op_type, op_value)
+            for op_type, op_value in BINARY_OPS
+        ] + [specialized_operator(interpreter, *key) for key in SPECIALIZED_BINARY_OPS]
+
+    def execute(self, code):
+        self.interpreter.load_builtins(code.all_names())
+        return self.run(code)
+
+    def lookup(self, name, frames):
+        """Resolves a name through the suspended callers, then the globals."""
+        for code, _, _, fast in reversed(frames):
+            slot = code.slot_index.get(name)
+            if slot is not None and fast[slot] is not UNBOUND:
+                return fast[slot]
+        try:
+            return self.globals[name]
+        except KeyError:
+            raise NameError(f"Name {name} is not defined")
+
+    def run(self, code, fast=None, callers=()):
+        """
+        Runs `code` to its RETURN_VALUE. A function's code is run with its
+        local slots in `fast` and the frames of its callers in `callers`.
+        """
+        instructions = code.instructions
+        constants = code.constants
+        names = code.names
+        binary_ops = self.binary_ops
+        globals_ = self.globals
+        frames = list(callers)
+        base = len(frames)
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            word = instructions[pc]
+            op = word & OPCODE_MASK
+            arg = word >> OPCODE_BITS
+            pc += 1
+            if op == LOAD_FAST:
+                push(fast[arg])
+            elif op == LOAD_CONST:
+                push(constants[arg])
+            elif op == BINARY_OP:
+                # Operands are read left to right, so stack[-2] is taken
+                # before pop() removes the right operand from the top
+                stack[-1] = binary_ops[arg](stack[-2], pop())
+            elif op == LOAD_LOCAL:
+                push(fast[arg])
+                if stack[-1] is UNBOUND:
+                    stack[-1] = self.lookup(code.slots[arg], frames)
+            elif op == STORE_FAST:
+                fast[arg] = pop()
+            elif op == LOAD_NAME:
+                try:
+                    push(globals_[names[arg]])
+                except KeyError:
+                    raise NameError(f"Name {names[arg]} is not defined")
+            elif op == STORE_NAME:
+                globals_[names[arg]] = pop()
+            elif op == POP_JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == FOR_ITER:
+                try:
+                    push(next(stack[-1]))
+                except StopIteration:
+                    pop()
+                    pc = arg
+            elif op == CALL:
+                func = pop()
+                argc = arg & CALL_ARGC_MASK
+                if argc:
+                    args = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    args = []
+                if type(func) is Function:
+                    callee = func.code
+                    if argc != len(callee.params):
+                        check_arity(names[arg >> CALL_ARGC_BITS], callee.params, args)
+                    if func.memo is not None:
+                        key, value = func.memo.lookup(args)
+                        if value is not MISSING:
+                            push(value)
+                            args = None
+                            continue
+                        frames.append((code, pc, stack, fast))
+                        code, pc, stack, fast = MEMO_RETURN, 0, [], (func.memo, key)
+                    frames.append((code, pc, stack, fast))
+                    code = callee
+                    instructions = code.instructions
+                    constants = code.constants
+                    names = code.names
+                    fast = args + code.unbound
+                    args = None
+                    stack = []
+                    push = stack.append
+                    pop = stack.pop
+                    pc = 0
+                elif callable(func):
+                    push(func(*args))
+                    args = None
+                else:
+                    raise Exception(f"{names[arg >> CALL_ARGC_BITS]} is not a function")
+            elif op == RETURN_VALUE:
+                value = pop()
+                if len(frames) == base:
+                    return value
+                code, pc, stack, fast = frames.pop()
+                instructions = code.instructions
+                constants = code.constants
+                names = code.names
+                push = stack.append
+                pop = stack.pop
+                push(value)
+            elif op == LOAD_DYNAMIC:
+                push(self.lookup(names[arg], frames))
+            elif op == POP_TOP:
+                pop()
+            elif op == TO_INDEX:
+                if isinstance(stack[-1], float):
+                    stack[-1] = int(stack[-1])
+            elif op == SUBSCRIPT:
+                index = pop()
+                try:
+                    stack[-1] = stack[-1][index]
+                except (IndexError, TypeError) as e:
+                    raise Exception(f"Subscript error: {e}")
+            elif op == UNARY_NEG:
+                stack[-1] = -stack[-1]
+            elif op == UNARY_NOT:
+                stack[-1] = not stack[-1]
+            elif op == UNARY_POS:
+                stack[-1] = +stack[-1]
+            elif op == GET_ITER:
+                stack[-1] = iter(stack[-1])
+            elif op == BUILD_ARRAY:
+                elements = stack[len(stack) - arg :]
+                del stack[len(stack) - arg :]
+                push(np.array(elements))
+            elif op == BUILD_SET:
+                elements = stack[len(stack) - arg :]
+                del stack[len(stack) - arg :]
+                push(set(elements))
+            elif op == BUILD_SLICE:
+                end = pop()
+                stack[-1] = slice(stack[-1], end)
+            elif op == BUILD_TUPLE:
+                elements = tuple(stack[len(stack) - arg :])
+                del stack[len(stack) - arg :]
+                push(elements)
+            elif op == MAKE_FUNCTION:
+                push(self.make_function(code.functions[arg]))
+            elif op == CALL_PLOT:
+                args = stack[len(stack) - arg :]
+                del stack[len(stack) - arg :]
+                push(builtin_modules.plot(args))
+            elif op == CALL_VMAP:
+                args = stack[len(stack) - arg :]
+                del stack[len(stack) - arg :]
+                push(self.vmap(args, frames + [(code, pc, stack, fast)]))
+            elif op == JUMP_IF_NOT_NONE:
+                if stack[-1] is not None:
+                    pc = arg
+                else:
+                    pop()
+            elif op == DUP_TOP:
+                push(stack[-1])
+            elif op == TAKE_FAST:
+                push(fast[arg])
+                if stack[-1] is UNBOUND:
+                    stack[-1] = self.lookup(code.slots[arg], frames)
+                else:
+                    fast[arg] = UNBOUND
+            elif op == TAKE_NAME:
+                try:
+                    push(globals_.pop(names[arg]))
+                except KeyError:
+                    raise NameError(f"Name {names[arg]} is not defined")
+            elif op == STORE_ITEM:
+                # The container is popped first, so that the stack no
+                # longer references it while it is updated
+                container = pop()
+                index = pop()
+                apply = binary_ops[arg - 1] if arg else None
+                push(store_item(container, index, pop(), apply))
+            elif op == INPLACE_OP:
+                container = pop()
+                op_value = BINARY_OPS[arg][1]
+                push(update_in_place(container, pop(), op_value, binary_ops[arg]))
+            elif op == RAISE_RETURN:
+                raise ReturnException(pop())
+            elif op == MEMO_STORE:
+                fast[0].store(fast[1], stack[-1])
+            else:
+                raise Exception(f"Unknown opcode {op}")
+
+    def make_function(self, code):
+        if code.memo:
+            return Function(code, self.interpreter.memo_table(code, code.name))
+        return Function(code)
+
+    def vmap(self, args, frames):
+        def call(func, item):
+            if type(func) is Function:
+                check_arity(func.name, func.params, [item])
+                if func.memo is None:
+                    return self.run(func.code, [item] + func.code.unbound, frames)
+                key, value = func.memo.lookup([item])
+                if value is MISSING:
+                    value = self.run(func.code, [item] + func.code.unbound, frames)
+                    func.memo.store(key, value)
+                return value
+            elif callable(func):
+                return func(item)
+            else:
+                raise Exception("vmap() argument is not a function")
+
+        plan_of = lambda func: func.code.lift if type(func) is Function else None
+        lookup = lambda name: self.lookup(name, frames)
+        return vectorizer.vmap(args, plan_of, lookup, call)
+
+
+def compile_program(interpreter, nodes):
+    return BytecodeCompiler(interpreter).compile_program(nodes)
+
+
+def dumps(code):
+    return BYTECODE_MAGIC + marshal.dumps(code.to_tuple())
+
+
+def loads(data):
+    if data[: len(BYTECODE_MAGIC)] != BYTECODE_MAGIC:
+        raise ValueError("Not a MathPy bytecode file or incompatible version")
+    return CodeObject.from_tuple(marshal.loads(data[len(BYTECODE_MAGIC) :]))
+
+
+def dump(code, filename):
+    with open(filename, "wb") as f:
+        f.write(dumps(code))
+
+
+def load(filename):
+    with open(filename, "rb") as f:
+        return loads(f.read())